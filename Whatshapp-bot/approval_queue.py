@@ -0,0 +1,156 @@
+# approval_queue.py
+"""
+The manual-approval queue, addressed by stable item IDs.
+
+Items used to be addressed by their list index, so two operators (or a new
+reply arriving mid-click) could shift indices and approve the wrong message.
+Every pending item now carries an "id" and a monotonically increasing "seq"
+(used for ordering and pagination), and the queue keeps them in an ordered
+index so lookups and removals don't scan or shift a list.
+
+memory.json still stores the queue as the plain "pending_for_approval" list.
+
+Items the model couldn't answer ("[NEED_INFO: topic]") are also indexed by
+that knowledge-gap topic, so filling a gap finds the replies waiting on it
+without scanning the whole queue.
+"""
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from storage import ts_epoch
+
+# placeholder reply for a missing fact, as written by reply() (older items only have this)
+MISSING_INFO_RE = re.compile(r"Missing info: (.*?)\)?\s*$|\[NEED_INFO:\s*([^\]]*)\]")
+
+
+def normalize_gap(topic):
+    """Normalized knowledge-gap topic, so "Fav food " and "fav food" match."""
+    return " ".join((topic or "").split()).casefold()
+
+
+def blocking_gap(item):
+    """The knowledge-gap topic a pending item is waiting on, or None."""
+    if "gap" in item:
+        return item["gap"]
+    m = MISSING_INFO_RE.search(item.get("reply") or "")
+    if m:
+        return m.group(1) if m.group(1) is not None else m.group(2)
+    return None
+
+
+class PendingQueue:
+    def __init__(self, items=None, id_prefix=""):
+        self._items = OrderedDict()     # id -> item, oldest first
+        self._seq = 0
+        self._by_gap = {}               # gap key -> ids of items blocked on that gap
+        self.id_prefix = id_prefix      # e.g. "s2-" so a shard router can find the owner
+        self.lock = threading.RLock()   # held by callers for multi-step transactions
+        for item in items or []:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self.items())
+
+    def items(self):
+        with self.lock:
+            return list(self._items.values())
+
+    def to_list(self):
+        """Plain list for persistence."""
+        return self.items()
+
+    def add(self, item):
+        """Enqueue an item, giving it an id/seq if it doesn't have one yet."""
+        with self.lock:
+            item.setdefault("id", self.id_prefix + uuid.uuid4().hex)
+            item.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+            self._seq = max(self._seq + 1, item.get("seq", 0))
+            item["seq"] = self._seq
+            self._items[item["id"]] = item
+            self._index(item)
+            return item
+
+    def _index(self, item):
+        gap = blocking_gap(item)
+        if gap is not None:
+            self._by_gap.setdefault(normalize_gap(gap), set()).add(item["id"])
+
+    def _unindex(self, item):
+        gap = blocking_gap(item)
+        if gap is None:
+            return
+        ids = self._by_gap.get(normalize_gap(gap))
+        if ids is not None:
+            ids.discard(item["id"])
+            if not ids:
+                del self._by_gap[normalize_gap(gap)]
+
+    def get(self, item_id):
+        return self._items.get(item_id)
+
+    def pop(self, item_id):
+        with self.lock:
+            item = self._items.pop(item_id, None)
+            if item is not None:
+                self._unindex(item)
+            return item
+
+    def pop_many(self, item_ids):
+        """Remove several items at once; returns them in queue order."""
+        with self.lock:
+            wanted = set(item_ids)
+            items = [self._items.pop(i) for i in list(self._items) if i in wanted]
+            for item in items:
+                self._unindex(item)
+            return items
+
+    def update_many(self, changes):
+        """
+        Apply {id: {field: value}} in one step. Each changed item is swapped
+        for an updated copy, so readers see either the old or the new reply,
+        never a half-written one. Items no longer queued are skipped; returns
+        the ids that were updated.
+        """
+        with self.lock:
+            done = []
+            for item_id, fields in changes.items():
+                old = self._items.get(item_id)
+                if old is None:
+                    continue
+                new = dict(old, **fields)
+                self._unindex(old)
+                self._items[item_id] = new
+                self._index(new)
+                done.append(item_id)
+            return done
+
+    # ─── Knowledge gaps ─────────────────────────────────────────────
+    def blocked_on(self, topic):
+        """Items waiting on the knowledge-gap topic, in queue order."""
+        with self.lock:
+            items = [self._items[i] for i in self._by_gap.get(normalize_gap(topic), ())]
+        return sorted(items, key=lambda it: it["seq"])
+
+    # ─── Selectors for bulk operations ──────────────────────────────
+    def ids_for_jid(self, jid):
+        with self.lock:
+            return [i for i, it in self._items.items() if it.get("jid") == jid]
+
+    def ids_older_than(self, cutoff_epoch):
+        with self.lock:
+            out = []
+            for i, it in self._items.items():
+                created = ts_epoch(it.get("created_at"))
+                if created is not None and created < cutoff_epoch:
+                    out.append(i)
+            return out
+
+    def remove_where(self, predicate):
+        with self.lock:
+            return self.pop_many([i for i, it in self._items.items() if predicate(it)])
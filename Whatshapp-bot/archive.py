@@ -0,0 +1,112 @@
+# archive.py
+"""
+Cold tier for chat history.
+
+Only a bounded hot window of each contact's history stays in memory (see
+ContactStore). Older messages are spilled here as compressed, append-only
+segments:
+
+    memory_archive/<contact_key>/seg-000001.jsonl.gz   one message per line
+    memory_archive/<contact_key>/index.json            segment index
+
+Segments are never rewritten, only added, so readers can stream them while
+new ones are written.
+"""
+import gzip
+import json
+import os
+import shutil
+import threading
+
+from metrics import metrics
+from storage import contact_key, write_json_atomic, ts_epoch
+
+
+class HistoryArchive:
+    def __init__(self, root: str):
+        self.root = root
+        self._indexes = {}          # jid -> index dict (cached)
+        self._lock = threading.RLock()
+
+    def _dir(self, jid):
+        return os.path.join(self.root, contact_key(jid))
+
+    def _index(self, jid):
+        with self._lock:
+            idx = self._indexes.get(jid)
+            if idx is None:
+                path = os.path.join(self._dir(jid), "index.json")
+                if os.path.exists(path):
+                    with open(path, encoding="utf-8") as f:
+                        idx = json.load(f)
+                else:
+                    idx = {"jid": jid, "archived": 0, "segments": []}
+                self._indexes[jid] = idx
+            return idx
+
+    def count(self, jid):
+        """How many messages of jid live in the cold tier."""
+        return self._index(jid)["archived"]
+
+    def segments(self, jid):
+        return list(self._index(jid)["segments"])
+
+    # ─── Writing ────────────────────────────────────────────────────
+    def append_segment(self, jid, messages):
+        """Write `messages` (oldest first) as a new segment."""
+        if not messages:
+            return
+        with self._lock:
+            idx = self._index(jid)
+            folder = self._dir(jid)
+            os.makedirs(folder, exist_ok=True)
+            name = f"seg-{len(idx['segments']) + 1:06d}.jsonl.gz"
+            tmp = os.path.join(folder, name + ".tmp")
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                for m in messages:
+                    f.write(json.dumps(m, ensure_ascii=False))
+                    f.write("\n")
+            metrics.inc("persist_bytes_total", os.path.getsize(tmp), target="archive_segment")
+            metrics.inc("persist_writes_total", target="archive_segment")
+            os.replace(tmp, os.path.join(folder, name))
+
+            epochs = [e for e in (ts_epoch(m.get("ts")) for m in messages) if e is not None]
+            idx["segments"].append({
+                "file": name,
+                "start": idx["archived"],
+                "count": len(messages),
+                "first_ts": min(epochs) if epochs else None,
+                "last_ts": max(epochs) if epochs else None,
+            })
+            idx["archived"] += len(messages)
+            write_json_atomic(os.path.join(folder, "index.json"), idx, target="archive_index", ensure_ascii=False)
+
+    def drop(self, jid):
+        """Forget a contact's archive entirely (contact removed)."""
+        with self._lock:
+            self._indexes.pop(jid, None)
+            shutil.rmtree(self._dir(jid), ignore_errors=True)
+
+    # ─── Reading ────────────────────────────────────────────────────
+    def iter_segment(self, jid, seg):
+        with gzip.open(os.path.join(self._dir(jid), seg["file"]), "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_messages(self, jid, start=0, since=None):
+        """
+        Stream archived messages from absolute position `start`, yielding
+        (position, message). Segments entirely older than `since` (epoch) are
+        skipped without being opened.
+        """
+        for seg in self.segments(jid):
+            end = seg["start"] + seg["count"]
+            if end <= start:
+                continue
+            if since is not None and seg.get("last_ts") is not None and seg["last_ts"] < since:
+                continue
+            for offset, m in enumerate(self.iter_segment(jid, seg)):
+                pos = seg["start"] + offset
+                if pos >= start:
+                    yield pos, m
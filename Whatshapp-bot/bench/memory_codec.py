@@ -0,0 +1,132 @@
+# bench/memory_codec.py
+"""
+Serialization benchmark for the persisted memory: encode time, decode time
+and file size of every codec.py format on synthetic memories of increasing
+size (the global sections plus every contact's history and profile, i.e.
+memory.json and memory_contacts/ together).
+
+"json (stdlib)" is the compact JSON encoder without orjson, and "json-pretty"
+is how files were written before codec.py. "marshal" is here for comparison
+only (codec.py doesn't offer it, see there). Formats whose package isn't
+installed are skipped.
+
+    python bench/memory_codec.py                     # 1k .. 1M messages
+    python bench/memory_codec.py --sizes 10000 200000 --repeat 5
+"""
+import argparse
+import marshal
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import codec  # noqa: E402
+
+SAMPLES = [
+    "hola! como estas?",
+    "I'm good, just got back from work 😊",
+    "jaja ok",
+    "did u eat yet today?",
+    "Tomorrow I'm going to the lake with my sister, want to come along?",
+    "gm",
+    "That sounds amazing, send me pics when you're there",
+]
+MESSAGES_PER_CONTACT = 2000
+
+
+def synthetic_memory(n):
+    """A memory with n messages in total, spread over contacts of MESSAGES_PER_CONTACT."""
+    t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    contacts = max(1, n // MESSAGES_PER_CONTACT)
+    memory = {
+        "my_profile": [f"fact {i}: something about me" for i in range(40)],
+        "personality_profile": ["warm", "playful", "curious"],
+        "allowed_contacts": [],
+        "settings": {"timezone": "America/Guatemala", "approval_enabled": True, "self_labels": ["You", "Julio"]},
+        "images": [f"IMG_{i:04}.jpg" for i in range(30)],
+        "chat_history": {},
+        "person_profiles": {},
+        "contacts_info": {},
+    }
+    i = 0
+    for c in range(contacts):
+        jid = f"1555{c:07}@c.us"
+        memory["allowed_contacts"].append({"jid": jid, "name": f"Contact {c}", "enabled": True})
+        count = n // contacts + (1 if c < n % contacts else 0)
+        memory["chat_history"][jid] = [
+            {
+                "role": "user" if k % 2 else "assistant",
+                "content": f"{SAMPLES[(i + k) % len(SAMPLES)]} #{i + k}",
+                "ts": (t0 + timedelta(seconds=37 * (i + k))).isoformat(),
+            }
+            for k in range(count)
+        ]
+        i += count
+        memory["person_profiles"][jid] = {"summary": "Likes hiking and coffee. " * 5, "style": "short, lots of emoji"}
+        memory["contacts_info"][jid] = {"objectives": [], "profile_cursor": count}
+    return memory
+
+
+def best_of(repeat, fn):
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+def variants():
+    """(label, encode, decode, use orjson) for every format available here."""
+    out = []
+    if codec.orjson is not None:
+        out.append(("json (orjson)", lambda m: codec.encode(m, "json"), codec.decode, True))
+    out.append(("json (stdlib)", lambda m: codec.encode(m, "json"), codec.decode, False))
+    out.append(("json-pretty", lambda m: codec.encode(m, "json-pretty"), codec.decode, False))
+    if codec.available("msgpack"):
+        out.append(("msgpack", lambda m: codec.encode(m, "msgpack"), codec.decode, False))
+    out.append(("marshal", marshal.dumps, marshal.loads, False))
+    return out
+
+
+def run(n, repeat):
+    memory = synthetic_memory(n)
+    rows = []
+    orjson = codec.orjson
+    try:
+        for label, encode, decode, fast_json in variants():
+            codec.orjson = orjson if fast_json else None
+            enc, raw = best_of(repeat, lambda: encode(memory))
+            dec, back = best_of(repeat, lambda: decode(raw))
+            assert back == memory, f"{label} did not round-trip"
+            rows.append((label, enc, dec, len(raw)))
+    finally:
+        codec.orjson = orjson
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000],
+                    help="messages per synthetic memory")
+    ap.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is kept)")
+    args = ap.parse_args()
+
+    skipped = [f for f in codec.FORMATS if not codec.available(f)]
+    if skipped:
+        print(f"(not installed, skipped: {', '.join(skipped)})")
+    for n in args.sizes:
+        rows = run(n, args.repeat)
+        base = next(r for r in rows if r[0] == "json-pretty")
+        print(f"\n{n:,} messages")
+        print(f"{'':16}{'encode ms':>11}{'decode ms':>11}{'size KB':>11}{'vs pretty':>11}")
+        for label, enc, dec, size in rows:
+            print(f"{label:16}{enc * 1000:>11.1f}{dec * 1000:>11.1f}{size / 1024:>11.0f}{size / base[3]:>10.0%} ")
+
+
+if __name__ == "__main__":
+    main()
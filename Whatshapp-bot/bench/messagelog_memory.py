@@ -0,0 +1,123 @@
+# bench/messagelog_memory.py
+"""
+Memory benchmark: chat history as a list of dicts vs. MessageLog.
+
+Each variant is built in a fresh child process so the numbers don't leak into
+each other. Reports RSS growth (psutil or resource, when available) and the
+Python-heap growth seen by tracemalloc.
+
+    python bench/messagelog_memory.py              # 1,000,000 messages
+    python bench/messagelog_memory.py -n 200000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+SAMPLES = [
+    "hola! como estas?",
+    "I'm good, just got back from work 😊",
+    "jaja ok",
+    "did u eat yet today?",
+    "Tomorrow I'm going to the lake with my sister, want to come along?",
+    "gm",
+    "That sounds amazing, send me pics when you're there",
+]
+
+
+def messages(n):
+    t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(n):
+        yield {
+            "role": "user" if i % 2 else "assistant",
+            # distinct strings, as real history would be (no accidental sharing)
+            "content": f"{SAMPLES[i % len(SAMPLES)]} #{i}",
+            "ts": (t0 + timedelta(seconds=37 * i)).isoformat(),
+        }
+
+
+def rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def run_child(kind, n):
+    from messagelog import MessageLog
+
+    tracemalloc.start()
+    rss0 = rss_bytes()
+    t = time.perf_counter()
+    if kind == "dicts":
+        hist = list(messages(n))
+    else:
+        hist = MessageLog(messages(n))
+    build = time.perf_counter() - t
+    heap, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss1 = rss_bytes()
+
+    t = time.perf_counter()
+    tail = hist[-10:]
+    for _ in range(10000):
+        tail = hist[-10:]
+    tail_us = (time.perf_counter() - t) / 10000 * 1e6
+    t = time.perf_counter()
+    total = sum(len(m["content"]) for m in hist)
+    scan = time.perf_counter() - t
+
+    print(json.dumps({
+        "kind": kind,
+        "messages": len(hist),
+        "heap_mb": heap / 2**20,
+        "rss_mb": (rss1 - rss0) / 2**20 if rss0 and rss1 else None,
+        "bytes_per_message": heap / n,
+        "build_s": build,
+        "tail10_us": tail_us,
+        "full_scan_s": scan,
+        "chars": total,
+        "last": tail[-1],
+    }))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=1_000_000, help="messages per history")
+    ap.add_argument("--child", choices=["dicts", "messagelog"], help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        return run_child(args.child, args.n)
+
+    results = {}
+    for kind in ("dicts", "messagelog"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", kind, "-n", str(args.n)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results[kind] = json.loads(out)
+    assert results["dicts"]["last"] == results["messagelog"]["last"]
+
+    print(f"{args.n:,} messages")
+    print(f"{'':12}{'RSS MB':>10}{'heap MB':>10}{'B/msg':>8}{'build s':>9}{'[-10:] µs':>11}{'scan s':>8}")
+    for kind, r in results.items():
+        rss = f"{r['rss_mb']:.1f}" if r["rss_mb"] is not None else "n/a"
+        print(f"{kind:12}{rss:>10}{r['heap_mb']:>10.1f}{r['bytes_per_message']:>8.0f}"
+              f"{r['build_s']:>9.2f}{r['tail10_us']:>11.1f}{r['full_scan_s']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,28 +3,58 @@ import json
 import re
 import traceback
 import random
-from datetime import datetime, timezone
-import pytz
-import langid
+import email.utils
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 import uuid
-import httpx 
-
-from flask import Flask, request, jsonify, render_template, redirect, url_for
-from flask import send_from_directory
-from openai import OpenAI
-from humanize import humanize_reply, get_typing_delay
-# Improved language detection
-def safe_detect_lang(text):
+from concurrent.futures import ThreadPoolExecutor
+
+from startup import startup_report
+from metrics import metrics
+
+with startup_report.stage("import flask"):
+    from flask import Flask, request, jsonify, render_template, redirect, url_for
+    from flask import send_from_directory, send_file, Response, stream_with_context, g, has_request_context
+    from werkzeug.security import safe_join
+from humanize import humanize_reply, get_typing_delay, LEXICONS
+from keywords import ContactMatchers
+from language import lang_service
+from storage import ContactStore, install_contact_views, core_sections, write_memory_atomic, ts_epoch, INDEX_KEY
+import codec
+from archive import HistoryArchive
+from contact_rows import ContactRows
+from pagination import paginate_sorted, paginate_offset, clamp_limit, encode_cursor, decode_cursor
+from events import EventBus, NotificationRing
+from approval_queue import PendingQueue, normalize_gap
+from profile_learner import ProfileLearner
+from summaries import SummaryCache
+from delivery import DeliveryScheduler
+from profiler import RequestProfiler
+from media_cache import MediaCache, media_kind
+from shards import ShardConfig, GlobalReplica, partition_memory, OUTBOUND_HEADER
+from reply_cache import ReplyCache
+from model_router import ModelRouter, is_complex
+from wa_sync import SyncLedger, select_new, insert_by_ts, missed_since_reply, answered_after, wa_ts_iso
+from search_index import SearchIndex
+import ipc
+
+
+def safe_detect_lang(text, jid=None, learn=True):
+    """
+    Language of an incoming message. With a jid, the contact's learned
+    language prior is used so short messages don't flip languages.
+    """
     try:
-        if len(text.split()) < 3:  # too short, default to English
-            return "en"
-        lang = detect(text)
-        # If detector says something weird but message has only English chars, fallback to en
-        if lang not in ["en", "es", "pt", "fr", "de"]:  # only allow common langs you want
-            return "en"
-        return lang
-    except:
-        return "en"
+        if jid is None:
+            return lang_service.detect(text)
+        contact_info = memory.setdefault("contacts_info", {}).setdefault(jid, {})
+        history = memory.get("chat_history", {}).get(jid, [])
+        return lang_service.detect_for_contact(contact_info, text, history, learn=learn)
+    except Exception as e:
+        print(f"[ERROR] Language detection failed: {e}")
+        return lang_service.default
 
 
 
@@ -41,45 +71,169 @@ if not api_key:
 if not api_key:
     raise RuntimeError("No API key. Put it in config.json under openai_api_key or set OPENAI_API_KEY.")
 
-# NEW, FIXED CODE
-# Create a custom http client that explicitly disables proxies
-http_client = httpx.Client()
-
-# Pass that client to OpenAI so it uses our proxy-free settings
-client = OpenAI(api_key=api_key, http_client=http_client)
-MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# openai/httpx are heavy to import, so the client is built on first use
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                t = time.perf_counter()
+                import httpx
+                from openai import OpenAI
+                # Create a custom http client that explicitly disables proxies
+                http_client = httpx.Client()
+                # Pass that client to OpenAI so it uses our proxy-free settings
+                _client = OpenAI(api_key=api_key, http_client=http_client,
+                                 timeout=float(os.getenv("OPENAI_TIMEOUT", "60")))
+                startup_report.record_lazy("openai client", time.perf_counter() - t)
+    return _client
+
+def get_tz(tzname):
+    """pytz timezone by name (pytz is imported on first use), UTC if unknown."""
+    import pytz
+    try:
+        return pytz.timezone(tzname)
+    except Exception:
+        return pytz.UTC
 
 # ─────────────────────────────────────────────────────────────────────────────
 # MEMORY
 # ─────────────────────────────────────────────────────────────────────────────
-MEM_PATH = os.path.join(os.path.dirname(__file__), "memory.json")
-if os.path.exists(MEM_PATH):
-    with open(MEM_PATH, encoding="utf-8") as f:
-        memory = json.load(f)
-else:
-    memory = {
-        "my_profile": [],
-        "personality_profile": [],
-        "allowed_contacts": [],
-        "settings": {
-            "timezone": "America/Guatemala",
-            "approval_enabled": False,
-            "date_day_first": False,
-            "self_labels": ["You", "Julio"]
-        },
-        "images": [],
-        "images_sent": {},          # { jid: [filenames...] }
-        "chat_history": {},         # { jid: [ {role, content, ts} ] }
-        "contacts_info": {},        # { jid: {...} }
-        "pending_for_approval": [], # [{jid, user_msg, reply, images: []}]
-        "pending_approved": [],     # consumed by index.js poller
-        "missed_messages": {},
-        "synced_wa_ids": {}
-    }
+# memory.json holds the global sections plus a small per-contact index;
+# each contact's history/profile lives in memory_contacts/ and loads on demand,
+# and history beyond the hot window is archived under memory_archive/.
+# In sharded mode (see shards.py / router.py) each worker keeps its own
+# memory.json and queues under shards/<i>/; contact files stay shared.
+BASE_DIR = os.path.dirname(__file__)
+SHARD = ShardConfig.from_env()
+DATA_DIR = SHARD.data_dir(BASE_DIR)
+os.makedirs(DATA_DIR, exist_ok=True)
+MEM_PATH = os.path.join(DATA_DIR, "memory.json")
+CONTACTS_DIR = os.path.join(BASE_DIR, "memory_contacts")
+ARCHIVE_DIR = os.path.join(BASE_DIR, "memory_archive")
+SINGLE_MEM_PATH = os.path.join(BASE_DIR, "memory.json")
+with startup_report.stage("load memory.json"):
+    # any format codec.py knows (old pretty-printed files included)
+    if os.path.exists(MEM_PATH):
+        memory = codec.load(MEM_PATH)
+    elif SHARD.enabled and os.path.exists(SINGLE_MEM_PATH):
+        # first start of this shard: take its contacts from the single-process memory.json
+        memory = partition_memory(codec.load(SINGLE_MEM_PATH), SHARD.owns)
+        print(f"[INFO] Shard {SHARD.index}/{SHARD.count} seeded with "
+              f"{len(memory.get('allowed_contacts', []))} contacts from memory.json")
+    else:
+        memory = {
+            "my_profile": [],
+            "personality_profile": [],
+            "allowed_contacts": [],
+            "settings": {
+                "timezone": "America/Guatemala",
+                "approval_enabled": False,
+                "date_day_first": False,
+                "self_labels": ["You", "Julio"]
+            },
+            "images": [],
+            "images_sent": {},          # { jid: [filenames...] }
+            "chat_history": {},         # { jid: [ {role, content, ts} ] }
+            "contacts_info": {},        # { jid: {...} }
+            "pending_for_approval": [], # [{jid, user_msg, reply, images: []}]
+            "pending_approved": [],     # consumed by index.js poller
+            "missed_messages": {},
+            "synced_wa_ids": {}
+        }
+
+with startup_report.stage("contact registry"):
+    contact_store = ContactStore(
+        CONTACTS_DIR, memory.setdefault(INDEX_KEY, {}), archive=HistoryArchive(ARCHIVE_DIR)
+    )
+    install_contact_views(memory, contact_store)
+    contact_rows = ContactRows(memory, contact_store)
+    contact_rows.rebuild()
+
+# Sharded mode: shard 0 owns my_profile / personality_profile / settings and
+# publishes them; the other shards reload the shared copy when it changes.
+GLOBALS_PATH = os.path.join(BASE_DIR, "shared_globals.json")
+global_replica = GlobalReplica(GLOBALS_PATH, memory, primary=SHARD.is_primary) if SHARD.enabled else None
+if global_replica is not None:
+    global_replica.sync()
+
+# Notifications live in a small ring of their own; the dashboard is pushed
+# new notifications and approval-queue changes over /events.
+NOTIFICATIONS_PATH = os.path.join(DATA_DIR, "notifications.json")
+event_bus = EventBus()
+notification_ring = NotificationRing(NOTIFICATIONS_PATH, size=50)
+if "notifications" in memory:
+    notification_ring.adopt(memory.pop("notifications"))
+atexit.register(notification_ring.flush)
+
+# Replies waiting for manual approval, addressed by stable item id
+pending_queue = PendingQueue(memory.pop("pending_for_approval", []), id_prefix=SHARD.id_prefix)
+
+# Replies waiting out their humanized typing delay (journaled, survives restarts)
+SCHEDULED_SENDS_PATH = os.path.join(DATA_DIR, "scheduled_sends.jsonl")
+delivery_scheduler = DeliveryScheduler(SCHEDULED_SENDS_PATH)
+
+# Sent replies to short small-talk messages, reused for near-duplicates when enabled
+# (written shortly after it learns something, and at exit)
+REPLY_CACHE_PATH = os.path.join(DATA_DIR, "reply_cache.json")
+reply_cache = ReplyCache(REPLY_CACHE_PATH)
+
+# Per-contact cursor and recent WhatsApp ids for the bridge's history sync (wa_sync.py)
+sync_ledger = SyncLedger(memory.setdefault("synced_wa_ids", {}))
+
+# Full-text index over every contact's history (SQLite FTS5, see search_index.py);
+# its own thread keeps it current as history grows and catches up at startup
+SEARCH_DB_PATH = os.path.join(DATA_DIR, "search_index.db")
+search_index = SearchIndex(SEARCH_DB_PATH, contact_store.history_len, contact_store.iter_positions).start(
+    {jid: e.get("messages", 0) for jid, e in list(contact_store.index.items())}
+)
+
+_save_lock = threading.Lock()
 
 def save_memory():
-    with open(MEM_PATH, "w", encoding="utf-8") as f:
-        json.dump(memory, f, indent=2, ensure_ascii=False)
+    # request threads and background workers both save; serialize the writes
+    with metrics.span("save_memory"), _save_lock:
+        contact_store.flush()
+        core = core_sections(memory)
+        core["pending_for_approval"] = pending_queue.to_list()
+        write_memory_atomic(MEM_PATH, core)
+        if global_replica is not None:
+            global_replica.publish()
+
+def iter_history(jid, start=0, since=None):
+    """Whole conversation with jid (archived + hot), streamed oldest first."""
+    return contact_store.iter_history(jid, start=start, since=since)
+
+# One keyword automaton per contact: mood/topic lexicons + their linguistic objectives
+contact_matchers = ContactMatchers(LEXICONS)
+
+def scan_keywords(jid, text):
+    """All lexicon and objective hits in text, in one pass ({label: [keywords]})."""
+    objectives = memory.get("contacts_info", {}).get(jid, {}).get("objectives", [])
+    return contact_matchers.get(jid, objectives).find(text)
+
+def reply_context(lang, hits):
+    """Coarse context a cached reply must share: language, mood and part of the day."""
+    mood = next((m for m in ("sad", "emotional", "happy") if m in hits), "neutral")
+    hour = datetime.now(get_tz(memory["settings"].get("timezone", "America/Guatemala"))).hour
+    daypart = "morning" if 5 <= hour < 12 else "afternoon" if hour < 18 else "night"
+    return f"{lang}|{mood}|{daypart}"
+
+def recent_replies(jid, n=5):
+    """The last n replies sent to jid, newest last."""
+    hist = memory.get("chat_history", {}).get(jid, [])
+    return [m["content"] for m in hist[-20:] if m["role"] == "assistant"][-n:]
+
+def append_history(jid, role, content, ts=None):
+    """Append one message to jid's history and keep the dashboard row current."""
+    hist = memory.setdefault("chat_history", {}).setdefault(jid, [])
+    hist.append({"role": role, "content": content, "ts": ts or datetime.now(timezone.utc).isoformat()})
+    contact_rows.refresh(jid)
+    search_index.schedule(jid)
+    return hist
 
 # ─────────────────────────────────────────────────────────────────────────────
 # IMAGES
@@ -101,23 +255,188 @@ def refresh_images():
 app = Flask(__name__, template_folder="templates", static_folder="static")
 app.config["DEBUG"] = True
 
-SYSTEM_BASE = (
+@app.before_request
+def _follow_shared_globals():
+    # followers pick up profile/settings edits made on the primary shard
+    if global_replica is not None:
+        global_replica.refresh()
 
+@app.after_request
+def _flag_outbound(resp):
+    # sharded: the bridge channel lives in the router, which relays this as "outbound"
+    if g.get("outbound_ready"):
+        resp.headers[OUTBOUND_HEADER] = "1"
+    return resp
+
+SYSTEM_BASE = (
+    ""      # base persona prompt; a str (not an empty tuple) so build_system_prompt can append to it
 )
 
+def build_system_prompt(jid):
+    """System prompt for a reply to jid: base, Julio's profile, the contact's profile, recent chat."""
+    system = SYSTEM_BASE
+    if memory.get("my_profile"):
+        system += "\n\nFacts about Julio:\n" + "\n".join(f"- {f}" for f in memory["my_profile"])
+    if memory.get("personality_profile"):
+        system += "\n\nPersonality guidelines:\n" + "\n".join(f"- {t}" for t in memory["personality_profile"])
+
+    contact_profile = memory.get("person_profiles", {}).get(jid, {})
+    if contact_profile.get("info"):
+        system += f"\n\nIMPORTANT FACTS TO REMEMBER ABOUT THIS PERSON:\n{contact_profile['info']}"
+    if contact_profile.get("style"):
+        system += f"\n\nADOPT THIS SPECIFIC STYLE FOR THIS PERSON:\n{contact_profile['style']}"
+
+    last10 = memory.get("chat_history", {}).get(jid, [])[-10:]
+    system += "\n\nRecent conversation:\n" + "\n".join(f"{m['role']}: {m['content']}" for m in last10)
+    return system
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # OPENAI HELPER
 # ─────────────────────────────────────────────────────────────────────────────
-def chat_complete(messages, temperature=0.7, max_tokens=200, top_p=0.9):
-    resp = client.chat.completions.create(
-        model=MODEL,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        top_p=top_p,
-    )
-    return resp.choices[0].message.content.strip()
+# Which model answers which call site (see model_router.py / model_routes.json)
+MODEL_ROUTES_PATH = os.path.join(os.path.dirname(__file__), "model_routes.json")
+model_router = ModelRouter.from_file(MODEL_ROUTES_PATH)
+
+def chat_complete(messages, temperature=0.7, max_tokens=200, top_p=0.9, route="default", complex=False):
+    return chat_candidates(messages, 1, temperature, max_tokens, top_p, route=route, complex=complex)[0]
+
+MAX_RETRY_AFTER = 60.0      # longest server-requested wait we honour before retrying
+
+def retry_after(error):
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, divisor in (("retry-after-ms", 1000), ("retry-after", 1)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            delay = float(value) / divisor
+        except ValueError:
+            when = email.utils.parsedate_tz(value)     # an HTTP date
+            if when is None:
+                continue
+            delay = email.utils.mktime_tz(when) - time.time()
+        return delay if 0 < delay <= MAX_RETRY_AFTER else None
+    return None
+
+def chat_candidates(messages, n, temperature=0.7, max_tokens=200, top_p=0.9, route="default", complex=False):
+    """n sampled replies to the same prompt, from a single request to the route's model."""
+    model, timeout, fallback = model_router.pick(route, complex)
+    client = get_client()
+    # already imported by get_client()
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, NotFoundError, RateLimitError
+
+    def call(model, **options):
+        t = time.perf_counter()
+        try:
+            resp = client.with_options(timeout=timeout, **options).chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                n=n,
+            )
+        except APITimeoutError:
+            model_router.record(route, model, time.perf_counter() - t, outcome="timeout")
+            raise
+        except Exception:
+            model_router.record(route, model, time.perf_counter() - t, outcome="error")
+            raise
+        usage = getattr(resp, "usage", None)
+        model_router.record(route, model, time.perf_counter() - t,
+                            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                            completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+        return resp
+
+    def call_retrying(model):
+        # the client's retries, minus retrying timeouts: those go to the fallback
+        for attempt in range(client.max_retries + 1):
+            try:
+                return call(model, max_retries=0)
+            except APITimeoutError:
+                raise
+            except (APIConnectionError, RateLimitError, InternalServerError) as e:
+                if attempt == client.max_retries:
+                    raise
+                time.sleep(retry_after(e) or 0.5 * 2 ** attempt)
+
+    with metrics.span("model_call"):
+        if fallback is None:
+            resp = call_retrying(model)
+        else:
+            try:
+                resp = call_retrying(model)
+            except APITimeoutError:
+                model_router.record_fallback(route, model, fallback, "timed out")
+                resp = call_retrying(fallback)
+            except (APIConnectionError, RateLimitError, InternalServerError, NotFoundError) as e:
+                # unreachable, overloaded or unknown (e.g. a wrong OPENAI_STRONG_MODEL)
+                model_router.record_fallback(route, model, fallback, f"failed ({type(e).__name__})")
+                resp = call_retrying(fallback)
+    return [(c.message.content or "").strip() for c in resp.choices]
+
+def translate_reply(text, lang):
+    """A reply written in English, in the contact's language."""
+    with metrics.span("translate"):
+        return chat_complete(
+            [
+                {"role": "system", "content": "Translate naturally, keep tone conversational."},
+                {"role": "user", "content": f"Translate to natural {lang.upper()}:\n\n{text}"}
+            ],
+            temperature=0.7, max_tokens=200, top_p=0.9, route="translate"
+        )
+
+# Candidates per model call for replies going to the approval queue (settings: reply_alternates)
+REPLY_ALTERNATES = max(2, int(os.getenv("REPLY_ALTERNATES", "3")))
+
+# Chunk summaries are cached by content hash and shared by every summary route
+SUMMARY_CACHE_PATH = os.path.join(DATA_DIR, "summary_cache.json")
+summary_cache = SummaryCache(
+    SUMMARY_CACHE_PATH,
+    lambda system, user, max_tokens: chat_complete(
+        [{"role": "system", "content": system}, {"role": "user", "content": user}],
+        temperature=0.3, max_tokens=max_tokens, top_p=1.0, route="summary",
+    ),
+)
+atexit.register(summary_cache.flush)
+atexit.register(reply_cache.flush)
+
+def summarize_history(jid, reduce_prompt, max_tokens=300):
+    """Summary of jid's whole conversation; only new/changed chunks hit the model."""
+    text = summary_cache.summarize(contact_store.iter_positions(jid), reduce_prompt,
+                                   max_tokens=max_tokens, key=jid)
+    summary_cache.flush()
+    return text
+
+# A first summary of a long history takes many model calls, so the summary
+# routes never run one on the request: they queue it here and serve the last
+# finished result (summary_cache.latest(), kept across restarts).
+summary_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SUMMARY_WORKERS", "2")), thread_name_prefix="summary")
+_summaries_running = set()
+_summaries_lock = threading.Lock()
+
+def summarize_later(jid, reduce_prompt, max_tokens=300, done=None):
+    """Summarize jid's history on summary_pool, then call done(text); False if already running."""
+    key = (jid, reduce_prompt)
+    with _summaries_lock:
+        if key in _summaries_running:
+            return False
+        _summaries_running.add(key)
+
+    def run():
+        try:
+            text = summarize_history(jid, reduce_prompt, max_tokens=max_tokens)
+            if done is not None:
+                done(text)
+        except Exception as e:
+            print(f"[ERROR] Summary for {jid} failed: {e}")
+        finally:
+            with _summaries_lock:
+                _summaries_running.discard(key)
+    summary_pool.submit(run)
+    return True
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -126,22 +445,24 @@ def chat_complete(messages, temperature=0.7, max_tokens=200, top_p=0.9):
 
 @app.route("/dashboard")
 def dashboard():
-    # ✅ Step 1: Load notifications before clearing
-    notifications = memory.get("notifications", [])
+    # ✅ Step 1: Load notifications the operator hasn't seen yet
+    notifications = notification_ring.unseen()
 
-    # ✅ Step 2: Automatically clear them after viewing
-    if notifications:
-        memory["notifications"] = []
-        save_memory()
+    # ✅ Step 2: Mark them seen (persisted lazily with the ring, no memory rewrite)
+    notification_ring.mark_seen()
 
     # ✅ Step 3: Render dashboard with updated info
+    # (pending replies are fetched page by page from /api/pending)
     return render_template(
         "index.html",
         approval_enabled=memory["settings"].get("approval_enabled", False),
-        pending_for_approval=memory.get("pending_for_approval", []),
-        allowed_contacts=memory.get("allowed_contacts", []),
-        contacts_info=memory.get("contacts_info", {}),
-        knowledge_gaps=memory.get("knowledge_gaps", []),
+        humanized_delay=memory["settings"].get("humanized_delay", False),
+        reply_cache_on=memory["settings"].get("reply_cache", False),
+        reply_alternates=memory["settings"].get("reply_alternates", False),
+        reply_missed=memory["settings"].get("reply_missed", False),
+        alternates_count=REPLY_ALTERNATES,
+        reply_cache_stats=reply_cache.report()["global"],
+        scheduled_count=len(delivery_scheduler),
         notifications=notifications  # pass to template
     )
 
@@ -164,15 +485,8 @@ def show_contact_profile(jid):
     # ✅ Ensure objectives key exists
     contact_info.setdefault("objectives", [])
 
-    # ✅ Collect media files (if any)
-    media_files = []
-    if media_dir and os.path.isdir(media_dir):
-        media_files = [
-            f for f in os.listdir(media_dir)
-            if os.path.isfile(os.path.join(media_dir, f))
-        ]
-
     # ✅ Render template with 'contact' and 'objectives'
+    # (media files are listed page by page from /api/media/<jid>)
     return render_template(
         "contact_profile.html",
         jid=jid,
@@ -180,7 +494,6 @@ def show_contact_profile(jid):
         profile=profile,
         summary=profile.get("summary"),
         media_dir=media_dir,
-        media_files=media_files,
         contact=contact_info,  # ✅ added for Jinja template compatibility
         objectives=contact_info["objectives"],  # ✅ safe and direct
     )
@@ -217,7 +530,8 @@ def add_objective(jid):
             {"role": "user", "content": prompt}
         ],
         temperature=0.7,
-        max_tokens=120
+        max_tokens=120,
+        route="strategy"
     )
 
     new_obj = {
@@ -236,15 +550,11 @@ def add_objective(jid):
 
     contact_info = memory.setdefault("contacts_info", {}).setdefault(jid, {})
     contact_info.setdefault("objectives", []).append(new_obj)
+    contact_rows.refresh(jid)
     save_memory()
 
     # Notify dashboard
-    memory.setdefault("notifications", []).append({
-        "jid": jid,
-        "message": f"New {obj_type} objective added: {description}",
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    })
-    save_memory()
+    add_notification(jid, f"New {obj_type} objective added: {description}")
 
     return redirect(url_for("show_contact_profile", jid=jid))
 
@@ -260,6 +570,7 @@ def complete_objective(jid, obj_id):
             add_notification(jid, f"✅ Objective completed for {jid}: “{obj['description']}”")
             obj["notes"].append("Manually marked complete by user.")
             break
+    contact_rows.refresh(jid)
     save_memory()
     return redirect(url_for("show_contact_profile", jid=jid))
 
@@ -269,6 +580,8 @@ def complete_objective(jid, obj_id):
 def delete_objective(jid, obj_id):
     objectives = memory.setdefault("contacts_info", {}).setdefault(jid, {}).setdefault("objectives", [])
     memory["contacts_info"][jid]["objectives"] = [obj for obj in objectives if obj["id"] != obj_id]
+    contact_matchers.invalidate(jid)
+    contact_rows.refresh(jid)
     add_notification(jid, f"🗑️ Objective deleted for {jid}")
     save_memory()
     return redirect(url_for("show_contact_profile", jid=jid))
@@ -299,9 +612,10 @@ def update_media_dir(jid):
         contact_info = memory.setdefault("contacts_info", {}).setdefault(jid, {})
         contact_info["media_dir"] = new_dir
 
-        # Scan for media files in that folder
-        files = sorted(os.listdir(new_dir))
-        contact_info["media_files"] = files
+        # The listing is indexed on demand by media_cache; drop the old
+        # one-off snapshot and warm the index (queues thumbnails).
+        contact_info.pop("media_files", None)
+        list_media_files(new_dir)
 
         save_memory()
     else:
@@ -311,44 +625,44 @@ def update_media_dir(jid):
 
 @app.route("/summarize_contact/<path:jid>", methods=["POST"])
 def summarize_contact(jid):
-    hist = memory.get("chat_history", {}).get(jid, [])
-    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in hist[-50:])  # last 50 msgs
-    summary = chat_complete(
-        [
-            {"role": "system", "content": "Summarize this contact’s personality, interests, and relationship with Julio."},
-            {"role": "user", "content": transcript}
-        ],
-        temperature=0.4, max_tokens=250
-    )
+    def done(summary):
+        info = memory.setdefault("person_profiles", {}).setdefault(jid, {})
+        info["last_summary"] = summary
+        save_memory()
+        add_notification(jid, "📝 Contact summary updated.")
 
-    info = memory.setdefault("person_profiles", {}).setdefault(jid, {})
-    info["last_summary"] = summary
-    save_memory()
+    summarize_later(
+        jid,
+        "Summarize this contact’s personality, interests, and relationship with Julio.",
+        max_tokens=250, done=done,
+    )
     return redirect(url_for("show_contact_profile", jid=jid))
 
 
 # keep old "/" working too
 @app.route("/")
 def index_redirect():
-    # load dashboard
-    result = dashboard()
-
-    # Clear notifications after viewing
-    memory["notifications"] = []
-    save_memory()
-
-    return result
+    # load dashboard (it marks notifications as seen)
+    return dashboard()
 
 
 @app.route("/nav/sync")
 def nav_sync():
+    # contact options come from /api/contacts (merged across shards), see base.html
     return render_template(
         "sync.html",
-        allowed_contacts=memory.get("allowed_contacts", []),
         self_labels=memory["settings"].get("self_labels", ["You"]),
         date_day_first=memory["settings"].get("date_day_first", False),
     )
 
+@app.route("/nav/search")
+def nav_search():
+    # results are fetched page by page from /api/search, contact options from /api/contacts
+    return render_template(
+        "search.html",
+        q=request.args.get("q", ""),
+    )
+
 @app.route("/nav/profile")
 def nav_profile():
     return render_template("profile_facts.html", my_profile=memory.get("my_profile", []))
@@ -362,11 +676,117 @@ def nav_personality():
 
 @app.route("/nav/contacts")
 def nav_contacts():
-    return render_template(
-        "contacts.html",
-        allowed_contacts=memory.get("allowed_contacts", []),
-        contacts_info=memory.get("contacts_info", {})
+    # contact cards (and the count) are fetched page by page from /api/contacts
+    return render_template("contacts.html")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# DASHBOARD API (paginated JSON for progressively rendered pages)
+# ─────────────────────────────────────────────────────────────────────────────
+# Media folders are indexed by mtime/size; gallery thumbnails are generated
+# in the background and kept under thumbs/ (needs Pillow, else originals).
+THUMBS_DIR = os.path.join(os.path.dirname(__file__), "thumbs")
+media_cache = MediaCache(THUMBS_DIR)
+
+def list_media_files(media_dir):
+    """Sorted files in media_dir; only re-read when the folder's mtime changes."""
+    return media_cache.listing(media_dir)
+
+def media_item(jid, media_dir, name):
+    kind = media_kind(name)
+    item = {"name": name, "kind": kind, "url": url_for("serve_media", jid=jid, filename=name)}
+    meta = media_cache.stat(media_dir, name)
+    if meta:
+        item["size"], item["mtime"] = meta[0], meta[1] // 1_000_000_000
+        if kind == "image" and media_cache.thumbnails_enabled:
+            # versioned URL: a changed photo gets a new thumbnail URL
+            item["thumb_url"] = url_for("serve_media_thumb", jid=jid, filename=name,
+                                        v=media_cache.thumb_key(media_dir, name, meta))
+    return item
+
+@app.route("/api/contacts", methods=["GET"])
+def api_contacts():
+    q = request.args.get("q", "").strip().lower()
+    enabled = request.args.get("enabled")
+    rows = contact_rows.rows()
+    if q:
+        rows = [r for r in rows if q in r["jid"].lower() or q in r["name"].lower()]
+    if enabled in ("true", "false"):
+        rows = [r for r in rows if r["enabled"] == (enabled == "true")]
+    page = paginate_sorted(rows, ContactRows.sort_key, request.args.get("cursor"),
+                           clamp_limit(request.args.get("limit")))
+    page["total"] = len(rows)   # summed by the router in sharded mode
+    return jsonify(page)
+
+def search_day(raw, days=0):
+    """YYYY-MM-DD (the operator's timezone) -> epoch seconds at its start, None if not a date."""
+    try:
+        day = datetime.strptime(raw, "%Y-%m-%d") + timedelta(days=days)
+    except (TypeError, ValueError):
+        return None
+    return get_tz(memory["settings"].get("timezone", "America/Guatemala")).localize(day).timestamp()
+
+@app.route("/api/search", methods=["GET"])
+def api_search():
+    """Ranked message search: q, and optionally jid, role, since/until (YYYY-MM-DD, inclusive)."""
+    q = request.args.get("q", "").strip()
+    limit = clamp_limit(request.args.get("limit"))
+    after = decode_cursor(request.args.get("cursor"))
+    t = time.perf_counter()
+    page = search_index.search(
+        q,
+        jid=request.args.get("jid", "").strip() or None,
+        role=request.args.get("role") if request.args.get("role") in ("user", "assistant") else None,
+        since=search_day(request.args.get("since")),
+        until=search_day(request.args.get("until"), days=1),
+        after=tuple(after) if isinstance(after, list) and len(after) == 3 else None,
+        limit=limit,
     )
+    items = page["items"]
+    for it in items:
+        it["name"] = (contact_rows.get(it["jid"]) or {}).get("name") or it["jid"]
+    metrics.observe("search_seconds", time.perf_counter() - t)
+    last = items[-1] if items else None
+    return jsonify({
+        "items": items,
+        "next_cursor": encode_cursor([last["score"], last["jid"], last["pos"]]) if page["more"] and last else None,
+    })
+
+@app.route("/api/pending", methods=["GET"])
+def api_pending():
+    jid = request.args.get("jid", "").strip()
+    q = request.args.get("q", "").strip().lower()
+    items = []
+    for item in pending_queue.items():
+        if jid and item.get("jid") != jid:
+            continue
+        if q and q not in item.get("user_msg", "").lower() and q not in item.get("reply", "").lower():
+            continue
+        row = contact_rows.get(item.get("jid")) or {}
+        items.append(dict(item, name=row.get("name", "")))
+    page = paginate_sorted(items, lambda it: [it["seq"], it["id"]], request.args.get("cursor"),
+                           clamp_limit(request.args.get("limit")))
+    page["total"] = len(items)
+    return jsonify(page)
+
+@app.route("/api/notifications", methods=["GET"])
+def api_notifications():
+    newest_first = list(reversed(notification_ring.items()))
+    return jsonify(paginate_offset(newest_first, request.args.get("cursor"),
+                                   clamp_limit(request.args.get("limit"))))
+
+@app.route("/api/knowledge_gaps", methods=["GET"])
+def api_knowledge_gaps():
+    return jsonify(items=list(memory.get("knowledge_gaps", [])))
+
+@app.route("/api/media/<path:jid>", methods=["GET"])
+def api_media(jid):
+    media_dir = memory.get("contacts_info", {}).get(jid, {}).get("media_dir")
+    files = list_media_files(media_dir) if media_dir else []
+    page = paginate_offset(files, request.args.get("cursor"), clamp_limit(request.args.get("limit")))
+    page["items"] = [media_item(jid, media_dir, f) for f in page["items"]]
+    page["total"] = len(files)
+    return jsonify(page)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -426,10 +846,7 @@ def parse_datetime_parts(date_s, time_s, ampm, day_first: bool, tzname: str):
         if ap == "am" and hh == 12:
             hh = 0
 
-    try:
-        tz = pytz.timezone(tzname)
-    except Exception:
-        tz = pytz.UTC
+    tz = get_tz(tzname)
 
     try:
         dt = tz.localize(datetime(y, month, day, hh, mm))
@@ -487,6 +904,10 @@ def merge_into_history(jid: str, parsed_msgs: list):
     hist = memory.setdefault("chat_history", {}).setdefault(jid, [])
     tail = hist[-200:]
     seen = {(m["role"], m["content"].strip()) for m in tail}
+    # Re-imported exports can overlap messages that were already archived
+    epochs = [e for e in (ts_epoch(m.get("ts")) for m in parsed_msgs) if e is not None]
+    if epochs:
+        seen.update((m["role"], m["content"].strip()) for m in iter_history(jid, since=min(epochs)))
     added = 0
     for m in parsed_msgs:
         key = (m["role"], m["content"].strip())
@@ -495,6 +916,8 @@ def merge_into_history(jid: str, parsed_msgs: list):
         hist.append(m)
         seen.add(key)
         added += 1
+    contact_rows.refresh(jid)
+    search_index.schedule(jid)
     save_memory()
     return added, len(parsed_msgs)
 
@@ -509,9 +932,6 @@ def ensure_contact_struct(jid: str):
 
     # ✅ Ensure objectives structure exists
     contact_info.setdefault("objectives", [])
-    
-    # ✅ NEW: Ensure the update counter exists
-    contact_info.setdefault("messages_since_profile_update", 0)
 
     # No save_memory() here, it will be saved by the calling function
 
@@ -531,14 +951,16 @@ def recent_user_asked_for_photos(jid: str, within: int = 6) -> bool:
 
 
 def add_notification(jid, message):
-    memory.setdefault("notifications", []).append({
-        "jid": jid,
-        "message": message,
-        "ts": datetime.now(timezone.utc).isoformat()
-    })
-    # Keep only last 50
-    memory["notifications"] = memory["notifications"][-50:]
-    save_memory()
+    # The ring keeps only the last 50 and persists itself lazily
+    item = notification_ring.append(jid, message)
+    event_bus.publish("notification", item)
+
+
+def publish_pending(action, **data):
+    """Tell open dashboards that the approval queue changed."""
+    event_bus.publish("pending", dict(
+        data, action=action, count=len(pending_queue)
+    ))
 
 
 
@@ -609,13 +1031,21 @@ def remove_personality(idx):
 # ─────────────────────────────────────────────────────────────────────────────
 @app.route("/update_contact_name", methods=["POST"])
 def update_contact_name():
-    jid  = request.form.get("jid","").strip()
-    name = request.form.get("name","").strip()
+    # the bridge posts JSON and is told whether the name was kept (contacts not added yet drop it)
+    data = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    jid  = (data.get("jid") or "").strip()
+    name = (data.get("name") or "").strip()
+    stored = False
     for c in memory.get("allowed_contacts", []):
         if c["jid"] == jid:
             c["name"] = name
+            stored = True
             break
-    save_memory()
+    if stored:
+        contact_rows.refresh(jid)
+        save_memory()
+    if request.is_json:
+        return jsonify(stored=stored)
     return redirect(url_for("nav_contacts"))
 
 @app.route("/add_contact", methods=["POST"])
@@ -626,6 +1056,7 @@ def add_contact():
             "jid": jid, "enabled": True, "name": ""
         })
         ensure_contact_struct(jid)
+        contact_rows.refresh(jid)
         save_memory()
     return redirect(url_for("nav_contacts"))
 
@@ -637,6 +1068,7 @@ def toggle_contact(jid):
             if c["enabled"]:
                 ensure_contact_struct(jid)
             break
+    contact_rows.refresh(jid)
     save_memory()
     return redirect(url_for("nav_contacts"))
 
@@ -646,16 +1078,22 @@ def remove_contact(jid):
         c for c in memory.get("allowed_contacts", []) if c["jid"] != jid
     ]
     memory.get("chat_history", {}).pop(jid, None)
+    memory.get("person_profiles", {}).pop(jid, None)
     memory.get("images_sent", {}).pop(jid, None)
     memory.get("contacts_info", {}).pop(jid, None)
-    memory["pending_for_approval"] = [
-        it for it in memory.get("pending_for_approval", []) if it.get("jid") != jid
-    ]
+    pending_queue.remove_where(lambda it: it.get("jid") == jid)
     memory["pending_approved"] = [
         it for it in memory.get("pending_approved", []) if it.get("jid") != jid
     ]
+    delivery_scheduler.cancel_jid(jid)
+    contact_matchers.invalidate(jid)
+    reply_cache.drop(jid)
+    summary_cache.drop(jid)
+    search_index.drop(jid)
+    publish_pending("removed", jid=jid)
     memory.get("missed_messages", {}).pop(jid, None)
     memory.get("synced_wa_ids", {}).pop(jid, None)
+    contact_rows.refresh(jid)
 
     save_memory()
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
@@ -669,6 +1107,48 @@ def toggle_approval():
     save_memory()
     return redirect(url_for("index"))
 
+@app.route("/toggle_humanized_delay", methods=["POST"])
+def toggle_humanized_delay():
+    curr = memory["settings"].get("humanized_delay", False)
+    memory["settings"]["humanized_delay"] = not curr
+    save_memory()
+    return redirect(url_for("index"))
+
+@app.route("/toggle_reply_alternates", methods=["POST"])
+def toggle_reply_alternates():
+    curr = memory["settings"].get("reply_alternates", False)
+    memory["settings"]["reply_alternates"] = not curr
+    save_memory()
+    return redirect(url_for("index"))
+
+@app.route("/toggle_reply_missed", methods=["POST"])
+def toggle_reply_missed():
+    curr = memory["settings"].get("reply_missed", False)
+    memory["settings"]["reply_missed"] = not curr
+    save_memory()
+    return redirect(url_for("index"))
+
+@app.route("/toggle_reply_cache", methods=["POST"])
+def toggle_reply_cache():
+    curr = memory["settings"].get("reply_cache", False)
+    memory["settings"]["reply_cache"] = not curr
+    save_memory()
+    return redirect(url_for("index"))
+
+@app.route("/api/model_routes")
+def api_model_routes():
+    """The model routing table and per-route latency/token stats, for tuning it."""
+    return jsonify(model_router.report())
+
+@app.route("/api/reply_cache")
+def api_reply_cache():
+    """Reply cache hit rate and model calls saved, overall and per contact."""
+    report = reply_cache.report()
+    names = {c["jid"]: c.get("name") for c in memory.get("allowed_contacts", [])}
+    for c in report["contacts"]:
+        c["name"] = names.get(c["jid"]) or c["jid"]
+    return jsonify(report)
+
 
 @app.route("/media/<path:jid>/<path:filename>")
 def serve_media(jid, filename):
@@ -678,87 +1158,187 @@ def serve_media(jid, filename):
     if not media_dir or not os.path.isdir(media_dir):
         return "Media directory not set or missing.", 404
 
-    return send_from_directory(media_dir, filename)
+    # conditional GETs (ETag / Last-Modified) are answered with 304s
+    return send_from_directory(media_dir, filename, max_age=3600)
+
+
+@app.route("/media_thumb/<path:jid>/<path:filename>")
+def serve_media_thumb(jid, filename):
+    media_dir = memory.get("contacts_info", {}).get(jid, {}).get("media_dir")
+    if not media_dir or not os.path.isdir(media_dir):
+        return "Media directory not set or missing.", 404
+    if safe_join(media_dir, filename) is None:
+        return "Not found.", 404
+
+    thumb = media_cache.thumb_for(media_dir, filename)
+    if thumb is None:
+        # no Pillow, not an image, or undecodable: fall back to the original
+        return serve_media(jid, filename)
+    # thumbnail URLs carry their version, so they can be cached for good
+    max_age = 31536000 if request.args.get("v") else 3600
+    return send_file(thumb, mimetype="image/jpeg", conditional=True, max_age=max_age)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # APPROVAL WORKFLOW
 # ─────────────────────────────────────────────────────────────────────────────
-@app.route("/approve_reply/<int:idx>", methods=["POST"])
-def approve_reply(idx):
-    pend = memory.get("pending_for_approval", [])
-    if 0 <= idx < len(pend):
-        item = pend.pop(idx)
-        # Push localized reply
-        memory.setdefault("pending_approved", []).append({
+def record_sent(entry):
+    """Log an outbound reply in history once it is actually handed to the bridge."""
+    append_history(entry["jid"], "assistant", entry.get("reply", ""))
+    cache = entry.get("reply_cache")
+    if cache:
+        reply_cache.learn(entry["jid"], entry.get("user_msg", ""), cache["ctx"], cache["base"])
+    if entry.get("log_images") and entry.get("images"):
+        memory.setdefault("images_sent", {}).setdefault(entry["jid"], []).extend(entry["images"])
+
+def bridge_item(entry):
+    # the id comes back with the bridge's /send_result for this item
+    return {"id": SHARD.id_prefix + uuid.uuid4().hex, "jid": entry["jid"],
+            "reply": entry.get("reply", ""), "images": entry.get("images", [])}
+
+def queue_outbound(entries):
+    """
+    Hand replies to the bridge's outbound queue. With humanized delays on, each
+    one waits get_typing_delay() seconds in the delivery scheduler first and is
+    logged in history only when it goes out. The caller saves afterwards.
+    """
+    if memory["settings"].get("humanized_delay"):
+        for entry in entries:
+            delivery_scheduler.schedule(entry, get_typing_delay(entry.get("user_msg", ""), entry.get("reply", "")))
+        return entries
+    for entry in entries:
+        record_sent(entry)
+    memory.setdefault("pending_approved", []).extend(bridge_item(e) for e in entries)
+    if entries:
+        if ipc_server is not None:
+            ipc_server.notify("outbound")   # the bridge fetches /approved_batch right away
+        elif SHARD.enabled and has_request_context():
+            g.outbound_ready = True         # the router pushes it (see _flag_outbound)
+    return entries
+
+def approve_items(items, texts=None):
+    """
+    Move approved items to the bridge's outbound queue and into history in one
+    batch. `texts` optionally overrides the reply per item id (edited replies).
+    The caller holds pending_queue.lock and saves afterwards.
+    """
+    texts = texts or {}
+    outbound = []
+    for item in items:
+        reply_text = texts.get(item["id"], item.get("reply", ""))  # this is localized
+        cache = item.get("reply_cache")
+        if cache and reply_text != item.get("reply"):
+            cache = dict(cache, base=reply_text)    # the operator's edit is what we keep
+        outbound.append({
             "jid": item.get("jid"),
-            "reply": item.get("reply", ""),   # this is localized
-            "images": item.get("images", [])
+            "reply": reply_text,
+            "images": item.get("images", []),
+            "user_msg": item.get("user_msg", ""),
+            "reply_cache": cache,
+            "approved": True,   # the operator's decision: goes out even if the contact writes again
         })
-        hist = memory.setdefault("chat_history", {}).setdefault(item["jid"], [])
-        hist.append({
-            "role": "assistant",
-            "content": item.get("reply", ""), # localized
-            "ts": datetime.now(timezone.utc).isoformat()
-        })
-        save_memory()
+    return queue_outbound(outbound)
+
+def bulk_response(action, items):
+    save_memory()
+    publish_pending(action, ids=[it["id"] for it in items])
+    if request.is_json or request.headers.get("X-Requested-With") == "XMLHttpRequest":
+        return jsonify(status="ok", count=len(items))
     return redirect(url_for("index"))
 
-@app.route("/approve_with_edit/<int:idx>", methods=["POST"])
-def approve_with_edit(idx):
-    pend = memory.get("pending_for_approval", [])
-    if 0 <= idx < len(pend):
-        item = pend.pop(idx)
-        
-        # ✅ FIX: Get the edited text from the form.
-        # It looks for "edited_reply", which is the name of your textarea.
-        # If for some reason it's empty, it safely falls back to the original reply.
-        edited_text = request.form.get("edited_reply", item.get("reply", ""))
+@app.route("/approve_reply/<item_id>", methods=["POST"])
+def approve_reply(item_id):
+    with pending_queue.lock:
+        item = pending_queue.pop(item_id)
+        if item:
+            approve_items([item])
+            save_memory()
+            publish_pending("removed", id=item_id, jid=item.get("jid"))
+    return redirect(url_for("index"))
 
-        # ✅ FIX: Use the 'edited_text' variable when adding to the approved queue.
-        memory.setdefault("pending_approved", []).append({
-            "jid": item.get("jid"),
-            "reply": edited_text,
-            "images": item.get("images", [])
-        })
-        
-        hist = memory.setdefault("chat_history", {}).setdefault(item["jid"], [])
-        # ✅ FIX: Use the 'edited_text' variable when saving to chat history.
-        hist.append({
-            "role": "assistant",
-            "content": edited_text,
-            "ts": datetime.now(timezone.utc).isoformat()
-        })
-        save_memory()
+@app.route("/approve_with_edit/<item_id>", methods=["POST"])
+def approve_with_edit(item_id):
+    with pending_queue.lock:
+        item = pending_queue.pop(item_id)
+        if item:
+            # ✅ FIX: Get the edited text from the form.
+            # It looks for "edited_reply", which is the name of your textarea.
+            # If for some reason it's empty, it safely falls back to the original reply.
+            edited_text = request.form.get("edited_reply", item.get("reply", ""))
+
+            # ✅ FIX: Use the 'edited_text' for both the approved queue and chat history.
+            approve_items([item], {item_id: edited_text})
+            save_memory()
+            publish_pending("removed", id=item_id, jid=item.get("jid"))
     return redirect(url_for("index"))
 
-@app.route("/reject_reply/<int:idx>", methods=["POST"])
-def reject_reply(idx):
-    if 0 <= idx < len(memory.get("pending_for_approval", [])):
-        memory["pending_for_approval"].pop(idx)
-        save_memory()
+@app.route("/reject_reply/<item_id>", methods=["POST"])
+def reject_reply(item_id):
+    with pending_queue.lock:
+        item = pending_queue.pop(item_id)
+        if item:
+            save_memory()
+            publish_pending("removed", id=item_id, jid=item.get("jid"))
     return redirect(url_for("index"))
 
-@app.route("/regenerate_reply/<int:idx>", methods=["POST"])
-def regenerate_reply(idx):
-    pend = memory.get("pending_for_approval", [])
-    if not (0 <= idx < len(pend)):
+# ─── Bulk operations: one transaction, one save, one batch to the bridge ───
+def selected_ids():
+    if request.is_json:
+        return (request.get_json(silent=True) or {}).get("ids", [])
+    return request.form.getlist("ids")
+
+@app.route("/pending/approve_selected", methods=["POST"])
+def approve_selected():
+    with pending_queue.lock:
+        items = pending_queue.pop_many(selected_ids())
+        approve_items(items)
+        return bulk_response("removed", items)
+
+@app.route("/pending/reject_selected", methods=["POST"])
+def reject_selected():
+    with pending_queue.lock:
+        items = pending_queue.pop_many(selected_ids())
+        return bulk_response("removed", items)
+
+@app.route("/pending/approve_contact/<path:jid>", methods=["POST"])
+def approve_contact(jid):
+    with pending_queue.lock:
+        items = pending_queue.pop_many(pending_queue.ids_for_jid(jid))
+        approve_items(items)
+        return bulk_response("removed", items)
+
+@app.route("/pending/reject_older_than", methods=["POST"])
+def reject_older_than():
+    data = request.get_json(silent=True) if request.is_json else request.form
+    try:
+        minutes = float((data or {}).get("minutes", 0))
+    except (TypeError, ValueError):
+        minutes = 0
+    if minutes <= 0:
+        return redirect(url_for("index"))
+    cutoff = time.time() - minutes * 60
+    with pending_queue.lock:
+        items = pending_queue.pop_many(pending_queue.ids_older_than(cutoff))
+        return bulk_response("removed", items)
+
+@app.route("/regenerate_reply/<item_id>", methods=["POST"])
+def regenerate_reply(item_id):
+    item = pending_queue.get(item_id)
+    if not item:
         return redirect(url_for("index"))
     instruction = request.form.get("instruction", "").strip()
-    item = pend[idx]
     jid = item["jid"]
     user_msg = item["user_msg"]
 
+    # no guidance: show the next alternate from the original call, if there are any
+    alternates = item.get("alternates") or []
+    if len(alternates) > 1 and (request.form.get("next") or not instruction):
+        return next_alternate(item_id, item)
+
     # keep any images already attached to this pending item
     keep_images = item.get("images", [])
 
     # build prompt
-    system = SYSTEM_BASE
-    if memory.get("my_profile"):
-        system += "\n\nFacts about Julio:\n" + "\n".join(f"- {f}" for f in memory["my_profile"])
-    if memory.get("personality_profile"):
-        system += "\n\nPersonality guidelines:\n" + "\n".join(f"- {t}" for t in memory["personality_profile"])
-    last10 = memory["chat_history"].get(jid, [])[-10:]
-    system += "\n\nRecent conversation:\n" + "\n".join(f"{m['role']}: {m['content']}" for m in last10)
+    system = build_system_prompt(jid)
 
     new_text = chat_complete(
         [
@@ -766,67 +1346,188 @@ def regenerate_reply(idx):
             {"role": "user",   "content": user_msg},
             {"role": "user",   "content": f"Regenerate the reply with this guidance: {instruction}"}
         ],
-        temperature=0.7, max_tokens=150, top_p=0.9
+        temperature=0.7, max_tokens=150, top_p=0.9, route="regenerate"
     )
-    pend[idx]["reply"] = new_text
-    pend[idx]["images"] = keep_images
-    save_memory()
+    with pending_queue.lock:
+        # the item may have been approved/rejected while the model was thinking
+        if pending_queue.get(item_id) is item:
+            pending_queue.update_many({item_id: {
+                "reply": new_text, "images": keep_images, "gap": None,
+                "alternates": [], "reply_cache": None,   # a guided one-off, not small talk to reuse
+            }})
+            save_memory()
+            publish_pending("updated", id=item_id, jid=jid)
     return redirect(url_for("index"))
 
+def next_alternate(item_id, item):
+    """Swap in the pending item's next stored alternate (no model call unless it needs translating)."""
+    alternates = item["alternates"]
+    idx = (item.get("alt_index", 0) + 1) % len(alternates)
+    alt = alternates[idx]
+    text = alt.get("text")
+    if text is None:
+        lang = item.get("lang") or "en"
+        text = translate_reply(alt["en"], lang) if lang != "en" else alt["en"]
+    alternates = list(alternates)
+    alternates[idx] = dict(alt, text=text)
+    fields = {
+        "reply": humanize_reply(item["user_msg"], text, memory, item["jid"]),
+        "reply_en": alt["en"],
+        "alternates": alternates,
+        "alt_index": idx,
+    }
+    if item.get("reply_cache"):
+        fields["reply_cache"] = dict(item["reply_cache"], base=text)
+    with pending_queue.lock:
+        if pending_queue.get(item_id) is item:
+            pending_queue.update_many({item_id: fields})
+            save_memory()
+            publish_pending("updated", id=item_id, jid=item["jid"])
+    return redirect(url_for("index"))
+
+@app.route("/events", methods=["GET"])
+def events():
+    """Server-Sent Events stream for the dashboard (notifications, pending changes)."""
+    q = event_bus.subscribe()
+    return Response(
+        stream_with_context(event_bus.stream(q)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.route("/pending", methods=["GET"])
 def get_pending():
     return jsonify({
-        "pending_for_approval": memory.get("pending_for_approval", []),
-        "approval_enabled": memory["settings"].get("approval_enabled", False)
+        "pending_for_approval": pending_queue.items(),
+        "approval_enabled": memory["settings"].get("approval_enabled", False),
+        "scheduled_sends": delivery_scheduler.stats(),
     })
 
 # Consumed by index.js poller; it will send images then the text.
+# Scheduled (humanized-delay) replies are released here once they are due.
 @app.route("/approved_batch", methods=["GET"])
 def approved_batch():
-    items = memory.get("pending_approved", [])
-    memory["pending_approved"] = []
-    save_memory()
+    with pending_queue.lock:
+        due = delivery_scheduler.pop_due()
+        for entry in due:
+            record_sent(entry)
+        items = [bridge_item(e) for e in due] + memory.get("pending_approved", [])
+        if items:
+            memory["pending_approved"] = []
+            save_memory()
     return jsonify(items=items)
 
+@app.route("/send_result", methods=["POST"])
+def send_result():
+    """The bridge's report on one outbound item (sender.js), after its retries."""
+    result = request.get_json(silent=True) or {}
+    jid = result.get("jid", "")
+    outcome = "ok" if result.get("ok") else "failed"
+    metrics.inc("outbound_sends_total", outcome=outcome)
+    metrics.inc("outbound_send_attempts_total", int(result.get("attempts") or 0))
+    metrics.observe("outbound_send_seconds", float(result.get("ms") or 0) / 1000)
+    for wa_id in result.get("wa_ids") or []:
+        sync_ledger.note(jid, wa_id)    # our own messages, as WhatsApp numbered them
+    if outcome == "failed":
+        print(f"[ERROR] Bridge could not deliver to {jid}: {result.get('error')}")
+        add_notification(jid, f"⚠️ Reply not delivered ({result.get('sent', 0)}/{result.get('parts', 0)} parts sent): {result.get('error')}")
+    return jsonify({"status": "ok"})
+
+# ─────────────────────────────────────────────────────────────────────────────
+# HISTORY SYNC (bridge)
+# ─────────────────────────────────────────────────────────────────────────────
+# The bridge (history_sync.js) asks for each contact's cursor, fetches the
+# chat from there with whatsapp-web.js and posts only the newer messages.
+# Inbound ones that arrived after our last message while we were offline
+# are "missed": flagged, and answered too if reply_missed is on.
+MISSED_REPLY_HOURS = float(os.getenv("MISSED_REPLY_HOURS", "24"))  # older missed messages are only flagged
+
+@app.route("/sync/cursors", methods=["GET"])
+def sync_cursors():
+    """{jid: cursor} for the enabled contacts (None: never synced)."""
+    return jsonify({c["jid"]: sync_ledger.cursor(c["jid"])
+                    for c in memory.get("allowed_contacts", []) if c.get("enabled")})
+
+@app.route("/sync/ingest", methods=["POST"])
+def sync_ingest():
+    """One contact's messages since its cursor: {jid, messages: [{id, fromMe, body, ts}]}."""
+    data = request.get_json(silent=True) or {}
+    jid = data.get("jid", "")
+    messages = [m for m in data.get("messages") or [] if isinstance(m, dict)]
+    if not any(c["jid"] == jid and c.get("enabled") for c in memory.get("allowed_contacts", [])):
+        return jsonify({"error": "unknown contact"}), 404
+    ensure_contact_struct(jid)
+
+    with metrics.span("sync_ingest"):
+        hist = memory["chat_history"].setdefault(jid, [])
+        # never synced: what the history already covers (uploads, live traffic) counts as known
+        floor = None
+        if sync_ledger.cursor(jid) is None and hist:
+            floor = ts_epoch(hist[-1].get("ts"))
+        fresh = select_new(jid, messages, sync_ledger, hist[-50:], floor=floor)
+        in_order = True
+        for msg, entry in fresh:
+            # history stays in timestamp order (archive, keyset pages and search rely on it)
+            in_order = insert_by_ts(hist, entry) and in_order
+            sync_ledger.note(jid, msg.get("id"))
+        newest = max((float(m.get("ts") or 0) for m in messages), default=None)
+        if newest:
+            sync_ledger.note(jid, None, newest)
+
+        # the new inbound messages newer than our last reply (older ones were answered)
+        missed = missed_since_reply(hist, [entry for _, entry in fresh])
+        if fresh:
+            contact_rows.refresh(jid)
+            if in_order:
+                search_index.schedule(jid)
+            else:
+                search_index.reindex(jid)   # positions after the inserted messages moved
+            maybe_schedule_profile_update(jid)
+
+    metrics.inc("sync_messages_total", len(fresh), outcome="added")
+    metrics.inc("sync_messages_total", len(messages) - len(fresh), outcome="duplicate")
+    out = {"added": len(fresh), "duplicates": len(messages) - len(fresh),
+           "cursor": sync_ledger.cursor(jid), "missed": len(missed)}
+    if missed:
+        memory.setdefault("missed_messages", {})[jid] = [{"content": m["content"], "ts": m["ts"]} for m in missed]
+        metrics.inc("sync_missed_total", len(missed))
+        newest_missed = ts_epoch(missed[-1]["ts"]) or 0
+        if memory["settings"].get("reply_missed") and time.time() - newest_missed < MISSED_REPLY_HOURS * 3600:
+            out["reply_to"] = "\n".join(m["content"] for m in missed)
+        else:
+            add_notification(jid, f"📭 {len(missed)} message(s) arrived while the bot was offline: “{missed[-1]['content'][:60]}”")
+    if fresh:
+        print(f"[INFO] Synced {len(fresh)} message(s) for {jid} ({len(missed)} missed)")
+    save_memory()
+    return jsonify(out)
+
 # ─────────────────────────────────────────────────────────────────────────────
 # SUMMARIES
 # ─────────────────────────────────────────────────────────────────────────────
 @app.route("/summary/<path:jid>", methods=["GET"])
 def summary(jid):
-    hist = memory.get("chat_history", {}).get(jid, [])
-    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in hist)
-    text = chat_complete(
-        [
-            {"role":"system","content":
-             "Summarize the most important personal details and personality traits from this conversation."},
-            {"role":"user","content":transcript}
-        ],
-        temperature=0.3, max_tokens=300, top_p=1.0
-    )
-    return jsonify(summary=text)
+    """The last finished summary (may trail the newest messages); a fresh one is being built."""
+    prompt = "Summarize the most important personal details and personality traits from this conversation."
+    summarize_later(jid, prompt, max_tokens=300)
+    return jsonify(summary=summary_cache.latest(jid, prompt), updating=True)
 
 @app.route("/generate_contact_summary/<path:jid>", methods=["POST"])
 def generate_contact_summary(jid):
-    hist = memory.get("chat_history", {}).get(jid, [])
-    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in hist[-40:])
+    def done(summary):
+        profiles = memory.setdefault("person_profiles", {})
+        profile = profiles.setdefault(jid, {})
+        profile["summary"] = summary
+        profile["last_summarized"] = datetime.now(timezone.utc).isoformat()
+        save_memory()
+        add_notification(jid, "📝 Profile summary updated.")
 
-    summary = chat_complete(
-        [
-            {"role": "system", "content": "Summarize the important details, personality traits, and context."},
-            {"role": "user", "content": transcript},
-        ],
-        temperature=0.4,
-        max_tokens=250,
-        top_p=0.9,
+    summarize_later(
+        jid,
+        "Summarize the important details, personality traits, and context.",
+        max_tokens=250, done=done,
     )
 
-    profiles = memory.setdefault("person_profiles", {})
-    profile = profiles.setdefault(jid, {})
-    profile["summary"] = summary
-    profile["last_summarized"] = datetime.now(timezone.utc).isoformat()
-    save_memory()
-
-    # Instead of JSON, refresh profile page
+    # Instead of JSON, refresh profile page (the summary shows up once it's ready)
     return redirect(url_for("show_contact_profile", jid=jid))
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -879,46 +1580,62 @@ def upload_chat():
 @app.route("/")
 def index():
     return render_template("index.html",
-        my_profile=memory["my_profile"],
-        personality_profile=memory["personality_profile"],
-        allowed_contacts=memory["allowed_contacts"],
-        pending_for_approval=memory["pending_for_approval"],
         approval_enabled=memory["settings"].get("approval_enabled", False),
-        contacts_info=memory.get("contacts_info", {}),
-        self_labels=memory["settings"].get("self_labels", ["You"]),
-        date_day_first=memory["settings"].get("date_day_first", False)
+        humanized_delay=memory["settings"].get("humanized_delay", False),
+        reply_cache_on=memory["settings"].get("reply_cache", False),
+        reply_alternates=memory["settings"].get("reply_alternates", False),
+        reply_missed=memory["settings"].get("reply_missed", False),
+        alternates_count=REPLY_ALTERNATES,
+        reply_cache_stats=reply_cache.report()["global"],
+        scheduled_count=len(delivery_scheduler),
+        notifications=notification_ring.unseen()
     )
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+# AUTOMATIC PROFILE LEARNING (background)
+# ─────────────────────────────────────────────────────────────────────────────
+PROFILE_UPDATE_EVERY = 20   # new messages before a contact's profile is refreshed
+PROFILE_FIRST_CONTEXT = 40  # messages considered on a contact's first update
+PROFILE_MAX_NEW = 200       # cap on new messages sent in one update
+PROFILE_RETRY_SECONDS = 600 # after a failed model call, no new update for this contact until then
+
 def update_contact_profile_with_ai(jid):
     """
-    Analyzes recent conversation and automatically refines the contact's
-    'info' and 'style' profile fields.
+    Refines the contact's 'info' and 'style' profile fields from the messages
+    that arrived since the last update (contact_info["profile_cursor"]).
+    Runs on the profile learner's worker thread.
     """
     print(f"[INFO] Running automatic profile update for {jid}...")
     try:
         profiles = memory.setdefault("person_profiles", {})
         profile = profiles.setdefault(jid, {"info": "", "style": "", "summary": ""})
+        contact_info = memory.setdefault("contacts_info", {}).setdefault(jid, {})
         
         current_info = profile.get("info", "")
         current_style = profile.get("style", "")
         
-        # Get the last 40 messages for context
-        transcript = "\n".join(
-            f"{m['role']}: {m['content']}" 
-            for m in memory.get("chat_history", {}).get(jid, [])[-40:]
-        )
+        # Only the messages since the last processed position
+        end = contact_store.history_len(jid)
+        start = max(contact_info.get("profile_cursor", 0), end - PROFILE_MAX_NEW)
+        new_msgs = []
+        for pos, m in contact_store.iter_positions(jid, start=start):
+            if pos >= end:
+                break
+            new_msgs.append(m)
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in new_msgs)
 
         if not transcript.strip():
-            print(f"[INFO] No transcript for {jid}, skipping profile update.")
+            print(f"[INFO] No new messages for {jid}, skipping profile update.")
+            contact_info["profile_cursor"] = end
             return
 
         prompt = f"""
-You are a profile analyst AI. Your job is to refine a contact's profile based on recent conversation.
+You are a profile analyst AI. Your job is to refine a contact's profile based on the newest messages of a conversation.
 Analyze the provided transcript and update the existing 'info' and 'style' sections.
 
 **RULES:**
-1.  **Refine, Don't Replace:** Integrate new learnings into the existing text. Do not remove existing user-written notes unless they are explicitly contradicted in the conversation.
+1.  **Refine, Don't Replace:** Integrate new learnings into the existing text. Do not remove existing notes unless they are explicitly contradicted in the new messages.
 2.  **'Info' is for Facts:** Extract concrete, objective facts about the person (e.g., job, family, plans, preferences).
 3.  **'Style' is for Communication:** Analyze their linguistic style (e.g., formality, emoji use, sentence length, common phrases, tone).
 4.  **Output JSON:** Respond ONLY with a valid JSON object with two keys: "updated_info" and "updated_style".
@@ -933,7 +1650,7 @@ Analyze the provided transcript and update the existing 'info' and 'style' secti
 {current_style}
 ---
 
-**RECENT CONVERSATION TRANSCRIPT:**
+**NEW MESSAGES SINCE THE LAST UPDATE:**
 ---
 {transcript}
 ---
@@ -944,11 +1661,22 @@ Now, provide the complete, updated profile sections in a single JSON object.
         response_str = chat_complete(
             [{"role": "system", "content": prompt}],
             temperature=0.4,
-            max_tokens=500
+            max_tokens=500,
+            route="profile"
         )
         
-        # Safely parse the JSON response
-        updates = json.loads(response_str)
+        # Safely parse the JSON response (tolerate ```json fences)
+        response_str = re.sub(r"^```(?:json)?\s*|\s*```$", "", response_str.strip())
+        try:
+            updates = json.loads(response_str)
+            if not isinstance(updates, dict):
+                raise ValueError("not a JSON object")
+        except ValueError as e:
+            # asking again about the same messages with every new one won't fix it: move on
+            print(f"[ERROR] Unusable profile update for {jid} ({e}), skipping these messages.")
+            contact_info["profile_cursor"] = end
+            save_memory()
+            return
         new_info = updates.get("updated_info")
         new_style = updates.get("updated_style")
 
@@ -962,18 +1690,62 @@ Now, provide the complete, updated profile sections in a single JSON object.
             add_notification(jid, "🤖 AI automatically updated the 'Style' profile.")
             print(f"[SUCCESS] Updated 'style' for {jid}.")
 
+        contact_info["profile_cursor"] = end
+        profile["last_auto_update"] = datetime.now(timezone.utc).isoformat()
+        save_memory()
+
     except Exception as e:
         print(f"[ERROR] Failed to automatically update profile for {jid}: {e}")
+        memory.setdefault("contacts_info", {}).setdefault(jid, {})["profile_retry_at"] = time.time() + PROFILE_RETRY_SECONDS
+
+_replies_in_flight = 0
+_inflight_lock = threading.Lock()
+
+@app.before_request
+def _count_reply_start():
+    global _replies_in_flight
+    if request.endpoint == "reply":
+        with _inflight_lock:
+            _replies_in_flight += 1
+
+@app.teardown_request
+def _count_reply_end(exc=None):
+    global _replies_in_flight
+    if request.endpoint == "reply":
+        with _inflight_lock:
+            _replies_in_flight -= 1
+
+profile_learner = ProfileLearner(
+    update_contact_profile_with_ai,
+    max_workers=int(os.getenv("PROFILE_LEARNER_WORKERS", "1")),
+    debounce=float(os.getenv("PROFILE_LEARNER_DEBOUNCE", "30")),
+    is_busy=lambda: _replies_in_flight > 0,
+)
+
+def maybe_schedule_profile_update(jid):
+    """Queue a background profile refresh once enough new messages piled up."""
+    contact_info = memory.setdefault("contacts_info", {}).setdefault(jid, {})
+    total = contact_store.history_len(jid)
+    if "profile_cursor" not in contact_info:
+        # first time: let the first update look at the recent conversation
+        contact_info["profile_cursor"] = max(0, total - PROFILE_FIRST_CONTEXT)
+    if time.time() < contact_info.get("profile_retry_at", 0):
+        return      # the last update failed; back off instead of retrying with every message
+    if total - contact_info["profile_cursor"] >= PROFILE_UPDATE_EVERY:
+        profile_learner.schedule(jid)
+
 # ─────────────────────────────────────────────────────────────────────────────
 # REPLY ENDPOINT (context-aware)
 # ─────────────────────────────────────────────────────────────────────────────
 @app.route("/reply", methods=["POST"])
 def reply():
     try:
-        refresh_images()
+        with metrics.span("refresh_images"):
+            refresh_images()
         data = request.get_json(force=True)
         jid = data.get("sender") or data.get("jid")
         msg = (data.get("message") or data.get("text") or "").strip()
+        wa_id, wa_ts = data.get("id"), data.get("ts")
         # ADD THIS LINE
         if not msg:
             return jsonify(reply="") # Ignore empty messages
@@ -989,11 +1761,36 @@ def reply():
         images_to_send = []
         user_msg_for_approval = msg  # Save original message for the approval queue
 
-        hist = memory.setdefault("chat_history", {}).setdefault(jid, [])
-        hist.append({"role": "user", "content": msg, "ts": datetime.now(timezone.utc).isoformat()})
+        synced = bool(data.get("synced"))
+        if not synced and wa_id and sync_ledger.seen(jid, wa_id):
+            # replayed by the bridge after /sync/ingest (or an earlier /reply) logged it
+            hist = memory["chat_history"].setdefault(jid, [])
+            if answered_after(hist, msg):
+                return jsonify(reply="")
+            synced = True
+        if synced:
+            # missed while offline: /sync/ingest already put it in the history
+            hist = memory["chat_history"].setdefault(jid, [])
+        else:
+            hist = append_history(jid, "user", msg, ts=wa_ts_iso(wa_ts) if wa_ts else None)
+        if wa_id:
+            sync_ledger.note(jid, wa_id)    # so the next history sync skips it
+        memory.setdefault("missed_messages", {}).pop(jid, None)
         # Note: Save memory once here to log the user message immediately
         save_memory()
 
+        # Profile learning runs in the background, never on this request
+        maybe_schedule_profile_update(jid)
+
+        # An auto reply still waiting out its typing delay is stale now that the contact
+        # wrote again; replies the operator approved still go out
+        dropped = delivery_scheduler.cancel_jid(jid, where=lambda it: not it.get("approved"))
+        if dropped:
+            print(f"[INFO] Cancelled {len(dropped)} scheduled send(s) to {jid}: contact wrote again")
+
+        # Mood, topic and objective keywords, found in one pass over the message
+        hits = scan_keywords(jid, msg)
+
         # ---------------------------------------------------------------------
         # Section 1: Rule-Based Logic (No direct returns!)
         # ---------------------------------------------------------------------
@@ -1001,7 +1798,7 @@ def reply():
         # Rule 1: "what are you doing" (Guatemala time)
         if WYD_RE.search(msg):
             tz = memory["settings"].get("timezone", "America/Guatemala")
-            now = datetime.now(pytz.timezone(tz))
+            now = datetime.now(get_tz(tz))
             hour = now.hour
             if 12 <= hour < 13:
                 final_reply = "I’m on lunch break right now, back to work at 1 PM."
@@ -1011,7 +1808,7 @@ def reply():
         # Rule 2: Clock question
         elif re.search(r"\b(?:what(?:'s| is)? the time|current time)\b", msg, re.I):
             tz = memory["settings"].get("timezone", "America/Guatemala")
-            now = datetime.now(pytz.timezone(tz))
+            now = datetime.now(get_tz(tz))
             final_reply = f"The current time in Guatemala is {now.strftime('%I:%M %p').lstrip('0')}."
 
         # Rule 3: Reset image flow
@@ -1049,136 +1846,150 @@ def reply():
                 else:
                     final_reply = "Do you mean more photos? If so, say the word 'photos' and I’ll send some 📸"
         
+
         # ---------------------------------------------------------------------
-        # Section 2: GPT-Powered Logic (only if no rule was met)
+        # Section 2: Reply cache for near-duplicate small talk (optional)
         # ---------------------------------------------------------------------
+        reply_cache_entry = None  # what the reply cache learns once this reply is sent
+        blocked_on_gap = None     # knowledge-gap topic the model asked for (NEED_INFO)
+        alternates = []           # other candidates from the same model call, for Regenerate
         if final_reply is None:
-            # ... inside the 'if final_reply is None:' block ...
-            system = SYSTEM_BASE
-            if memory.get("my_profile"):
-                system += "\n\nFacts about Julio:\n" + "\n".join(f"- {f}" for f in memory["my_profile"])
-            if memory.get("personality_profile"):
-                system += "\n\nPersonality guidelines:\n" + "\n".join(f"- {t}" for t in memory["personality_profile"])
-
-            # ✅ NEW: Add contact-specific info and style from their profile
-            profiles = memory.get("person_profiles", {})
-            contact_profile = profiles.get(jid, {})
-            if contact_profile.get("info"):
-                system += f"\n\nIMPORTANT FACTS TO REMEMBER ABOUT THIS PERSON:\n{contact_profile['info']}"
-            if contact_profile.get("style"):
-                system += f"\n\nADOPT THIS SPECIFIC STYLE FOR THIS PERSON:\n{contact_profile['style']}"
-
-            last10 = memory["chat_history"][jid][-10:]
-            system += "\n\nRecent conversation:\n" + "\n".join(f"{m['role']}: {m['content']}" for m in last10)
-
-            lang, _ = langid.classify(msg)
-
-            raw_reply_en = chat_complete(
-                [{"role": "system", "content": system},
-                 {"role": "user", "content": f"(Reply in English only)\n\n{msg}"}],
-                temperature=0.7, max_tokens=150, top_p=0.9
-            )
+            with metrics.span("lang_detect"):
+                lang = safe_detect_lang(msg, jid)
+            ctx = reply_context(lang, hits)
+            if memory["settings"].get("reply_cache"):
+                with metrics.span("reply_cache"):
+                    cached = reply_cache.lookup(jid, msg, ctx, avoid=recent_replies(jid),
+                                                saves=1 if lang == "en" else 2)
+                if cached:
+                    with metrics.span("humanize"):
+                        final_reply = humanize_reply(msg, cached, memory, jid, hits=hits)
+                    # not learned again: that would renew its ts, and a reply that
+                    # keeps hitting would never age out of the window
+
+        # ---------------------------------------------------------------------
+        # Section 3: GPT-Powered Logic (only if no rule or cached reply was met)
+        # ---------------------------------------------------------------------
+        if final_reply is None:
+            with metrics.span("prompt"):
+                system = build_system_prompt(jid)
+
+            # Going to the approval queue: sample a few alternates in the same
+            # request, so Regenerate can cycle through them without a model call
+            n = 1
+            if memory["settings"].get("approval_enabled") and memory["settings"].get("reply_alternates"):
+                n = REPLY_ALTERNATES
+            with metrics.span("model_reply"):
+                candidates = chat_candidates(
+                    [{"role": "system", "content": system},
+                     {"role": "user", "content": f"(Reply in English only)\n\n{msg}"}],
+                    n, temperature=0.7, max_tokens=150, top_p=0.9,
+                    route="reply", complex=is_complex(msg, hits)
+                )
+            raw_reply_en = candidates[0]
 
             if raw_reply_en.startswith("[NEED_INFO:"):
                 missing_topic = raw_reply_en.replace("[NEED_INFO:", "").replace("]", "").strip()
-                memory.setdefault("knowledge_gaps", []).append(missing_topic)
+                gaps = memory.setdefault("knowledge_gaps", [])
+                if not any(normalize_gap(g) == normalize_gap(missing_topic) for g in gaps):
+                    gaps.append(missing_topic)
                 final_reply = f"(⚠️ Missing info: {missing_topic})"
+                blocked_on_gap = missing_topic
             else:
                 reply_translated = raw_reply_en
                 if lang != "en":
-                    reply_translated = chat_complete(
-                        [
-                            {"role": "system", "content": "Translate naturally, keep tone conversational."},
-                            {"role": "user", "content": f"Translate to natural {lang.upper()}:\n\n{raw_reply_en}"}
-                        ],
-                        temperature=0.7, max_tokens=200, top_p=0.9
-                    )
-                final_reply = humanize_reply(msg, reply_translated, memory, jid)
+                    reply_translated = translate_reply(raw_reply_en, lang)
+                with metrics.span("humanize"):
+                    final_reply = humanize_reply(msg, reply_translated, memory, jid, hits=hits)
+                reply_cache_entry = {"ctx": ctx, "base": reply_translated}
+
+                # alternates are translated only if the operator cycles to them
+                others = [c for c in dict.fromkeys(candidates[1:])
+                          if c and c != raw_reply_en and not c.startswith("[NEED_INFO:")]
+                if others:
+                    alternates = [{"en": raw_reply_en, "text": reply_translated}] + [{"en": c} for c in others]
 
         # ───────────────────────────────────────────────────────────────────
         # FINAL EXIT POINT: All replies must pass through here.
         # ───────────────────────────────────────────────────────────────────
         if final_reply:
             if memory["settings"].get("approval_enabled"):
-                memory.setdefault("pending_for_approval", []).append({
+                item = pending_queue.add({
                     "jid": jid,
                     "user_msg": user_msg_for_approval,
                     "reply": final_reply,
-                    "images": images_to_send
+                    "images": images_to_send,
+                    "reply_cache": reply_cache_entry,
+                    "gap": blocked_on_gap,
+                    "alternates": alternates,
+                    "lang": lang if alternates else None,
                 })
                 save_memory()
+                publish_pending("added", id=item["id"], jid=jid)
                 return jsonify(reply="")
             else:
-                # Approval is OFF, send directly
-                hist.append({"role": "assistant", "content": final_reply, "ts": datetime.now(timezone.utc).isoformat()})
-                
-                # If we are sending images, log them now
-                if images_to_send:
-                    memory.setdefault("images_sent", {}).setdefault(jid, []).extend(images_to_send)
+                # Approval is OFF, send directly (or after a humanized typing delay)
+                outgoing = {
+                    "jid": jid,
+                    "reply": final_reply,
+                    "images": images_to_send,
+                    "user_msg": msg,
+                    "log_images": True,
+                    "reply_cache": reply_cache_entry,
+                }
+                delayed = memory["settings"].get("humanized_delay", False)
+                if delayed:
+                    queue_outbound([outgoing])  # the bridge picks it up from /approved_batch
+                else:
+                    record_sent(outgoing)
 
                 # Check for objective progress (only when sending automatically)
-                objectives = memory.get("contacts_info", {}).get(jid, {}).get("objectives", [])
-                for obj in objectives:
-                    if obj.get("status") != "in_progress": continue
+                with metrics.span("objectives"):
+                    objectives = memory.get("contacts_info", {}).get(jid, {}).get("objectives", [])
+                    for obj in objectives:
+                        if obj.get("status") != "in_progress": continue
                     
-                    progress_made = False
-                    if obj["type"] == "linguistic":
-                        key_terms = [w.strip().lower() for w in obj["description"].split() if len(w) > 3]
-                        if any(term in msg.lower() for term in key_terms):
-                            progress_made = True
-                            obj["notes"].append(f"Matched linguistic cue in message: '{msg}'")
+                        progress_made = False
+                        if obj["type"] == "linguistic":
+                            if f"objective:{obj['id']}" in hits:
+                                progress_made = True
+                                obj["notes"].append(f"Matched linguistic cue in message: '{msg}'")
                     
-                    elif obj["type"] == "behavioral":
-                        progress_detected = chat_complete(
-                            [
-                                {"role": "system", "content": "You are a precise behavior progress detector."},
-                                {"role": "user", "content": f"Objective: {obj['description']}\nMessage: {msg}\nDoes this message show progress? Reply only 'yes' or 'no'."}
-                            ],
-                            temperature=0.1, max_tokens=3
-                        ).strip().lower()
-                        if "yes" in progress_detected:
-                            progress_made = True
-                            obj["notes"].append(f"Behavioral cue detected in message: '{msg}'")
+                        elif obj["type"] == "behavioral":
+                            progress_detected = chat_complete(
+                                [
+                                    {"role": "system", "content": "You are a precise behavior progress detector."},
+                                    {"role": "user", "content": f"Objective: {obj['description']}\nMessage: {msg}\nDoes this message show progress? Reply only 'yes' or 'no'."}
+                                ],
+                                temperature=0.1, max_tokens=3, route="classify"
+                            ).strip().lower()
+                            if "yes" in progress_detected:
+                                progress_made = True
+                                obj["notes"].append(f"Behavioral cue detected in message: '{msg}'")
                     
-                    if progress_made:
-                        obj["progress"] = obj.get("progress", 0) + 1
-                        if obj["progress"] >= obj.get("occurrences_needed", 5):
-                            obj["status"] = "completed"
-                            add_notification(jid, f"✅ Objective completed: “{obj['description']}”")
+                        if progress_made:
+                            obj["progress"] = obj.get("progress", 0) + 1
+                            if obj["progress"] >= obj.get("occurrences_needed", 5):
+                                obj["status"] = "completed"
+                                add_notification(jid, f"✅ Objective completed: “{obj['description']}”")
+                contact_rows.refresh(jid)
 
                 save_memory()
+                if delayed:
+                    return jsonify(reply="")
                 return jsonify(reply=final_reply, images=images_to_send)
 
         # If no reply was generated, return empty
         return jsonify(reply="")
 
-
-    # ... inside reply(), right before the 'except' block ...
-
-        # ---------------------------------------------------------------------
-        # Section 3: Automatic Profile Update Trigger
-        # ---------------------------------------------------------------------
-        contact_info = memory.setdefault("contacts_info", {}).setdefault(jid, {})
-        counter = contact_info.get("messages_since_profile_update", 0) + 1
-        contact_info["messages_since_profile_update"] = counter
-
-        # Trigger the update every 20 messages
-        if counter >= 20:
-            update_contact_profile_with_ai(jid)
-            contact_info["messages_since_profile_update"] = 0 # Reset counter
-        
-        save_memory() # Final save before returning
-        
-        # This should be the last part of the 'try' block
-        if final_reply and not memory["settings"].get("approval_enabled"):
-             return jsonify(reply=final_reply, images=images_to_send)
-        else:
-             return jsonify(reply="")
-             
     except Exception as e:
         traceback.print_exc()
         return jsonify(reply=f"Error: {e}"), 500
 
+# Pending replies blocked on a knowledge gap are regenerated on this pool once it is filled
+REGEN_WORKERS = int(os.getenv("REGEN_WORKERS", "8"))
+regen_pool = ThreadPoolExecutor(max_workers=REGEN_WORKERS, thread_name_prefix="regen")
+
 @app.route("/add_knowledge_gap", methods=["POST"])
 def add_knowledge_gap():
     gap_key = request.form.get("gap", "").strip()
@@ -1194,81 +2005,223 @@ def add_knowledge_gap():
         memory.setdefault("my_profile", []).append(entry)
     elif target == "personality":
         memory.setdefault("personality_profile", []).append(entry)
-        add_notification("system", f"🧩 Knowledge gap filled: “{gap_key}” → “{gap_value}”")
+        # sharded: every shard gets this request (to regenerate its own pending
+        # replies), but only the primary announces it
+        if SHARD.is_primary:
+            add_notification("system", f"🧩 Knowledge gap filled: “{gap_key}” → “{gap_value}”")
 
 
     # ✅ Remove gap from knowledge_gaps
-    if gap_key in memory.get("knowledge_gaps", []):
-        memory["knowledge_gaps"].remove(gap_key)
-
-    # ✅ Regenerate replies that were blocked by this gap
-    pending = memory.get("pending_for_approval", [])
-    for item in pending:
-        if "Missing info" in item["reply"] or "[NEED_INFO" in item["reply"]:
-            jid = item["jid"]
-            msg = item["user_msg"]
+    memory["knowledge_gaps"] = [
+        g for g in memory.get("knowledge_gaps", []) if normalize_gap(g) != normalize_gap(gap_key)
+    ]
 
-            try:
-                # Build updated system prompt
-                system = SYSTEM_BASE
-                if memory.get("my_profile"):
-                    system += "\n\nFacts about Julio:\n" + "\n".join(f"- {f}" for f in memory["my_profile"])
-                if memory.get("personality_profile"):
-                    system += "\n\nPersonality guidelines:\n" + "\n".join(f"- {t}" for t in memory["personality_profile"])
-                last10 = memory["chat_history"].get(jid, [])[-10:]
-                system += "\n\nRecent conversation:\n" + "\n".join(f"{m['role']}: {m['content']}" for m in last10)
-
-                # Fresh GPT reply (English first)
-                raw_reply_en = chat_complete(
-                    [{"role": "system", "content": system},
-                     {"role": "user", "content": f"(Reply in English only)\n\n{msg}"}],
-                    temperature=0.7, max_tokens=150, top_p=0.9
-                )
+    # ✅ Regenerate only the replies that were blocked by this gap, concurrently,
+    # then swap them into the queue in one step
+    blocked = pending_queue.blocked_on(gap_key)
+    if blocked:
+        t = time.perf_counter()
+        results = list(regen_pool.map(lambda it: regenerate_blocked(it, gap_key), blocked))
+        with pending_queue.lock:
+            # skip items approved/rejected while the model was thinking
+            changes = {it["id"]: fields for it, fields in zip(blocked, results)
+                       if pending_queue.get(it["id"]) is it}
+            updated = pending_queue.update_many(changes)
+        gaps = memory["knowledge_gaps"]
+        for fields in changes.values():
+            topic = fields["gap"]
+            if topic and not any(normalize_gap(g) == normalize_gap(topic) for g in gaps):
+                gaps.append(topic)
+        print(f"[INFO] Regenerated {len(updated)} pending repl(ies) for “{gap_key}” in {time.perf_counter() - t:.1f}s")
 
-                # Detect language
-                try:
-                    lang = safe_detect_lang(msg)
-                except Exception:
-                    lang = "en"
+    # ✅ Save updated memory
+    save_memory()
+    publish_pending("updated")
 
-                # Translate if needed
-                if lang != "en":
-                    reply_final = chat_complete(
-                        [
-                            {"role": "system", "content": "Translate naturally, keep tone conversational and human."},
-                            {"role": "user", "content": f"Translate the following English reply into natural {lang.upper()}, keep it conversational and romantic:\n\n{raw_reply_en}"}
-                        ],
-                        temperature=0.7, max_tokens=150, top_p=0.9
-                    )
-                else:
-                    reply_final = raw_reply_en
+    return redirect(url_for("dashboard"))
 
-                # Humanize
-                reply_final = humanize_reply(msg, reply_final, memory, jid)
+def regenerate_blocked(item, gap):
+    """New reply fields for a pending item whose knowledge gap was just filled (runs in regen_pool)."""
+    jid = item["jid"]
+    msg = item["user_msg"]
+    try:
+        # Fresh GPT reply (English first)
+        raw_reply_en = chat_complete(
+            [{"role": "system", "content": build_system_prompt(jid)},
+             {"role": "user", "content": f"(Reply in English only)\n\n{msg}"}],
+            temperature=0.7, max_tokens=150, top_p=0.9,
+            route="reply", complex=is_complex(msg, scan_keywords(jid, msg))
+        )
+        if raw_reply_en.startswith("[NEED_INFO:"):
+            # still missing something (maybe another fact): stay blocked on that
+            missing_topic = raw_reply_en.replace("[NEED_INFO:", "").replace("]", "").strip()
+            return {"reply_en": raw_reply_en, "reply": f"(⚠️ Missing info: {missing_topic})", "gap": missing_topic}
+
+        # Detect language (same path as reply(); don't re-learn the prior)
+        lang = safe_detect_lang(msg, jid, learn=False)
+
+        # Translate if needed
+        if lang != "en":
+            reply_final = chat_complete(
+                [
+                    {"role": "system", "content": "Translate naturally, keep tone conversational and human."},
+                    {"role": "user", "content": f"Translate the following English reply into natural {lang.upper()}, keep it conversational and romantic:\n\n{raw_reply_en}"}
+                ],
+                temperature=0.7, max_tokens=150, top_p=0.9, route="translate"
+            )
+        else:
+            reply_final = raw_reply_en
 
-                # ✅ Always update the pending item
-                item["reply_en"] = raw_reply_en
-                item["reply"] = reply_final
+        # Humanize
+        reply_final = humanize_reply(msg, reply_final, memory, jid)
+        print(f"[INFO] Regenerated reply for {jid}: {reply_final[:60]}...")
+        return {"reply_en": raw_reply_en, "reply": reply_final, "gap": None}
 
-                print(f"[INFO] Regenerated reply for {jid}: {reply_final[:60]}...")
+    except Exception as e:
+        print(f"[ERROR] Failed to regenerate reply for {jid}: {e}")
+        # ✅ Fallback reply instead of leaving NEED_INFO
+        return {
+            "reply_en": "(Could not regenerate reply)",
+            "reply": f"(Could not regenerate reply, but I saved your fact about {gap}.)",
+            "gap": None,
+        }
 
-            except Exception as e:
-                print(f"[ERROR] Failed to regenerate reply for {jid}: {e}")
-                # ✅ Fallback reply instead of leaving NEED_INFO
-                item["reply_en"] = "(Could not regenerate reply)"
-                item["reply"] = f"(Could not regenerate reply, but I saved your fact about {gap_key}.)"
 
-    # ✅ Save updated memory
-    save_memory()
 
-    return redirect(url_for("dashboard"))
+# ─────────────────────────────────────────────────────────────────────────────
+# METRICS & TRACING
+# ─────────────────────────────────────────────────────────────────────────────
+# Requests slower than this are logged with their per-stage breakdown
+metrics.slow_request_seconds = float(os.getenv("SLOW_REQUEST_MS", "2000")) / 1000
+UNTRACED_ENDPOINTS = {"events", "metrics", "static", None}
+
+@app.before_request
+def _trace_start():
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        metrics.begin_request(request.endpoint)
+
+@app.after_request
+def _trace_end(response):
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        metrics.end_request(response.status_code, request.path)
+    return response
+
+@app.teardown_request
+def _trace_abort(exc=None):
+    metrics.end_request("error", request.path)  # no-op unless after_request was skipped
+
+metrics.gauge("summary_cache_hits_total", lambda: summary_cache.hits, "Summary chunks served from cache", kind="counter")
+metrics.gauge("summary_cache_misses_total", lambda: summary_cache.misses, "Summary chunks sent to the model", kind="counter")
+metrics.gauge("lang_cache_hits_total", lambda: lang_service.cache_info().hits, "Language detections served from cache", kind="counter")
+metrics.gauge("lang_cache_misses_total", lambda: lang_service.cache_info().misses, "Language detections computed", kind="counter")
+metrics.gauge("contacts_loaded_total", lambda: contact_store.loads, "Contact files loaded from disk", kind="counter")
+metrics.gauge("profile_updates_total", lambda: profile_learner.runs, "Background profile updates run", kind="counter")
+metrics.gauge("pending_approval", lambda: len(pending_queue), "Replies waiting for approval")
+metrics.gauge("scheduled_sends", lambda: len(delivery_scheduler), "Replies waiting out their typing delay")
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
+# ─────────────────────────────────────────────────────────────────────────────
+# ON-DEMAND PROFILER
+# ─────────────────────────────────────────────────────────────────────────────
+PROFILES_DIR = os.path.join(DATA_DIR, "profiles")
+request_profiler = RequestProfiler(PROFILES_DIR, keep=int(os.getenv("PROFILE_KEEP", "30")))
+request_profiler.configure(os.getenv("PROFILE_EVERY_N", "0"), os.getenv("PROFILE_JID"))
+
+@app.before_request
+def _profile_start():
+    if not request_profiler.active or request.endpoint in UNTRACED_ENDPOINTS:
+        return
+    body = request.get_json(silent=True) if request.is_json else None
+    jid = (body or {}).get("sender") or (body or {}).get("jid") or (request.view_args or {}).get("jid")
+    g.profile_session = request_profiler.maybe_start(request.endpoint, jid)
+
+@app.teardown_request
+def _profile_end(exc=None):
+    session = g.pop("profile_session", None)
+    if session is not None:
+        request_profiler.finish(session)
+
+@app.route("/profiler", methods=["GET"])
+def profiler_page():
+    return render_template(
+        "profiler.html",
+        every_n=request_profiler.every_n,
+        profile_jid=request_profiler.jid or "",
+        profiles=request_profiler.recent(),
+    )
 
+@app.route("/profiler/configure", methods=["POST"])
+def profiler_configure():
+    if request.form.get("action") == "off":
+        request_profiler.configure(0, None)
+    else:
+        try:
+            every_n = int(request.form.get("every_n") or 0)
+        except ValueError:
+            every_n = 0
+        request_profiler.configure(every_n, request.form.get("jid"))
+    return redirect(url_for("profiler_page"))
+
+@app.route("/profiler/file/<path:name>", methods=["GET"])
+def profiler_file(name):
+    return send_from_directory(PROFILES_DIR, name, as_attachment=True)
+
+@app.route("/startup_report", methods=["GET"])
+def get_startup_report():
+    report = startup_report.as_dict()
+    report["contacts_loaded"] = contact_store.loads
+    report["contacts_load_seconds"] = round(contact_store.load_seconds, 4)
+    report["contacts_known"] = len(contact_store.index)
+    return jsonify(report)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
 # MAIN
 # ─────────────────────────────────────────────────────────────────────────────
+# ─────────────────────────────────────────────────────────────────────────────
+# SERVING (python bot.py = dev server, python serve.py = production)
+# ─────────────────────────────────────────────────────────────────────────────
+_background_started = False
+
+def start_background():
+    """Report startup and warm the heavy pieces; once per process."""
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    startup_report.ready()
+    print(startup_report.render())
+    print(f"🚀 Julio is up on {model_router.tiers['fast']} (strong: {model_router.tiers['strong']})!")
+    # Warm the heavy pieces in the background once we're about to bind
+    lang_service.warm_async()
+    threading.Thread(target=get_client, name="openai-warmup", daemon=True).start()
+
+ipc_server = None
+
+def start_ipc(workers=ipc.DEFAULT_WORKERS):
+    """Open the bridge channel (ipc.py); only in the process index.js talks to."""
+    global ipc_server
+    ipc_server = ipc.start_server(app, workers=workers)
+    return ipc_server
+
+def flush_state():
+    """Write everything still buffered in memory (graceful shutdown)."""
+    save_memory()
+    notification_ring.flush()
+    summary_cache.flush()
+    reply_cache.flush()
+
+
 if __name__ == "__main__":
-    print(f"🚀 Julio is up on {MODEL}!")
-    app.run(host="0.0.0.0", port=5001)
+    start_background()
+    if SHARD.enabled:
+        print(f"[INFO] Shard {SHARD.index}/{SHARD.count} on port {SHARD.port(SHARD.index)}")
+        # the router supervises the workers, so no reloader child (and no debugger) here
+        app.run(host=SHARD.host, port=SHARD.port(SHARD.index), use_reloader=False, debug=False)
+    else:
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":   # the reloader's serving child
+            start_ipc()
+        app.run(host="0.0.0.0", port=5001)
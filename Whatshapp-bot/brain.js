@@ -0,0 +1,168 @@
+// brain.js
+// The bridge's connection to the Python brain.
+//
+// One persistent connection (Unix domain socket, or loopback TCP on Windows)
+// carries length-prefixed JSON frames. Many requests can be in flight on it
+// at once, each matched to its response by id. The brain pushes events on
+// the same connection ("outbound": replies are ready to send). While the
+// connection is down, requests go over HTTP with keep-alive instead, and
+// the channel keeps reconnecting in the background. See ipc.py for the
+// other end.
+//
+// request() resolves to { status, data } like axios, and rejects on errors
+// and on status >= 400, so callers keep their axios-style handling.
+const net = require('net');
+const os = require('os');
+const path = require('path');
+const http = require('http');
+const axios = require('axios');
+const { EventEmitter } = require('events');
+
+const HEADER_BYTES = 4;
+
+function defaultAddress() {
+    if (process.env.IPC_ADDRESS) return process.env.IPC_ADDRESS;
+    if (process.platform === 'win32') return 'tcp:127.0.0.1:5002';
+    return 'unix:' + path.join(os.tmpdir(), 'whatshapp-bot.sock');
+}
+
+function connectOptions(address) {
+    const i = address.indexOf(':');
+    const kind = address.slice(0, i);
+    const rest = address.slice(i + 1);
+    if (kind === 'unix') return { path: rest };
+    if (kind === 'tcp') {
+        const j = rest.lastIndexOf(':');
+        return { host: rest.slice(0, j) || '127.0.0.1', port: Number(rest.slice(j + 1)) };
+    }
+    throw new Error(`IPC address must start with unix: or tcp:, got ${address}`);
+}
+
+class BrainClient extends EventEmitter {
+    constructor({ address = defaultAddress(), httpBase = 'http://127.0.0.1:5001', timeoutMs = 180000 } = {}) {
+        super();
+        this.options = connectOptions(address);
+        this.address = address;
+        this.timeoutMs = timeoutMs;
+        this.http = axios.create({
+            baseURL: httpBase,
+            timeout: timeoutMs,
+            httpAgent: new http.Agent({ keepAlive: true, maxSockets: 16 }),
+        });
+        this.socket = null;
+        this.connected = false;
+        this.nextId = 1;
+        this.inflight = new Map();    // id -> { resolve, reject, timer }
+        this.buffer = Buffer.alloc(0);
+        this.retryMs = 500;
+        this.closing = false;
+    }
+
+    connect() {
+        const socket = net.connect(this.options);
+        socket.setNoDelay?.(true);
+        socket.on('connect', () => {
+            this.socket = socket;
+            this.connected = true;
+            this.retryMs = 500;
+            console.log(`[brain] channel connected (${this.address})`);
+            this.emit('connected');
+        });
+        socket.on('data', (chunk) => this.onData(chunk));
+        socket.on('error', () => {});   // 'close' follows
+        socket.on('close', () => {
+            const wasConnected = this.connected;
+            this.connected = false;
+            this.socket = null;
+            this.buffer = Buffer.alloc(0);
+            for (const [id, call] of this.inflight) {
+                clearTimeout(call.timer);
+                call.reject(new Error('brain channel closed'));
+                this.inflight.delete(id);
+            }
+            if (wasConnected && !this.closing) console.warn('[brain] channel lost, using HTTP until it is back');
+            if (!this.closing) {
+                setTimeout(() => this.connect(), this.retryMs);
+                this.retryMs = Math.min(this.retryMs * 2, 10000);
+            }
+        });
+        return this;
+    }
+
+    close() {
+        this.closing = true;
+        if (this.socket) this.socket.end();
+    }
+
+    onData(chunk) {
+        this.buffer = this.buffer.length ? Buffer.concat([this.buffer, chunk]) : chunk;
+        while (this.buffer.length >= HEADER_BYTES) {
+            const size = this.buffer.readUInt32BE(0);
+            if (this.buffer.length < HEADER_BYTES + size) break;
+            const frame = JSON.parse(this.buffer.subarray(HEADER_BYTES, HEADER_BYTES + size).toString('utf-8'));
+            this.buffer = this.buffer.subarray(HEADER_BYTES + size);
+            this.onFrame(frame);
+        }
+    }
+
+    onFrame(frame) {
+        if (frame.event) {
+            this.emit(frame.event, frame);
+            return;
+        }
+        const call = this.inflight.get(frame.id);
+        if (!call) return;
+        this.inflight.delete(frame.id);
+        clearTimeout(call.timer);
+        const res = { status: frame.status, data: 'json' in frame ? frame.json : frame.body };
+        if (frame.status >= 400) {
+            const err = new Error(`brain returned ${frame.status} for request ${frame.id}`);
+            err.response = res;
+            call.reject(err);
+        } else {
+            call.resolve(res);
+        }
+    }
+
+    // request('POST', '/reply', { json: {...} }) or { form: {...} } / { query: 'a=b' }
+    request(method, urlPath, { json, form, query } = {}) {
+        if (!this.connected) return this.httpRequest(method, urlPath, { json, form, query });
+        const id = this.nextId++;
+        const frame = { id, method, path: urlPath };
+        if (json !== undefined) frame.json = json;
+        if (form !== undefined) frame.form = form;
+        if (query) frame.query = query;
+        const body = Buffer.from(JSON.stringify(frame), 'utf-8');
+        const header = Buffer.alloc(HEADER_BYTES);
+        header.writeUInt32BE(body.length, 0);
+        return new Promise((resolve, reject) => {
+            const timer = setTimeout(() => {
+                this.inflight.delete(id);
+                reject(new Error(`brain request ${urlPath} timed out`));
+            }, this.timeoutMs);
+            this.inflight.set(id, { resolve, reject, timer });
+            this.socket.write(Buffer.concat([header, body]));
+        });
+    }
+
+    async httpRequest(method, urlPath, { json, form, query } = {}) {
+        const url = query ? `${urlPath}?${query}` : urlPath;
+        const data = form !== undefined ? new URLSearchParams(form) : json;
+        const res = await this.http.request({ method, url, data });
+        return { status: res.status, data: res.data };
+    }
+
+    get(urlPath, opts) {
+        return this.request('GET', urlPath, opts);
+    }
+
+    post(urlPath, json) {
+        return this.request('POST', urlPath, { json });
+    }
+
+    postForm(urlPath, form) {
+        return this.request('POST', urlPath, { form });
+    }
+}
+
+module.exports = { BrainClient, defaultAddress };
@@ -0,0 +1,158 @@
+# codec.py
+"""
+Serialization formats for the persisted memory (memory.json and the contact
+files under memory_contacts/).
+
+  • json         compact JSON; encoded with orjson when it is installed,
+                 the stdlib otherwise. The default.
+  • json-pretty  indented JSON, as the files used to be written (for
+                 reading or editing them by hand).
+  • msgpack      compact binary (needs the msgpack package).
+
+(marshal is only in bench/memory_codec.py, for comparison: its format can
+change between Python versions and it isn't safe on untrusted input, so it
+is no format to keep memory in.)
+
+MEMORY_FORMAT picks the format files are written in. Loading detects the
+format from the file itself: binary files start with MAGIC and a format
+byte, anything else is JSON, so files written before (or in another format)
+keep opening. File names stay the same in every format.
+
+    python codec.py info memory.json
+    python codec.py convert --to msgpack memory.json memory_contacts/*.json
+    python codec.py convert --to json-pretty memory.json -o memory.pretty.json
+"""
+import argparse
+import json
+import os
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# binary files: MAGIC + one format byte + payload (JSON never starts with NUL)
+MAGIC = b"\x00WHB"
+_IDS = {"msgpack": 1}
+_NAMES = {v: k for k, v in _IDS.items()}
+
+FORMATS = ("json", "json-pretty", "msgpack")
+
+
+def available(fmt):
+    return fmt in FORMATS and (fmt != "msgpack" or msgpack is not None)
+
+
+MEMORY_FORMAT = os.getenv("MEMORY_FORMAT", "json")
+if not available(MEMORY_FORMAT):
+    print(f"[ERROR] MEMORY_FORMAT={MEMORY_FORMAT} is not available (unknown, or its package "
+          f"isn't installed); memory files will be written as json")
+    MEMORY_FORMAT = "json"
+
+
+def _check(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown memory format {fmt!r} (one of: {', '.join(FORMATS)})")
+    if not available(fmt):
+        raise RuntimeError(f"Memory format {fmt!r} needs the {fmt} package (pip install {fmt})")
+
+
+# ─── Encoding ───────────────────────────────────────────────────────
+def encode(data, fmt=None, default=None):
+    """data -> bytes in fmt (MEMORY_FORMAT by default); default() converts unknown objects."""
+    fmt = fmt or MEMORY_FORMAT
+    _check(fmt)
+    if fmt == "json":
+        if orjson is not None:
+            return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if fmt == "json-pretty":
+        return json.dumps(data, default=default, ensure_ascii=False, indent=2).encode("utf-8")
+    payload = msgpack.packb(data, default=default, use_bin_type=True)
+    return MAGIC + bytes([_IDS[fmt]]) + payload
+
+
+# ─── Decoding ───────────────────────────────────────────────────────
+def detect(raw):
+    """Format name of raw bytes ("json" for any JSON, pretty or not)."""
+    if raw[:len(MAGIC)] == MAGIC:
+        fmt = _NAMES.get(raw[len(MAGIC)]) if len(raw) > len(MAGIC) else None
+        if fmt is None:
+            raise ValueError("Unknown binary memory format")
+        return fmt
+    return "json"
+
+
+def decode(raw):
+    fmt = detect(raw)
+    if fmt == "json":
+        if raw[:3] == b"\xef\xbb\xbf":
+            raw = raw[3:]
+        return orjson.loads(raw) if orjson is not None else json.loads(raw.decode("utf-8"))
+    _check(fmt)
+    payload = raw[len(MAGIC) + 1:]
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+def load(path):
+    """Read a memory file in whichever format it was written."""
+    with open(path, "rb") as f:
+        return decode(f.read())
+
+
+# ─── CLI ────────────────────────────────────────────────────────────
+def convert(src, dst, fmt):
+    with open(src, "rb") as f:
+        raw = f.read()
+    out = encode(decode(raw), fmt)
+    tmp = f"{dst}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(out)
+    os.replace(tmp, dst)
+    return detect(raw), len(raw), len(out)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    info = sub.add_parser("info", help="show the format and size of memory files")
+    info.add_argument("paths", nargs="+")
+    conv = sub.add_parser("convert", help="rewrite memory files in another format")
+    conv.add_argument("paths", nargs="+")
+    conv.add_argument("--to", required=True, choices=FORMATS)
+    conv.add_argument("-o", "--output", help="write here instead of in place (one input only)")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "info":
+        for path in args.paths:
+            with open(path, "rb") as f:
+                raw = f.read()
+            print(f"{path}: {detect(raw)}, {len(raw):,} bytes")
+        return 0
+
+    if not available(args.to):
+        ap.error(f"{args.to} needs the {args.to} package (pip install {args.to})")
+    if args.output and len(args.paths) != 1:
+        ap.error("--output takes a single input file")
+    before = after = 0
+    for path in args.paths:
+        src_fmt, n_in, n_out = convert(path, args.output or path, args.to)
+        before += n_in
+        after += n_out
+        print(f"{path}: {src_fmt} -> {args.to}, {n_in:,} -> {n_out:,} bytes")
+    if len(args.paths) > 1:
+        print(f"{len(args.paths)} files, {before:,} -> {after:,} bytes")
+    if args.to != MEMORY_FORMAT:
+        print(f"Set MEMORY_FORMAT={args.to} so the bot keeps writing this format "
+              f"(it reads any format, but writes {MEMORY_FORMAT}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
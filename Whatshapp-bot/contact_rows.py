@@ -0,0 +1,75 @@
+# contact_rows.py
+"""
+Cached one-line summary per contact for the dashboard lists:
+name, enabled, message count, last message ts and open objectives.
+
+Rows are built from the contact registry, contacts_info and the per-contact
+hot index, so listing hundreds of contacts never loads any history. Call
+refresh(jid) whenever one of those changes for a contact; the sorted order is
+recomputed lazily on the next listing.
+"""
+import threading
+
+from storage import ts_epoch
+
+
+class ContactRows:
+    def __init__(self, memory, store):
+        self.memory = memory
+        self.store = store
+        self._rows = {}
+        self._order = None
+        self._lock = threading.RLock()
+
+    def _build(self, jid, registry_entry):
+        info = self.memory.get("contacts_info", {}).get(jid, {})
+        entry = self.store.index.get(jid, {})
+        messages = entry.get("messages", 0)
+        last_ts = entry.get("last_ts")
+        if self.store.is_loaded(jid) and self.store.has(jid, "chat_history"):
+            # the hot list is authoritative until the next flush updates the index
+            hot = self.store.get(jid, "chat_history")
+            messages = self.store.archived_count(jid) + len(hot)
+            last_ts = hot[-1].get("ts") if hot else last_ts
+        return {
+            "jid": jid,
+            "name": registry_entry.get("name") or "",
+            "enabled": bool(registry_entry.get("enabled")),
+            "messages": messages,
+            "last_ts": last_ts,
+            "open_objectives": sum(
+                1 for o in info.get("objectives", []) if o.get("status") == "in_progress"
+            ),
+        }
+
+    def rebuild(self):
+        with self._lock:
+            self._rows = {
+                c["jid"]: self._build(c["jid"], c)
+                for c in self.memory.get("allowed_contacts", [])
+            }
+            self._order = None
+
+    def refresh(self, jid):
+        with self._lock:
+            entry = next((c for c in self.memory.get("allowed_contacts", []) if c["jid"] == jid), None)
+            if entry is None:
+                self._rows.pop(jid, None)
+            else:
+                self._rows[jid] = self._build(jid, entry)
+            self._order = None
+
+    def get(self, jid):
+        return self._rows.get(jid)
+
+    @staticmethod
+    def sort_key(row):
+        """Most recently active first, then by jid for a stable order."""
+        return [-(ts_epoch(row.get("last_ts")) or 0), row["jid"]]
+
+    def rows(self):
+        """All rows, most recent first."""
+        with self._lock:
+            if self._order is None:
+                self._order = sorted(self._rows.values(), key=self.sort_key)
+            return self._order
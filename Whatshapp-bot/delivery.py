@@ -0,0 +1,153 @@
+# delivery.py
+"""
+Delayed delivery of outbound replies ("typing" delays).
+
+Instead of sleeping in a request thread or in the bridge, a reply that should
+go out in N seconds is put in a min-heap keyed by its due time; the bridge's
+/approved_batch poll collects whatever is due. Scheduling and popping are
+O(log n), so tens of thousands of pending timed sends cost nothing while they
+wait.
+
+  • Persistence is an append-only journal (scheduled_sends.jsonl): one line per
+    scheduled or removed item, compacted on startup and whenever removed lines
+    outnumber live ones. Pending sends survive restarts.
+  • cancel_jid(jid) drops what is still waiting for a contact (everything,
+    or the items matching `where`), e.g. auto replies when they write again
+    before the reply went out. Cancelled entries are removed from the heap
+    lazily when they reach the top.
+"""
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+
+COMPACT_MIN_DEAD = 1000
+
+
+class DeliveryScheduler:
+    def __init__(self, path):
+        self.path = path
+        self._items = {}        # id -> item (live only)
+        self._by_jid = {}       # jid -> set of ids
+        self._heap = []         # (due_at, id); may contain removed ids
+        self._dead = 0          # journal lines that no longer describe a live item
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._items)
+
+    # ─── Journal ────────────────────────────────────────────────────
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        items = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                if op.get("op") == "add":
+                    items[op["item"]["id"]] = op["item"]
+                elif op.get("op") == "del":
+                    for i in op.get("ids", []):
+                        items.pop(i, None)
+        for item in items.values():
+            self._index(item)
+        self._heap = [(it["due_at"], it["id"]) for it in self._items.values()]
+        heapq.heapify(self._heap)
+        self._compact()
+
+    def _append(self, ops):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for op in ops:
+                f.write(json.dumps(op, ensure_ascii=False) + "\n")
+
+    def _compact(self):
+        """Rewrite the journal with only the live items."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for item in self._items.values():
+                f.write(json.dumps({"op": "add", "item": item}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        self._dead = 0
+
+    def _removed(self, ids):
+        if not ids:
+            return
+        self._append([{"op": "del", "ids": ids}])
+        self._dead += len(ids) + 1
+        if self._dead > max(COMPACT_MIN_DEAD, len(self._items)):
+            self._compact()
+        if len(self._heap) > 2 * len(self._items) + COMPACT_MIN_DEAD:
+            # too many cancelled entries waiting to surface; rebuild in O(n)
+            self._heap = [(it["due_at"], it["id"]) for it in self._items.values()]
+            heapq.heapify(self._heap)
+
+    def _index(self, item):
+        self._items[item["id"]] = item
+        self._by_jid.setdefault(item["jid"], set()).add(item["id"])
+
+    def _unindex(self, item_id):
+        item = self._items.pop(item_id, None)
+        if item is not None:
+            ids = self._by_jid.get(item["jid"])
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self._by_jid[item["jid"]]
+        return item
+
+    # ─── API ────────────────────────────────────────────────────────
+    def schedule(self, item, delay):
+        """Schedule `item` (needs "jid") to be delivered `delay` seconds from now."""
+        with self._lock:
+            item = dict(item, id=item.get("id") or uuid.uuid4().hex, due_at=time.time() + max(0, delay))
+            self._unindex(item["id"])
+            self._index(item)
+            heapq.heappush(self._heap, (item["due_at"], item["id"]))
+            self._append([{"op": "add", "item": item}])
+            return item
+
+    def pop_due(self, now=None):
+        """Remove and return every item whose time has come, earliest first."""
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, item_id = heapq.heappop(self._heap)
+                item = self._items.get(item_id)
+                if item is None or item["due_at"] != due_at:
+                    continue  # cancelled or rescheduled
+                due.append(self._unindex(item_id))
+            self._removed([it["id"] for it in due])
+        return due
+
+    def cancel_jid(self, jid, where=None):
+        """Drop every send still waiting for jid (that where(item) accepts); returns the dropped items."""
+        with self._lock:
+            ids = [i for i in self._by_jid.get(jid, ()) if where is None or where(self._items[i])]
+            dropped = [self._unindex(i) for i in ids]
+            self._removed([it["id"] for it in dropped])
+            return dropped
+
+    def pending_for(self, jid):
+        with self._lock:
+            return sorted((self._items[i] for i in self._by_jid.get(jid, ())), key=lambda it: it["due_at"])
+
+    def next_due(self):
+        with self._lock:
+            while self._heap:
+                due_at, item_id = self._heap[0]
+                item = self._items.get(item_id)
+                if item is not None and item["due_at"] == due_at:
+                    return due_at
+                heapq.heappop(self._heap)  # drop a cancelled entry
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {"scheduled": len(self._items), "contacts": len(self._by_jid), "heap": len(self._heap)}
@@ -0,0 +1,135 @@
+# events.py
+"""
+Live dashboard updates.
+
+  • EventBus fans events (new notification, pending queue changes, ...) out to
+    every open dashboard over Server-Sent Events.
+  • NotificationRing keeps the last N notifications in a fixed-size ring and
+    writes them to their own small file a moment after they change, so
+    showing a notification never rewrites memory.json.
+"""
+import json
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from storage import write_json_atomic
+
+HEARTBEAT_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 200
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((event, payload))
+            except queue.Full:
+                pass  # slow client; it will resync on its next reload
+
+    def stream(self, q):
+        """SSE generator for one subscriber; sends a heartbeat comment when idle."""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, payload = q.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {payload}\n\n"
+        finally:
+            self.unsubscribe(q)
+
+
+class NotificationRing:
+    def __init__(self, path, size=50, flush_delay=2.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._items = deque(maxlen=size)
+        self._seq = 0           # ever-increasing id of the newest notification
+        self.seen_seq = 0       # newest notification the operator has viewed
+        self._dirty = False
+        self._timer = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._items.extend(data.get("items", []))
+        self._seq = data.get("seq", len(self._items))
+        self.seen_seq = data.get("seen_seq", 0)
+
+    def adopt(self, legacy_items):
+        """Import notifications from an old memory.json (all considered unseen)."""
+        for n in legacy_items or []:
+            self.append(n.get("jid"), n.get("message", ""), ts=n.get("ts") or n.get("timestamp"))
+
+    def append(self, jid, message, ts=None):
+        with self._lock:
+            self._seq += 1
+            item = {
+                "seq": self._seq,
+                "jid": jid,
+                "message": message,
+                "ts": ts or datetime.now(timezone.utc).isoformat(),
+            }
+            self._items.append(item)
+            self._mark_dirty()
+            return item
+
+    def items(self):
+        with self._lock:
+            return list(self._items)
+
+    def unseen(self):
+        with self._lock:
+            return [n for n in self._items if n["seq"] > self.seen_seq]
+
+    def mark_seen(self):
+        with self._lock:
+            if self.seen_seq != self._seq:
+                self.seen_seq = self._seq
+                self._mark_dirty()
+
+    # ─── Lazy persistence ───────────────────────────────────────────
+    def _mark_dirty(self):
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = {"seq": self._seq, "seen_seq": self.seen_seq, "items": list(self._items)}
+            write_json_atomic(self.path, data, ensure_ascii=False)
@@ -0,0 +1,96 @@
+// history_sync.js
+// Incremental history sync from WhatsApp to the brain.
+//
+// The brain keeps a cursor per contact (the timestamp of the newest message
+// it has seen from WhatsApp, see wa_sync.py). On startup and then every
+// `intervalMs`, each enabled contact's chat is fetched back to its cursor
+// (the fetch doubles until it reaches it, up to `maxFetch` messages) and
+// only those messages are posted to /sync/ingest, which drops the ones it
+// already has by WhatsApp id. A contact that was never synced gets its last
+// `firstFetch` messages.
+//
+// Messages that arrived while the bridge or the brain was down come back
+// as `reply_to` when the brain should answer them; `onMissed` sends them
+// through the normal /reply path.
+class HistorySync {
+    constructor(client, brain, {
+        intervalMs = 15 * 60 * 1000,
+        firstFetch = 50,
+        maxFetch = 1000,
+        onMissed = null,
+    } = {}) {
+        this.client = client;
+        this.brain = brain;
+        this.intervalMs = intervalMs;
+        this.firstFetch = firstFetch;
+        this.maxFetch = maxFetch;
+        this.onMissed = onMissed;
+        this.running = false;
+        this.timer = null;
+    }
+
+    start() {
+        if (!this.timer && this.intervalMs > 0) {
+            this.timer = setInterval(() => this.syncAll(), this.intervalMs);
+        }
+        return this.syncAll();
+    }
+
+    stop() {
+        clearInterval(this.timer);
+        this.timer = null;
+    }
+
+    // Messages in the chat at or after cursor (seconds), oldest first
+    async fetchSince(chat, cursor) {
+        let limit = this.firstFetch;
+        for (;;) {
+            const msgs = await chat.fetchMessages({ limit });
+            const reachedCursor = cursor == null || !msgs.length || msgs[0].timestamp <= cursor;
+            if (reachedCursor || msgs.length < limit || limit >= this.maxFetch) {
+                return cursor == null ? msgs : msgs.filter((m) => m.timestamp >= cursor);
+            }
+            limit = Math.min(limit * 2, this.maxFetch);
+        }
+    }
+
+    async syncContact(jid, cursor) {
+        const chat = await this.client.getChatById(jid);
+        const messages = (await this.fetchSince(chat, cursor))
+            .filter((m) => !m.isStatus && m.body && m.body.trim())
+            .map((m) => ({ id: m.id._serialized, fromMe: m.fromMe, body: m.body, ts: m.timestamp }));
+        if (!messages.length) return null;
+        const { data } = await this.brain.post('/sync/ingest', { jid, messages });
+        if (data.reply_to && this.onMissed) await this.onMissed(jid, data.reply_to);
+        return data;
+    }
+
+    async syncAll() {
+        if (this.running) return;
+        this.running = true;
+        const started = Date.now();
+        let added = 0;
+        let missed = 0;
+        try {
+            const { data: cursors } = await this.brain.get('/sync/cursors');
+            for (const [jid, cursor] of Object.entries(cursors || {})) {
+                try {
+                    const res = await this.syncContact(jid, cursor);
+                    added += res?.added || 0;
+                    missed += res?.missed || 0;
+                } catch (e) {
+                    console.warn(`[sync] ${jid}: ${e.message}`);
+                }
+            }
+            if (added) {
+                console.log(`[sync] ${added} new message(s), ${missed} missed, in ${Date.now() - started} ms`);
+            }
+        } catch (e) {
+            // the brain is down; the next run picks up from the same cursors
+        } finally {
+            this.running = false;
+        }
+    }
+}
+
+module.exports = { HistorySync };
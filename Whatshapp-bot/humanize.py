@@ -2,16 +2,35 @@
 import random
 import re
 
-def humanize_reply(user_msg, raw_reply, memory, jid):
-    """Take GPT’s raw reply and make it feel human-like (text-level)."""
+from keywords import KeywordMatcher
+
+# ─── Lexicons (compiled once; whole-word matches only) ──────────────
+LEXICONS = {
+    "sad": ["sad", "tired", "lonely", "bad", "depressed", "down", "cry", "crying"],
+    "happy": ["good", "great", "love", "happy", "excited", "amazing"],
+    "emotional": ["sad", "love", "angry", "cry", "crying", "miss", "missing", "missed"],
+    "topic:dog": ["dog", "dogs"],
+    "topic:work": ["work", "working", "job"],
+    "topic:food": ["food", "eat", "eating", "ate"],
+}
+lexicon_matcher = KeywordMatcher(LEXICONS)
+
+def keyword_hits(text):
+    """Mood/topic hits for text that has no per-contact matcher at hand."""
+    return lexicon_matcher.find(text)
+
+def humanize_reply(user_msg, raw_reply, memory, jid, hits=None):
+    """
+    Take GPT’s raw reply and make it feel human-like (text-level).
+    `hits` is the keyword scan of user_msg if the caller already has it.
+    """
 
     reply = raw_reply.strip()
 
     # ─── Mood detection ─────────────────────────────────────────────
-    sad_words = ["sad", "tired", "lonely", "bad", "depressed", "down", "cry"]
-    happy_words = ["good", "great", "love", "happy", "excited", "amazing"]
-    is_sad = any(w in user_msg.lower() for w in sad_words)
-    is_happy = any(w in user_msg.lower() for w in happy_words)
+    hits = keyword_hits(user_msg) if hits is None else hits
+    is_sad = "sad" in hits
+    is_happy = "happy" in hits
 
     # ─── Casual fillers (skip if user is sad) ───────────────────────
     if not is_sad and random.random() < 0.2:
@@ -52,18 +71,18 @@ def humanize_reply(user_msg, raw_reply, memory, jid):
     # ─── Memory callbacks (refer back to old topics) ───────────────
     history = memory.get("chat_history", {}).get(jid, [])
     if history and random.random() < 0.1:
-        last_msgs = " ".join(m["content"].lower() for m in history[-5:])
-        if "dog" in last_msgs:
+        topics = keyword_hits("\n".join(m["content"] for m in history[-5:]))
+        if "topic:dog" in topics:
             reply += " btw how’s ur dog?"
-        elif "work" in last_msgs:
+        elif "topic:work" in topics:
             reply += " how’s work going btw?"
-        elif "food" in last_msgs or "eat" in last_msgs:
+        elif "topic:food" in topics:
             reply += " did u eat yet today?"
 
     return reply
 
 
-def get_typing_delay(user_msg, reply_text):
+def get_typing_delay(user_msg, reply_text, hits=None):
     """Return realistic delay (seconds) before sending reply."""
 
     # Base delay depends on reply length
@@ -75,7 +94,8 @@ def get_typing_delay(user_msg, reply_text):
         delay = random.uniform(10, 20) # thoughtful/long answers
 
     # Add extra delay if user sent emotional text
-    if any(w in user_msg.lower() for w in ["sad", "love", "angry", "cry", "miss"]):
+    hits = keyword_hits(user_msg) if hits is None else hits
+    if "emotional" in hits:
         delay *= 1.3
 
     # Occasionally simulate being busy/distracted
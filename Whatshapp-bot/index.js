@@ -1,11 +1,19 @@
 // NEW: Import the necessary classes from whatsapp-web.js
 const { Client, LocalAuth, MessageMedia } = require('whatsapp-web.js');
-const axios = require('axios');
 const qrcode = require('qrcode-terminal');
 const fs = require('fs');
 const path = require('path');
+const { OutboundSender } = require('./sender');
+const { BrainClient } = require('./brain');
+const { HistorySync } = require('./history_sync');
 
+// One persistent channel to bot.py (HTTP fallback while it's down), see brain.js
+const brain = new BrainClient().connect();
+
+// Last name the brain stored per contact, so it's only sent when it changes
+const contactNames = new Map();
 const QUEUE_PATH = path.join(__dirname, 'pending.json');
+const OUTBOX_PATH = path.join(__dirname, 'outbox.json');
 const IMAGES_DIR = path.join(__dirname, 'images');
 
 // --- Your queue logic remains exactly the same ---
@@ -26,32 +34,27 @@ function saveQueue() {
 
 // --- The core logic functions are updated for the new client ---
 
+// A /reply answer with something to send goes to the sender; approval and
+// delayed modes answer with an empty reply and nothing to send
+function enqueueReply(jid, data) {
+    const images = Array.isArray(data.images) ? data.images : [];
+    if (!data.reply && !images.length) return;
+    sender.enqueue({ jid, reply: data.reply, images });
+}
+
 // The `sock` object is now a `client` object
 async function processQueue(client) {
     for (let i = 0; i < pending.length; ) {
-        const { from, text } = pending[i];
+        const { from, text, meta } = pending[i];
         try {
-            const { data } = await axios.post('http://127.0.0.1:5001/reply', {
+            const { data } = await brain.post('/reply', {
                 sender: from,
                 message: text,
+                ...meta,
             });
-
-            if (Array.isArray(data.images)) {
-                for (const img of data.images) {
-                    const p = path.join(IMAGES_DIR, img);
-                    if (fs.existsSync(p)) {
-                        // NEW: Sending media is done with the MessageMedia class
-                        const media = MessageMedia.fromFilePath(p);
-                        await client.sendMessage(from, media);
-                    } else {
-                        console.warn('[processQueue] image not found:', p);
-                    }
-                }
-            }
-            if (data.reply) {
-                // NEW: Sending text is simpler
-                await client.sendMessage(from, data.reply);
-            }
+            // the sender keeps the reply in outbox.json until it is sent, so the
+            // message can leave pending.json now
+            enqueueReply(from, data);
 
             pending.splice(i, 1);
             saveQueue();
@@ -61,31 +64,19 @@ async function processQueue(client) {
     }
 }
 
-async function sendOrQueue(client, from, text) {
+// meta: the WhatsApp { id, ts } of the message, or { synced: true } for missed ones
+async function sendOrQueue(client, from, text, meta = {}) {
     try {
-        const { data } = await axios.post('http://127.0.0.1:5001/reply', {
+        const { data } = await brain.post('/reply', {
             sender: from,
             message: text,
+            ...meta,
         });
-
-        if (Array.isArray(data.images)) {
-            for (const img of data.images) {
-                const p = path.join(IMAGES_DIR, img);
-                if (fs.existsSync(p)) {
-                    const media = MessageMedia.fromFilePath(p);
-                    await client.sendMessage(from, media);
-                } else {
-                    console.warn('[sendOrQueue] image not found:', p);
-                }
-            }
-        }
-        if (data.reply) {
-            await client.sendMessage(from, data.reply);
-        }
+        enqueueReply(from, data);
 
         await processQueue(client);
     } catch (e) {
-        pending.push({ from, text });
+        pending.push({ from, text, meta });
         saveQueue();
     }
 }
@@ -103,6 +94,24 @@ const client = new Client({
     },
 });
 
+// All outbound messages go through per-contact lanes (see sender.js)
+const sender = new OutboundSender(client, {
+    imagesDir: IMAGES_DIR,
+    MessageMedia,
+    concurrency: Number(process.env.SEND_CONCURRENCY || 4),
+    ratePerSec: Number(process.env.SEND_RATE || 2),
+    burst: Number(process.env.SEND_BURST || 5),
+    retries: Number(process.env.SEND_RETRIES || 3),
+    report: (result) => brain.post('/send_result', result),
+    outboxPath: OUTBOX_PATH,
+});
+
+// Catches up on messages since each contact's cursor (see history_sync.js)
+const historySync = new HistorySync(client, brain, {
+    intervalMs: Number(process.env.HISTORY_SYNC_MINUTES || 15) * 60 * 1000,
+    onMissed: (jid, text) => sendOrQueue(client, jid, text, { synced: true }),
+});
+
 // NEW: Event for QR code generation
 client.on('qr', (qr) => {
     console.log('QR Code received, scan it with your phone.');
@@ -112,8 +121,13 @@ client.on('qr', (qr) => {
 // NEW: Event for when the client is authenticated and ready
 client.on('ready', async () => {
     console.log('✅ Client is ready and connected!');
+    // Replies that were still waiting to be sent when the bridge stopped
+    const restored = sender.restore();
+    if (restored) console.log(`Resending ${restored} unsent repl(ies)`);
     // Process the local queue once connected
     await processQueue(client);
+    // Then whatever arrived while we were offline
+    await historySync.start();
 });
 
 // NEW: Event for incoming messages
@@ -143,11 +157,10 @@ client.on('message', async (msg) => {
     try {
         const contact = await msg.getContact();
         const assignedName = contact.name || contact.pushname;
-        if (assignedName) {
-            const params = new URLSearchParams();
-            params.append('jid', from);
-            params.append('name', assignedName);
-            axios.post('http://127.0.0.1:5001/update_contact_name', params)
+        if (assignedName && contactNames.get(from) !== assignedName) {
+            // only cached once the brain kept it: contacts not added yet send it again next time
+            brain.post('/update_contact_name', { jid: from, name: assignedName })
+                 .then((res) => { if (res.data && res.data.stored) contactNames.set(from, assignedName); })
                  .catch(() => {});
         }
     } catch (e) {
@@ -155,37 +168,30 @@ client.on('message', async (msg) => {
     }
 
 
-    await sendOrQueue(client, from, text);
+    await sendOrQueue(client, from, text, { id: msg.id._serialized, ts: msg.timestamp });
 });
 
 // Start the client
 client.initialize();
 
-// --- Polling for approved replies remains exactly the same ---
-setInterval(async () => {
+// --- Polling for approved replies: handed to the sender, which sends them per contact ---
+// The brain also pushes an "outbound" event when replies are ready, so they
+// don't wait for the next tick.
+let polling = false;
+async function pollApproved() {
+    if (polling) return;
+    polling = true;
     try {
-        const { data } = await axios.get('http://127.0.0.1:5001/approved_batch');
+        const { data } = await brain.get('/approved_batch');
         const items = Array.isArray(data?.items) ? data.items : [];
         for (const item of items) {
-            if (!item?.jid) continue;
-
-            if (Array.isArray(item.images) && item.images.length) {
-                for (const img of item.images) {
-                    const p = path.join(IMAGES_DIR, img);
-                    if (fs.existsSync(p)) {
-                        const media = MessageMedia.fromFilePath(p);
-                        await client.sendMessage(item.jid, media);
-                    } else {
-                        console.warn('[approved_batch] image not found:', p);
-                    }
-                }
-            }
-
-            if (item.reply) {
-                await client.sendMessage(item.jid, item.reply);
-            }
+            sender.enqueue(item);
         }
     } catch (err) {
         // swallow; will try again next tick
+    } finally {
+        polling = false;
     }
-}, 2000);
\ No newline at end of file
+}
+brain.on('outbound', pollApproved);
+setInterval(pollApproved, 2000);
\ No newline at end of file
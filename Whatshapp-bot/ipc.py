@@ -0,0 +1,237 @@
+# ipc.py
+"""
+Persistent channel between the bridge (index.js, brain.js) and the brain.
+
+Instead of a new HTTP request for every inbound message, name update and
+2 s poll, the bridge keeps one connection open to a Unix domain socket
+(a loopback TCP port on Windows) and sends framed requests over it:
+
+  • framing: 4-byte big-endian length, then a UTF-8 JSON object.
+  • request:  {"id": 7, "method": "POST", "path": "/reply", "json": {...}}
+              ("form" for form fields, "query" for the query string)
+    response: {"id": 7, "status": 200, "json": {...}}  (or "body": text)
+  • requests are multiplexed: each runs on a worker thread and its response
+    goes back tagged with its id as soon as it is ready. /reply (waiting on
+    the model) has a pool of its own, so slow replies never hold up polls,
+    name updates and sync; both pools are sized like the HTTP server's
+    (serve.py --threads).
+  • the brain can push events ({"event": "outbound"}) to tell the bridge
+    there is something to send, instead of waiting for its next poll. In
+    sharded mode the router holds the channel and relays the workers'
+    OUTBOUND_HEADER (shards.py) as this event.
+
+Requests are dispatched through the Flask app itself (same routes, hooks
+and metrics as HTTP), so the router process can serve the channel in
+sharded mode just as bot.py does in a single process. HTTP on :5001 stays
+as it is for the dashboard and as the bridge's fallback.
+
+IPC_ADDRESS selects the endpoint, "unix:/path/to.sock" or "tcp:host:port";
+index.js reads the same variable.
+"""
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+HEADER = struct.Struct(">I")
+MAX_FRAME = 16 * 1024 * 1024
+DEFAULT_WORKERS = 8
+SLOW_PATHS = ("/reply",)    # run on their own pool
+
+
+def default_address():
+    addr = os.getenv("IPC_ADDRESS")
+    if addr:
+        return addr
+    if sys.platform == "win32" or not hasattr(socket, "AF_UNIX"):
+        return "tcp:127.0.0.1:5002"
+    return "unix:" + os.path.join(tempfile.gettempdir(), "whatshapp-bot.sock")
+
+
+def parse_address(addr):
+    """("unix", path) or ("tcp", (host, port))."""
+    kind, _, rest = addr.partition(":")
+    if kind == "unix":
+        return "unix", rest
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    raise ValueError(f"IPC address must start with unix: or tcp:, got {addr!r}")
+
+
+def encode_frame(obj):
+    data = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return HEADER.pack(len(data)) + data
+
+
+def read_frame(sock_file):
+    """Next frame from a socket file, None at EOF."""
+    header = sock_file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise ValueError(f"IPC frame of {size} bytes is too large")
+    data = sock_file.read(size)
+    if len(data) < size:
+        return None
+    return json.loads(data)
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile("rb")
+        self.write_lock = threading.Lock()
+        self.closed = False
+
+    def send(self, obj):
+        frame = encode_frame(obj)
+        with self.write_lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                self.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class IPCServer:
+    def __init__(self, app, address=None, workers=DEFAULT_WORKERS):
+        self.app = app
+        self.address = address or default_address()
+        self.kind, self.target = parse_address(self.address)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ipc")
+        self._slow_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ipc-reply")
+        self._conns = set()
+        self._lock = threading.Lock()
+        self._listener = None
+        self.draining = False
+
+    # ─── Lifecycle ──────────────────────────────────────────────────
+    def start(self):
+        if self.kind == "unix":
+            if os.path.exists(self.target):
+                os.unlink(self.target)      # left over from a previous run
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.target)
+        else:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(self.target)
+        listener.listen(8)
+        self._listener = listener
+        threading.Thread(target=self._accept_loop, name="ipc-accept", daemon=True).start()
+        print(f"[INFO] Bridge channel on {self.address}")
+        return self
+
+    def stop(self):
+        """Stop taking requests, let the ones running finish, close every connection."""
+        self.draining = True
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            if self.kind == "unix" and os.path.exists(self.target):
+                os.unlink(self.target)
+        self._pool.shutdown(wait=True)
+        self._slow_pool.shutdown(wait=True)
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            conn.close()
+
+    def _accept_loop(self):
+        while self._listener is not None:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return
+            if self.kind == "tcp":
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Connection(sock)
+            with self._lock:
+                self._conns.add(conn)
+            metrics.inc("ipc_connections_total")
+            threading.Thread(target=self._read_loop, args=(conn,), name="ipc-conn", daemon=True).start()
+
+    def _read_loop(self, conn):
+        try:
+            while True:
+                try:
+                    req = read_frame(conn.file)
+                except (OSError, ValueError) as e:
+                    if not conn.closed:
+                        print(f"[ERROR] Bridge channel: {e}")
+                    break
+                if req is None:
+                    break
+                if self.draining:
+                    conn.send({"id": req.get("id"), "status": 503, "body": "Shutting down, retry shortly."})
+                    continue
+                pool = self._slow_pool if req.get("path") in SLOW_PATHS else self._pool
+                try:
+                    pool.submit(self._handle, conn, req)
+                except RuntimeError:    # pool shut down by stop()
+                    conn.send({"id": req.get("id"), "status": 503, "body": "Shutting down, retry shortly."})
+        finally:
+            with self._lock:
+                self._conns.discard(conn)
+            conn.close()
+
+    # ─── Requests and events ────────────────────────────────────────
+    def _handle(self, conn, req):
+        metrics.inc("ipc_requests_total")
+        try:
+            reply = self.dispatch(req)
+        except Exception as e:
+            print(f"[ERROR] Bridge request {req.get('path')} failed: {e}")
+            reply = {"status": 500, "body": str(e)}
+        reply["id"] = req.get("id")
+        conn.send(reply)
+
+    def dispatch(self, req):
+        """Run one framed request through the Flask app; the response as a frame dict."""
+        kwargs = {"method": req.get("method", "GET"), "query_string": req.get("query") or ""}
+        if "json" in req:
+            kwargs["json"] = req["json"]
+        elif "form" in req:
+            kwargs["data"] = req["form"]
+        with self.app.test_request_context(req.get("path", "/"), **kwargs):
+            resp = self.app.full_dispatch_request()
+            try:
+                if resp.is_json:
+                    return {"status": resp.status_code, "json": resp.get_json()}
+                return {"status": resp.status_code, "body": resp.get_data(as_text=True)}
+            finally:
+                resp.close()
+
+    def notify(self, event, **data):
+        """Push an event to every connected bridge."""
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            conn.send(dict(data, event=event))
+
+
+def start_server(app, address=None, workers=DEFAULT_WORKERS):
+    """Start the channel for app; None (the bridge stays on HTTP) if it can't bind."""
+    server = IPCServer(app, address, workers=workers)
+    try:
+        return server.start()
+    except OSError as e:
+        print(f"[ERROR] Bridge channel unavailable on {server.address} ({e}); index.js will use HTTP")
+        return None
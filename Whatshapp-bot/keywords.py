@@ -0,0 +1,150 @@
+# keywords.py
+"""
+Multi-keyword matching in one pass over the text.
+
+KeywordMatcher compiles labelled word lists ("sad": [...], "topic:dog": [...],
+"objective:<id>": [...]) into an Aho–Corasick automaton once; find(text) then
+walks the text a single time and reports every label whose keywords occur.
+Keywords may be phrases, and only whole words match: "sad" matches
+"so sad!" but not "sadly", "eat" doesn't fire on "great".
+
+ContactMatchers keeps one compiled matcher per contact: the shared lexicons
+plus that contact's linguistic objectives. A contact's matcher is rebuilt
+only when their objective set changes.
+"""
+import re
+import threading
+from collections import deque
+
+_WORD_RE = re.compile(r"\w+")
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_keyword(word):
+    return _WS_RE.sub(" ", (word or "").strip().lower())
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == "_"
+
+
+class KeywordMatcher:
+    def __init__(self, groups):
+        """groups: {label: iterable of keywords/phrases}"""
+        self._labels = {}           # keyword -> set of labels
+        for label, words in groups.items():
+            for w in words:
+                w = normalize_keyword(w)
+                if w:
+                    self._labels.setdefault(w, set()).add(label)
+        self._goto = [{}]           # state -> {char: state}
+        self._fail = [0]
+        self._out = [()]            # state -> keywords ending here (incl. via fail links)
+        for w in self._labels:
+            self._insert(w)
+        self._link()
+
+    def __len__(self):
+        return len(self._labels)
+
+    def _insert(self, word):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] = self._out[state] + (word,)
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, text):
+        """Yield (start, keyword) for every whole-word occurrence in text."""
+        text = (text or "").lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        n = len(text)
+        state = 0
+        for i, ch in enumerate(text):
+            if ch.isspace():
+                ch = " "
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            after_ok = i + 1 >= n or not _is_word_char(text[i + 1])
+            if not after_ok:
+                continue
+            for word in out[state]:
+                start = i - len(word) + 1
+                if start == 0 or not _is_word_char(text[start - 1]):
+                    yield start, word
+
+    def find(self, text):
+        """{label: [matched keywords in order of appearance]} for every label that hit."""
+        hits = {}
+        for _, word in self.scan(text):
+            for label in self._labels[word]:
+                found = hits.setdefault(label, [])
+                if word not in found:
+                    found.append(word)
+        return hits
+
+
+def objective_terms(description, min_len=4):
+    """Key terms of a linguistic objective: its words of at least `min_len` letters."""
+    return [w for w in _WORD_RE.findall((description or "").lower()) if len(w) >= min_len]
+
+
+class ContactMatchers:
+    """Per-contact matchers: shared lexicons + the contact's linguistic objectives."""
+
+    def __init__(self, base_groups):
+        self.base_groups = dict(base_groups)
+        self.base = KeywordMatcher(self.base_groups)
+        self._cache = {}            # jid -> (signature, matcher)
+        self._lock = threading.Lock()
+        self.compiles = 0
+
+    @staticmethod
+    def _signature(objectives):
+        return tuple(
+            (o.get("id"), o.get("description", ""))
+            for o in objectives or [] if o.get("type") == "linguistic"
+        )
+
+    def get(self, jid, objectives):
+        sig = self._signature(objectives)
+        if not sig:
+            return self.base
+        with self._lock:
+            cached = self._cache.get(jid)
+            if cached and cached[0] == sig:
+                return cached[1]
+        groups = dict(self.base_groups)
+        for obj_id, description in sig:
+            groups[f"objective:{obj_id}"] = objective_terms(description)
+        matcher = KeywordMatcher(groups)
+        with self._lock:
+            self._cache[jid] = (sig, matcher)
+            self.compiles += 1
+        return matcher
+
+    def invalidate(self, jid):
+        with self._lock:
+            self._cache.pop(jid, None)
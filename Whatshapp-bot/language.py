@@ -0,0 +1,139 @@
+# language.py
+"""
+Language identification for incoming messages.
+
+One service backs both the live /reply path and the knowledge-gap
+regeneration path:
+  • the langid model is loaded once (warm it at startup with warm_async())
+  • short inputs ("jaja ok", "gm") are normalised and served from an LRU cache
+  • each contact keeps a language prior learned from their history, and we only
+    move away from it when a message gives strong evidence for another language
+  • langid itself is unrestricted: a message clearly in a language outside
+    `languages` is still answered in it, but only `languages` are learned as
+    a contact's prior
+"""
+import re
+import threading
+from functools import lru_cache
+
+DEFAULT_LANGUAGES = ("en", "es", "pt", "fr", "de")
+DEFAULT_LANG = "en"
+
+CACHE_MAX_CHARS = 64        # only short texts are worth caching
+MIN_WORDS_TO_DETECT = 4     # below this we trust the contact's prior
+MIN_WORDS_STATELESS = 3     # below this, without a prior, assume the default
+SWITCH_CONFIDENCE = 0.90    # normalised probability needed to count as evidence
+SWITCH_STREAK = 2           # consecutive strong detections before switching
+INSTANT_SWITCH_WORDS = 12   # ...unless the message is long and unambiguous
+INSTANT_SWITCH_CONFIDENCE = 0.99
+BOOTSTRAP_MESSAGES = 20     # user messages used to learn a missing prior
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    return _WS_RE.sub(" ", (text or "").strip().lower())
+
+
+class LanguageService:
+    def __init__(self, languages=DEFAULT_LANGUAGES, default=DEFAULT_LANG, cache_size=4096):
+        self.languages = tuple(languages)
+        self.default = default
+        self._identifier = None
+        self._lock = threading.Lock()
+        self._classify_cached = lru_cache(maxsize=cache_size)(self._classify_uncached)
+
+    # ─── Model loading ──────────────────────────────────────────────
+    def preload(self):
+        """Load the langid model (idempotent, thread-safe)."""
+        if self._identifier is not None:
+            return self._identifier
+        with self._lock:
+            if self._identifier is None:
+                from langid.langid import LanguageIdentifier, model
+                ident = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+                ident.classify("warm up")  # touch the model once so numpy pages are hot
+                self._identifier = ident
+        return self._identifier
+
+    def warm_async(self):
+        """Preload in a daemon thread so startup isn't blocked."""
+        t = threading.Thread(target=self.preload, name="langid-warmup", daemon=True)
+        t.start()
+        return t
+
+    # ─── Stateless detection ────────────────────────────────────────
+    def _classify_uncached(self, norm_text):
+        lang, prob = self.preload().classify(norm_text)
+        return lang, float(prob)
+
+    def cache_info(self):
+        return self._classify_cached.cache_info()
+
+    def classify(self, text):
+        """Return (lang, probability). Short inputs are cached."""
+        norm = normalize(text)
+        if not norm:
+            return self.default, 0.0
+        if len(norm) <= CACHE_MAX_CHARS:
+            return self._classify_cached(norm)
+        return self._classify_uncached(norm)
+
+    def detect(self, text):
+        """Best guess with no contact context; short texts fall back to default."""
+        if len(normalize(text).split()) < MIN_WORDS_STATELESS:
+            return self.default
+        lang, _ = self.classify(text)
+        return lang
+
+    # ─── Contact-aware detection ────────────────────────────────────
+    def _bootstrap_prior(self, text, history):
+        recent = [m["content"] for m in list(history)[-BOOTSTRAP_MESSAGES * 2:] if m.get("role") == "user"]
+        sample = " ".join(recent[-BOOTSTRAP_MESSAGES:]) or text
+        lang, prob = self.classify(sample)
+        if lang not in self.languages or prob < 0.5:
+            lang = self.default
+        return {"lang": lang, "streak": 0, "candidate": None}
+
+    def detect_for_contact(self, contact_info, text, history=(), learn=True):
+        """
+        Detect the language of `text` for a contact, sticking to their prior
+        unless there is strong evidence of a switch. The prior lives in
+        contact_info["lang_prior"] and is updated in place when learn=True.
+        """
+        prior = contact_info.get("lang_prior")
+        if not prior or prior.get("lang") not in self.languages:
+            prior = self._bootstrap_prior(text, history)
+            if learn:
+                contact_info["lang_prior"] = prior
+
+        current = prior["lang"]
+        words = len(normalize(text).split())
+        if words < MIN_WORDS_TO_DETECT:
+            return current
+
+        lang, prob = self.classify(text)
+        if lang not in self.languages and prob >= SWITCH_CONFIDENCE:
+            return lang     # answered in kind, never learned as the prior
+        if lang == current or lang not in self.languages or prob < SWITCH_CONFIDENCE:
+            if learn and lang == current:
+                prior["streak"], prior["candidate"] = 0, None
+            return current
+
+        # Strong evidence for another language
+        if words >= INSTANT_SWITCH_WORDS and prob >= INSTANT_SWITCH_CONFIDENCE:
+            streak = SWITCH_STREAK
+        else:
+            streak = prior.get("streak", 0) + 1 if prior.get("candidate") == lang else 1
+
+        if streak >= SWITCH_STREAK:
+            if learn:
+                prior.update(lang=lang, streak=0, candidate=None)
+            return lang
+
+        if learn:
+            prior["streak"], prior["candidate"] = streak, lang
+        return current
+
+
+lang_service = LanguageService()
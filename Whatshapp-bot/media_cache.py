@@ -0,0 +1,169 @@
+# media_cache.py
+"""
+Media index and thumbnail cache for the contact profile gallery.
+
+  • Each media folder is indexed incrementally: the listing is only re-read
+    when the folder's mtime changes, and then only files whose size or mtime
+    changed get new thumbnails. A file overwritten in place doesn't change
+    the folder's mtime, so stat() (and with it thumb_for()) also checks the
+    file's own (size, mtime_ns) and refreshes its index entry.
+  • Thumbnails are downscaled JPEGs generated in a small background pool and
+    stored under thumbs/ with a content-addressed name (source path + size +
+    mtime), so they survive restarts and never go stale: an edited photo gets
+    a new name. Concurrent requests for the same thumbnail share one job.
+  • Pillow is optional. Without it, thumb_for() returns None and the gallery
+    shows the originals as before.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+VIDEO_EXTS = ('.mp4', '.webm', '.ogg')
+
+THUMB_SIZE = 320
+THUMB_QUALITY = 80
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:     # thumbnails are optional
+    Image = None
+
+
+def media_kind(filename):
+    name = filename.lower()
+    if name.endswith(IMAGE_EXTS):
+        return "image"
+    if name.endswith(VIDEO_EXTS):
+        return "video"
+    return "file"
+
+
+class MediaCache:
+    def __init__(self, thumb_root, size=THUMB_SIZE, workers=2):
+        self.thumb_root = thumb_root
+        self.size = size
+        self._dirs = {}             # media_dir -> {"mtime": ns, "files": {name: (size, mtime_ns)}, "order": [...]}
+        self._jobs = {}             # thumb path -> Future (in flight)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs") if Image else None
+        self.generated = 0
+
+    @property
+    def thumbnails_enabled(self):
+        return self._pool is not None
+
+    # ─── Index ──────────────────────────────────────────────────────
+    def _scan(self, media_dir):
+        try:
+            dir_mtime = os.stat(media_dir).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._dirs.get(media_dir)
+            if entry and entry["mtime"] == dir_mtime:
+                return entry
+            old = entry["files"] if entry else {}
+        files = {}
+        changed = []
+        for e in os.scandir(media_dir):
+            if not e.is_file():
+                continue
+            st = e.stat()
+            meta = (st.st_size, st.st_mtime_ns)
+            files[e.name] = meta
+            if old.get(e.name) != meta:
+                changed.append(e.name)
+        entry = {"mtime": dir_mtime, "files": files, "order": sorted(files)}
+        with self._lock:
+            self._dirs[media_dir] = entry
+        # pre-generate thumbnails for new/changed photos in the background
+        for name in changed:
+            if media_kind(name) == "image":
+                self._submit(media_dir, name, files[name])
+        return entry
+
+    def listing(self, media_dir):
+        """Sorted file names in media_dir."""
+        entry = self._scan(media_dir) if media_dir else None
+        return entry["order"] if entry else []
+
+    def stat(self, media_dir, name):
+        """(size, mtime_ns) of the file as it is now, or None if it isn't there."""
+        entry = self._scan(media_dir)
+        if not entry or name not in entry["files"]:
+            return None
+        try:
+            st = os.stat(os.path.join(media_dir, name))
+        except OSError:
+            return None
+        meta = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            changed = entry["files"].get(name) != meta
+            entry["files"][name] = meta
+        if changed and media_kind(name) == "image":
+            self._submit(media_dir, name, meta)   # overwritten in place
+        return meta
+
+    # ─── Thumbnails ─────────────────────────────────────────────────
+    def thumb_key(self, media_dir, name, meta):
+        raw = f"{os.path.abspath(os.path.join(media_dir, name))}|{meta[0]}|{meta[1]}|{self.size}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+    def _thumb_path(self, key):
+        return os.path.join(self.thumb_root, key[:2], key + ".jpg")
+
+    def _submit(self, media_dir, name, meta):
+        if self._pool is None:
+            return None
+        path = self._thumb_path(self.thumb_key(media_dir, name, meta))
+        if os.path.exists(path):
+            return None
+        with self._lock:
+            job = self._jobs.get(path)
+            if job is None:
+                job = self._pool.submit(self._make_thumb, os.path.join(media_dir, name), path)
+                self._jobs[path] = job
+                job.add_done_callback(lambda _f, p=path: self._forget(p))
+            return job
+
+    def _forget(self, path):
+        with self._lock:
+            self._jobs.pop(path, None)
+
+    def _make_thumb(self, src, dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with Image.open(src) as im:
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((self.size, self.size))
+            if im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+            tmp = dest + ".tmp"
+            im.save(tmp, "JPEG", quality=THUMB_QUALITY, optimize=True)
+        os.replace(tmp, dest)
+        self.generated += 1
+        return dest
+
+    def thumb_for(self, media_dir, name, wait=5.0):
+        """
+        Path of name's thumbnail, generating it if needed (waits up to `wait`
+        seconds). None if thumbnails are off, the file isn't an image, or it
+        can't be decoded.
+        """
+        if self._pool is None or media_kind(name) != "image":
+            return None
+        meta = self.stat(media_dir, name)
+        if meta is None:
+            return None
+        path = self._thumb_path(self.thumb_key(media_dir, name, meta))
+        if os.path.exists(path):
+            return path
+        job = self._submit(media_dir, name, meta)
+        if job is None:
+            return path if os.path.exists(path) else None
+        try:
+            return job.result(timeout=wait)
+        except Exception as e:
+            print(f"[ERROR] Thumbnail failed for {name}: {e}")
+            return None
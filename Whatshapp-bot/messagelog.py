@@ -0,0 +1,259 @@
+# messagelog.py
+"""
+Compact in-memory chat history.
+
+A history used to be a list of {"role", "content", "ts"} dicts: a dict, two
+or three str objects and an ISO timestamp string per message, several hundred
+bytes before the text itself. MessageLog stores the same messages in columns:
+
+    roles     array('b')    small int per message (user/assistant/system)
+    ts        array('q')    epoch microseconds
+    tz        array('h')    UTC offset in minutes (or "naive")
+    start/len array('Q'/'I') slice of one shared utf-8 buffer for the content
+
+so a message costs ~23 bytes plus its utf-8 text. Anything that doesn't fit
+the columns exactly (an unusual role, a timestamp that wouldn't round-trip
+to the same string, extra keys like "wa_id") is kept per message in a small
+side dict, so reading a message always gives back what was stored.
+
+MessageLog behaves like a list of dicts for existing callers: len(),
+iteration, hist[-10:], hist[-1], append/extend, del hist[:n]. Reading an item
+builds a fresh dict, so mutate messages with hist[i] = {...}, not in place.
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableSequence
+from datetime import datetime, timedelta, timezone
+
+ROLES = ("user", "assistant", "system")
+_ROLE_CODE = {r: i for i, r in enumerate(ROLES)}
+_NO_ROLE = -1
+_NO_TS = -(2 ** 63)
+_NAIVE = -(2 ** 15)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_NAIVE = datetime(1970, 1, 1)
+_COLUMN_KEYS = ("role", "content", "ts")
+_US = timedelta(microseconds=1)
+
+
+_TZ_CACHE = {}
+
+
+def _tz(off):
+    tz = _TZ_CACHE.get(off)
+    if tz is None:
+        tz = _TZ_CACHE[off] = timezone(timedelta(minutes=off))
+    return tz
+
+
+def _encode_ts(ts):
+    """ISO string -> (epoch µs, offset minutes), or None if it wouldn't round-trip."""
+    if not isinstance(ts, str):
+        return None
+    try:
+        dt = datetime.fromisoformat(ts)
+    except ValueError:
+        return None
+    if dt.isoformat() != ts:
+        return None  # e.g. "Z" suffix or a shortened form; keep the original string
+    if dt.tzinfo is None:
+        return (dt - _EPOCH_NAIVE) // _US, _NAIVE
+    delta = dt.utcoffset()
+    if delta % timedelta(minutes=1):
+        return None
+    return (dt - _EPOCH) // _US, delta // timedelta(minutes=1)
+
+
+def _decode_ts(us, off):
+    if off == _NAIVE:
+        return (_EPOCH_NAIVE + timedelta(microseconds=us)).isoformat()
+    secs, micro = divmod(us, 1_000_000)
+    return datetime.fromtimestamp(secs, _tz(off)).replace(microsecond=micro).isoformat()
+
+
+class MessageLog(MutableSequence):
+    def __init__(self, messages=()):
+        self._roles = array("b")
+        self._ts = array("q")
+        self._tz = array("h")
+        self._start = array("Q")
+        self._len = array("I")
+        self._buf = bytearray()
+        self._garbage = 0       # buffer bytes no longer referenced
+        self._extras = {}       # index -> {key: value} that didn't fit the columns
+        self.extend(messages)
+
+    # ─── Encoding ───────────────────────────────────────────────────
+    def _encode(self, msg):
+        role = msg.get("role")
+        code = _ROLE_CODE.get(role, _NO_ROLE) if isinstance(role, str) else _NO_ROLE
+        content = msg.get("content")
+        data = content.encode("utf-8") if isinstance(content, str) else b""
+        ts = _encode_ts(msg.get("ts")) if "ts" in msg else None
+        extras = {k: v for k, v in msg.items() if k not in _COLUMN_KEYS}
+        if code == _NO_ROLE and "role" in msg:
+            extras["role"] = role
+        if not isinstance(content, str) and "content" in msg:
+            extras["content"] = content
+        if ts is None and "ts" in msg:
+            extras["ts"] = msg["ts"]
+        missing = [k for k in _COLUMN_KEYS if k not in msg]
+        if missing:
+            extras["_missing"] = missing
+        return code, ts or (_NO_TS, 0), data, extras
+
+    def _decode(self, i):
+        msg = {}
+        code = self._roles[i]
+        if code != _NO_ROLE:
+            msg["role"] = ROLES[code]
+        s = self._start[i]
+        msg["content"] = self._buf[s:s + self._len[i]].decode("utf-8")
+        if self._ts[i] != _NO_TS:
+            msg["ts"] = _decode_ts(self._ts[i], self._tz[i])
+        extras = self._extras.get(i)
+        if extras:
+            for k in extras.get("_missing", ()):
+                msg.pop(k, None)
+            msg.update((k, v) for k, v in extras.items() if k != "_missing")
+        return msg
+
+    def _write(self, i, msg):
+        code, (us, off), data, extras = self._encode(msg)
+        self._roles[i] = code
+        self._ts[i] = us
+        self._tz[i] = off
+        self._start[i] = len(self._buf)
+        self._len[i] = len(data)
+        self._buf += data
+        if extras:
+            self._extras[i] = extras
+        else:
+            self._extras.pop(i, None)
+
+    # ─── Sequence protocol ──────────────────────────────────────────
+    def __len__(self):
+        return len(self._roles)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._decode(i) for i in range(*index.indices(len(self)))]
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("MessageLog index out of range")
+        return self._decode(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._decode(i)
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self._decode(i)
+
+    def __setitem__(self, index, msg):
+        if isinstance(index, slice):
+            items = list(msg)
+            rng = range(*index.indices(len(self)))
+            if index.step not in (None, 1):
+                if len(rng) != len(items):
+                    raise ValueError(f"attempt to assign sequence of size {len(items)} to extended slice of size {len(rng)}")
+                for i, m in zip(rng, items):
+                    self._replace(i, m)
+            else:
+                del self[index]
+                for k, m in enumerate(items):
+                    self.insert(rng.start + k, m)
+            return
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("MessageLog assignment index out of range")
+        self._replace(index, msg)
+
+    def _replace(self, i, msg):
+        self._garbage += self._len[i]
+        self._write(i, msg)
+        self._maybe_compact()
+
+    def __delitem__(self, index):
+        n = len(self)
+        if isinstance(index, slice):
+            doomed = range(*index.indices(n))
+        else:
+            if index < 0:
+                index += n
+            if not 0 <= index < n:
+                raise IndexError("MessageLog assignment index out of range")
+            doomed = range(index, index + 1)
+            index = slice(index, index + 1)
+        if not doomed:
+            return
+        self._garbage += sum(self._len[i] for i in doomed)
+        for col in (self._roles, self._ts, self._tz, self._start, self._len):
+            del col[index]
+        if self._extras:
+            gone = sorted(doomed)
+            self._extras = {
+                i - bisect_left(gone, i): e
+                for i, e in self._extras.items() if i not in doomed
+            }
+        self._maybe_compact()
+
+    def insert(self, index, msg):
+        n = len(self)
+        if index < 0:
+            index = max(0, index + n)
+        index = min(index, n)
+        for col in (self._roles, self._ts, self._tz, self._start, self._len):
+            col.insert(index, 0)
+        if self._extras:
+            self._extras = {(i + 1 if i >= index else i): e for i, e in self._extras.items()}
+        self._write(index, msg)
+
+    def append(self, msg):
+        for col in (self._roles, self._ts, self._tz, self._start, self._len):
+            col.append(0)
+        self._write(len(self._roles) - 1, msg)
+
+    def extend(self, messages):
+        for m in messages:
+            self.append(m)
+
+    def clear(self):
+        self.__init__()
+
+    def __repr__(self):
+        return f"<MessageLog {len(self)} messages, {len(self._buf)} bytes>"
+
+    # ─── Housekeeping ───────────────────────────────────────────────
+    def _maybe_compact(self):
+        """Drop unreferenced bytes once they outweigh the live text."""
+        if self._garbage < 65536 or self._garbage * 2 < len(self._buf):
+            return
+        buf = bytearray()
+        for i in range(len(self)):
+            s = self._start[i]
+            self._start[i] = len(buf)
+            buf += self._buf[s:s + self._len[i]]
+        self._buf = buf
+        self._garbage = 0
+
+    def nbytes(self):
+        """Approximate memory held by the columns and text buffer."""
+        cols = (self._roles, self._ts, self._tz, self._start, self._len)
+        return sum(c.itemsize * len(c) for c in cols) + len(self._buf)
+
+    def to_list(self):
+        """Plain list of dicts (for JSON)."""
+        return list(self)
+
+
+def json_default(obj):
+    """json.dump(default=...) hook so MessageLog serializes as a plain list."""
+    if isinstance(obj, MessageLog):
+        return obj.to_list()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,200 @@
+# metrics.py
+"""
+Lightweight tracing and metrics, exposed in Prometheus text format at /metrics.
+
+  • metrics.span("stage") times a block. Inside a request it is also added to
+    that request's trace, so a slow request can be logged with its per-stage
+    breakdown; outside a request (background workers) only the histogram is
+    updated.
+  • metrics.inc(name, n, **labels) bumps a counter (model calls, tokens,
+    bytes written, ...); metrics.observe(name, seconds, **labels) feeds a
+    histogram; metrics.gauge(name, fn) publishes a value read at scrape time
+    (e.g. cache hit counts kept by other modules).
+
+Everything lives in process memory, behind one lock; recording a span costs a
+couple of dict lookups.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n_buckets):
+        self.counts = [0] * n_buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS, slow_request_seconds=2.0):
+        self.buckets = tuple(buckets)
+        self.slow_request_seconds = slow_request_seconds
+        self._counters = {}     # name -> {label_key: value}
+        self._hists = {}        # name -> {label_key: _Histogram}
+        self._gauges = {}       # name -> fn() -> number | {label dict as tuple: number}
+        self._help = {}         # name -> (type, help)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ─── Recording ──────────────────────────────────────────────────
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._hists.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = _Histogram(len(self.buckets))
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    h.counts[i] += 1
+                    break
+            h.sum += value
+            h.count += 1
+
+    def gauge(self, name, fn, help_text="", kind="gauge"):
+        self._gauges[name] = fn
+        self.describe(name, kind, help_text)
+
+    # ─── Tracing ────────────────────────────────────────────────────
+    @contextmanager
+    def span(self, stage):
+        trace = getattr(self._local, "trace", None)
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t
+            self._local.depth = depth
+            route = trace["route"] if trace is not None else "background"
+            self.observe("stage_seconds", elapsed, route=route, stage=stage)
+            if trace is not None:
+                trace["spans"].append((depth, stage, elapsed))
+
+    def begin_request(self, route):
+        self._local.trace = {"route": route or "unknown", "start": time.perf_counter(), "spans": []}
+        self._local.depth = 0
+
+    def end_request(self, status=None, detail=""):
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            return None
+        self._local.trace = None
+        elapsed = time.perf_counter() - trace["start"]
+        self.observe("request_seconds", elapsed, route=trace["route"])
+        self.inc("requests_total", route=trace["route"], status=status or "")
+        if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+            self.inc("slow_requests_total", route=trace["route"])
+            print(self.format_trace(trace, elapsed, detail))
+        return elapsed
+
+    def format_trace(self, trace, elapsed, detail=""):
+        lines = [f"[SLOW] {trace['route']} took {elapsed * 1000:.0f} ms {detail}".rstrip()]
+        # spans are recorded as they finish (children first); show them in start order
+        for depth, stage, secs in _start_order(trace["spans"]):
+            lines.append(f"   {secs * 1000:8.1f} ms  {'  ' * depth}{stage}")
+        return "\n".join(lines)
+
+    # ─── Exposition ─────────────────────────────────────────────────
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        out = []
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            hists = {n: {k: (list(h.counts), h.sum, h.count) for k, h in s.items()} for n, s in self._hists.items()}
+        for name in sorted(counters):
+            self._header(out, name, "counter")
+            for key, value in sorted(counters[name].items()):
+                out.append(f"{name}{_fmt_labels(key)} {value}")
+        for name in sorted(hists):
+            self._header(out, name, "histogram")
+            for key, (counts, total, count) in sorted(hists[name].items()):
+                running = 0
+                for b, c in zip(self.buckets, counts):
+                    running += c
+                    out.append(f"{name}_bucket{_fmt_labels(key, [('le', repr(b))])} {running}")
+                out.append(f"{name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {count}")
+                out.append(f"{name}_sum{_fmt_labels(key)} {total}")
+                out.append(f"{name}_count{_fmt_labels(key)} {count}")
+        for name in sorted(self._gauges):
+            try:
+                value = self._gauges[name]()
+            except Exception:
+                continue
+            self._header(out, name, self._help.get(name, ("gauge", ""))[0])
+            if isinstance(value, dict):
+                for labels, v in sorted(value.items()):
+                    out.append(f"{name}{_fmt_labels(_label_key(dict(labels)))} {v}")
+            else:
+                out.append(f"{name} {value}")
+        return "\n".join(out) + "\n"
+
+    def _header(self, out, name, default_kind):
+        kind, help_text = self._help.get(name, (default_kind, ""))
+        if help_text:
+            out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+
+
+def _start_order(spans):
+    """Re-nest spans recorded in finish order (post-order) into start order (pre-order)."""
+    out, stack = [], []
+    for depth, stage, secs in spans:
+        children = []
+        while stack and stack[-1][0] > depth:
+            children.insert(0, stack.pop()[1])
+        stack.append((depth, [(depth, stage, secs)] + [c for group in children for c in group]))
+    for _, group in stack:
+        out.extend(group)
+    return out
+
+
+metrics = Metrics()
+metrics.describe("stage_seconds", "histogram", "Time spent per stage, by route")
+metrics.describe("request_seconds", "histogram", "Request latency by route")
+metrics.describe("requests_total", "counter", "Requests served, by route and status")
+metrics.describe("slow_requests_total", "counter", "Requests slower than the slow-request threshold")
+metrics.describe("model_calls_total", "counter", "Chat completion calls, by route, model and outcome")
+metrics.describe("model_tokens_total", "counter", "Tokens used, by route, model and kind (prompt/completion)")
+metrics.describe("ipc_connections_total", "counter", "Bridge channel connections accepted")
+metrics.describe("ipc_requests_total", "counter", "Requests received over the bridge channel")
+metrics.describe("outbound_sends_total", "counter", "Outbound items the bridge finished, by outcome")
+metrics.describe("outbound_send_attempts_total", "counter", "WhatsApp send attempts by the bridge, retries included")
+metrics.describe("outbound_send_seconds", "histogram", "Time from the bridge starting an item to its last part sent")
+metrics.describe("sync_messages_total", "counter", "Messages posted by the bridge history sync, added or duplicate")
+metrics.describe("sync_missed_total", "counter", "Synced inbound messages that arrived while the bot was offline")
+metrics.describe("search_indexed_total", "counter", "Messages added to the full-text search index")
+metrics.describe("search_seconds", "histogram", "Time to answer one /api/search page")
+metrics.describe("model_call_seconds", "histogram", "Chat completion latency, by route and model")
+metrics.describe("model_fallbacks_total", "counter", "Calls retried on the fallback model after a timeout, connection, rate-limit, 5xx or unknown-model error")
+metrics.describe("persist_bytes_total", "counter", "Bytes written by persistence, by target")
+metrics.describe("persist_writes_total", "counter", "Files written by persistence, by target")
+metrics.describe("reply_cache_lookups_total", "counter", "Reply cache lookups for small talk, by outcome")
+metrics.describe("reply_cache_saved_calls_total", "counter", "Model calls spared by reply cache hits")
@@ -0,0 +1,141 @@
+# model_router.py
+"""
+Picks the model for each OpenAI call from a small routing table.
+
+Every call site names its route ("reply", "translate", "classify", ...).
+A route maps to a model tier, optionally a stronger tier for complex
+messages, a per-call timeout (capped by OPENAI_TIMEOUT, serve.py
+--model-timeout) and a fallback tier:
+
+    "reply": {"tier": "fast", "complex_tier": "strong", "timeout": 20, "fallback": "fast"}
+
+  • tiers ("fast", "strong") map to model names, so the table reads the
+    same when the models behind it change.
+  • is_complex() marks long or emotional messages; routes with a
+    complex_tier send those to it.
+  • when the chosen model times out, can't be reached, is overloaded or
+    doesn't exist (after the client's usual retries, which skip timeouts),
+    the call is retried once on the fallback tier (if it names a different
+    model).
+  • every call's latency and tokens are recorded per route and model, both
+    as metrics and in report(), which is what the table is tuned from.
+
+model_routes.json next to bot.py, if present, is merged over the defaults
+({"tiers": {...}, "routes": {...}}); OPENAI_MODEL and OPENAI_STRONG_MODEL
+set the default tiers.
+"""
+import json
+import os
+import threading
+
+from metrics import metrics
+
+DEFAULT_TIERS = {
+    "fast": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+    "strong": os.getenv("OPENAI_STRONG_MODEL", "gpt-4o"),
+}
+
+DEFAULT_ROUTES = {
+    # the contact-facing reply: fast for small talk, strong for long/emotional messages
+    "reply":      {"tier": "fast", "complex_tier": "strong", "timeout": 20, "fallback": "fast"},
+    "regenerate": {"tier": "strong", "timeout": 25, "fallback": "fast"},
+    "translate":  {"tier": "fast", "timeout": 15, "fallback": "strong"},
+    # yes/no objective checks
+    "classify":   {"tier": "fast", "timeout": 8},
+    "summary":    {"tier": "fast", "timeout": 45, "fallback": "strong"},
+    "profile":    {"tier": "fast", "timeout": 45},
+    "strategy":   {"tier": "strong", "timeout": 30, "fallback": "fast"},
+}
+# upper bound on every route's timeout, and the timeout of call sites without
+# a route of their own (serve.py --model-timeout)
+MODEL_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+DEFAULT_ROUTE = {"tier": "fast", "timeout": MODEL_TIMEOUT}
+
+# messages longer than this (in words) count as complex
+LONG_MESSAGE_WORDS = 40
+COMPLEX_MOODS = ("sad", "emotional")
+
+
+def is_complex(text, hits=()):
+    """Long or emotional messages get the route's complex_tier."""
+    return len((text or "").split()) > LONG_MESSAGE_WORDS or any(m in hits for m in COMPLEX_MOODS)
+
+
+class ModelRouter:
+    def __init__(self, tiers=None, routes=None):
+        self.tiers = dict(DEFAULT_TIERS, **(tiers or {}))
+        self.routes = {name: dict(r) for name, r in DEFAULT_ROUTES.items()}
+        for name, r in (routes or {}).items():
+            self.routes[name] = dict(self.routes.get(name, {}), **r)
+        self._stats = {}    # (route, model) -> counters
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Could not read {os.path.basename(path)}, using default model routes: {e}")
+            return cls()
+        return cls(data.get("tiers"), data.get("routes"))
+
+    def _model(self, tier):
+        # a tier that isn't in the table is taken as a model name
+        return self.tiers.get(tier, tier) if tier else None
+
+    def pick(self, route, complex=False):
+        """(model, timeout, fallback model or None) for a call on route."""
+        r = self.routes.get(route, DEFAULT_ROUTE)
+        tier = r.get("complex_tier") if complex and r.get("complex_tier") else r.get("tier", "fast")
+        model = self._model(tier)
+        fallback = self._model(r.get("fallback"))
+        timeout = min(float(r.get("timeout", MODEL_TIMEOUT)), MODEL_TIMEOUT)
+        return model, timeout, (fallback if fallback != model else None)
+
+    # ─── Stats ──────────────────────────────────────────────────────
+    def record(self, route, model, seconds, outcome="ok", prompt_tokens=0, completion_tokens=0):
+        metrics.observe("model_call_seconds", seconds, route=route, model=model)
+        metrics.inc("model_calls_total", route=route, model=model, outcome=outcome)
+        if prompt_tokens or completion_tokens:
+            metrics.inc("model_tokens_total", prompt_tokens, route=route, model=model, kind="prompt")
+            metrics.inc("model_tokens_total", completion_tokens, route=route, model=model, kind="completion")
+        with self._lock:
+            s = self._stats.setdefault((route, model), {
+                "calls": 0, "errors": 0, "timeouts": 0, "fallbacks": 0,
+                "seconds": 0.0, "max_seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            })
+            s["calls"] += 1
+            if outcome == "timeout":
+                s["timeouts"] += 1
+            elif outcome != "ok":
+                s["errors"] += 1
+            s["seconds"] += seconds
+            s["max_seconds"] = max(s["max_seconds"], seconds)
+            s["prompt_tokens"] += prompt_tokens
+            s["completion_tokens"] += completion_tokens
+
+    def record_fallback(self, route, model, fallback, reason="timed out"):
+        metrics.inc("model_fallbacks_total", route=route, model=model)
+        with self._lock:
+            s = self._stats.get((route, model))
+            if s is not None:
+                s["fallbacks"] += 1
+        print(f"[INFO] {route}: {model} {reason}, retrying on {fallback}")
+
+    def report(self):
+        """Per route and model: calls, latency and tokens, plus the table in use."""
+        with self._lock:
+            rows = []
+            for (route, model), s in sorted(self._stats.items()):
+                calls = s["calls"] or 1
+                rows.append(dict(
+                    s, route=route, model=model,
+                    avg_seconds=round(s["seconds"] / calls, 3),
+                    max_seconds=round(s["max_seconds"], 3),
+                    seconds=round(s["seconds"], 3),
+                    avg_completion_tokens=round(s["completion_tokens"] / calls, 1),
+                ))
+        return {"tiers": self.tiers, "routes": self.routes, "stats": rows}
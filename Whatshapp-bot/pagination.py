@@ -0,0 +1,84 @@
+# pagination.py
+"""
+Cursor pagination for the dashboard's JSON endpoints.
+
+Cursors are opaque to the browser: a url-safe base64 of the sort key of the
+last item served (keyset pagination), or of an offset for plain lists. Keyset
+cursors stay correct when rows are added or re-ordered between page loads.
+A cursor that doesn't fit the list (garbage, or from another view) reads as
+no cursor: the first page.
+"""
+import base64
+import json
+from bisect import bisect_right
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def clamp_limit(raw, default=DEFAULT_LIMIT):
+    try:
+        n = int(raw)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(MAX_LIMIT, n))
+
+
+def encode_cursor(value) -> str:
+    raw = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _as_key(value):
+    return tuple(_as_key(v) for v in value) if isinstance(value, list) else value
+
+
+def _comparable(value, key):
+    """Whether a decoded cursor value orders against a sort key (same shape and types)."""
+    if isinstance(key, tuple):
+        return isinstance(value, tuple) and len(value) == len(key) and all(map(_comparable, value, key))
+    if isinstance(key, (int, float)):
+        return isinstance(value, (int, float))
+    return type(value) is type(key)
+
+
+def paginate_sorted(rows, sort_key, cursor=None, limit=DEFAULT_LIMIT):
+    """
+    Keyset page over `rows`, which must already be sorted by `sort_key`.
+    Returns {"items": [...], "next_cursor": str | None}.
+    """
+    keys = [_as_key(sort_key(r)) for r in rows]
+    after = _as_key(decode_cursor(cursor))
+    if after is not None and keys and not _comparable(after, keys[0]):
+        after = None
+    start = bisect_right(keys, after) if after is not None else 0
+    items = rows[start:start + limit]
+    next_cursor = None
+    if start + limit < len(rows) and items:
+        next_cursor = encode_cursor(keys[start + len(items) - 1])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def paginate_offset(items, cursor=None, limit=DEFAULT_LIMIT):
+    """Offset page over a plain list (for queues that are only appended to)."""
+    after = decode_cursor(cursor)
+    start = after.get("o", 0) if isinstance(after, dict) else 0
+    if not isinstance(start, int) or isinstance(start, bool) or start < 0:
+        start = 0
+    page = items[start:start + limit]
+    end = start + len(page)
+    return {
+        "items": page,
+        "offset": start,
+        "next_cursor": encode_cursor({"o": end}) if end < len(items) else None,
+    }
@@ -0,0 +1,95 @@
+# profile_learner.py
+"""
+Background scheduler for automatic contact-profile updates.
+
+reply() only calls schedule(jid); the actual model call runs later on a small
+worker pool, off the request path:
+  • bursts of triggers for the same contact coalesce into one run
+    (each trigger pushes the run back by `debounce` seconds, up to `max_delay`)
+  • at most `max_workers` updates run at once
+  • runs are held back while replies are in flight (`is_busy`), so profile
+    learning never competes with a live conversation, but not past
+    `max_delay` after the first trigger (steady traffic can't starve it)
+"""
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ProfileLearner:
+    def __init__(self, run, max_workers=1, debounce=30.0, max_delay=300.0,
+                 is_busy=None, busy_backoff=2.0):
+        self.run = run                  # run(jid) does the actual update
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.is_busy = is_busy or (lambda: False)
+        self.busy_backoff = busy_backoff
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="profile-learner")
+        self._due = {}                  # jid -> (due_at, first_requested_at)
+        self._running = set()
+        self._rerun = set()             # triggered again while running
+        self._cond = threading.Condition()
+        self._thread = None
+        self.runs = 0
+        self.coalesced = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="profile-learner-dispatch", daemon=True)
+            self._thread.start()
+
+    def schedule(self, jid):
+        now = time.monotonic()
+        with self._cond:
+            if jid in self._running:
+                self._rerun.add(jid)
+                self.coalesced += 1
+                return
+            if jid in self._due:
+                self.coalesced += 1
+                first = self._due[jid][1]
+            else:
+                first = now
+            due = min(now + self.debounce, first + self.max_delay)
+            self._due[jid] = (due, first)
+            self._cond.notify()
+        self.start()
+
+    def pending(self):
+        with self._cond:
+            return {"scheduled": sorted(self._due), "running": sorted(self._running)}
+
+    # ─── Dispatcher ─────────────────────────────────────────────────
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._due:
+                    self._cond.wait()
+                jid, (due, first) = min(self._due.items(), key=lambda kv: kv[1][0])
+                now = time.monotonic()
+                wait = due - now
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+                if now - first < self.max_delay and self.is_busy():
+                    self._cond.wait(timeout=self.busy_backoff)
+                    continue
+                del self._due[jid]
+                self._running.add(jid)
+            self._pool.submit(self._run_one, jid)
+
+    def _run_one(self, jid):
+        try:
+            self.runs += 1
+            self.run(jid)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self._cond:
+                self._running.discard(jid)
+                if jid in self._rerun:
+                    self._rerun.discard(jid)
+                    now = time.monotonic()
+                    self._due[jid] = (now + self.debounce, now)
+                    self._cond.notify()
@@ -0,0 +1,180 @@
+# profiler.py
+"""
+On-demand request profiling, switched on from the /profiler page.
+
+Two modes, usable together:
+  • every Nth /reply is profiled
+  • every request for one chosen contact (jid) is profiled
+
+A profiled request runs under cProfile (exact call counts and times, written
+as a .prof pstats file) while a sampler thread snapshots its stack every few
+milliseconds (written as a .folded collapsed-stack file, ready for
+flamegraph.pl / speedscope). A small .json sidecar keeps the route, jid,
+duration and top functions for the dashboard. Only the newest `keep`
+profiles are kept.
+
+When profiling is off, the request hooks only check one boolean.
+"""
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from storage import contact_key
+
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 15
+
+
+class _Sampler(threading.Thread):
+    """Collects collapsed stacks of one thread until stopped."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            key = ";".join(reversed(parts))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+class ProfileSession:
+    def __init__(self, route, jid, interval):
+        self.route = route
+        self.jid = jid
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.sampler = _Sampler(threading.get_ident(), interval)
+
+    def start(self):
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        return time.perf_counter() - self.started
+
+
+class RequestProfiler:
+    def __init__(self, out_dir, keep=30, interval=SAMPLE_INTERVAL):
+        self.out_dir = out_dir
+        self.keep = keep
+        self.interval = interval
+        self.every_n = 0            # profile every Nth /reply (0 = off)
+        self.jid = None             # profile every request for this contact
+        self.active = False         # the only thing checked when profiling is off
+        self._count = itertools.count(1)    # next() is atomic, no lock per /reply
+        self._busy = threading.Lock()   # one cProfile session at a time
+
+    def configure(self, every_n=0, jid=None):
+        self.every_n = max(0, int(every_n or 0))
+        self.jid = (jid or "").strip() or None
+        self._count = itertools.count(1)
+        self.active = bool(self.every_n or self.jid)
+
+    # ─── Request hooks ──────────────────────────────────────────────
+    def maybe_start(self, route, jid=None):
+        """Return a running ProfileSession if this request should be profiled."""
+        wanted = self.jid is not None and jid == self.jid
+        if not wanted and self.every_n and route == "reply":
+            wanted = next(self._count) % self.every_n == 0
+        if not wanted or not self._busy.acquire(blocking=False):
+            return None
+        session = ProfileSession(route, jid, self.interval)
+        try:
+            session.start()
+        except Exception:
+            self._busy.release()
+            raise
+        return session
+
+    def finish(self, session):
+        try:
+            seconds = session.stop()
+        finally:
+            self._busy.release()
+        try:
+            self._write(session, seconds)
+        except Exception as e:
+            print(f"[ERROR] Could not write profile: {e}")
+
+    # ─── Output ─────────────────────────────────────────────────────
+    def _write(self, session, seconds):
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S-%f")[:-3]
+        who = contact_key(session.jid) if session.jid else "all"
+        base = os.path.join(self.out_dir, f"{stamp}-{session.route}-{who}")
+
+        session.profile.dump_stats(base + ".prof")
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in sorted(session.sampler.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        stats = pstats.Stats(session.profile)
+        rows = []
+        for (filename, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "calls": nc,
+                "tottime": round(tt, 4),
+                "cumtime": round(ct, 4),
+            })
+        rows.sort(key=lambda r: r["cumtime"], reverse=True)
+        meta = {
+            "name": os.path.basename(base),
+            "route": session.route,
+            "jid": session.jid,
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "seconds": round(seconds, 4),
+            "samples": sum(session.sampler.stacks.values()),
+            "top": rows[:TOP_FUNCTIONS],
+        }
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        self._rotate()
+        print(f"[INFO] Profiled {session.route} ({seconds * 1000:.0f} ms) -> {base}.prof")
+
+    def _rotate(self):
+        metas = sorted(n for n in os.listdir(self.out_dir) if n.endswith(".json"))
+        for name in metas[:max(0, len(metas) - self.keep)]:
+            stem = name[:-len(".json")]
+            for ext in (".json", ".prof", ".folded"):
+                try:
+                    os.remove(os.path.join(self.out_dir, stem + ext))
+                except OSError:
+                    pass
+
+    def recent(self, limit=20):
+        """Newest profiles first (their .json sidecars)."""
+        if not os.path.isdir(self.out_dir):
+            return []
+        out = []
+        for name in sorted((n for n in os.listdir(self.out_dir) if n.endswith(".json")), reverse=True)[:limit]:
+            try:
+                with open(os.path.join(self.out_dir, name), encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return out
@@ -0,0 +1,197 @@
+# reply_cache.py
+"""
+Near-duplicate reply cache for small talk.
+
+Contacts send the same few openers over and over ("gm", "good morning!!",
+"how was ur day"). Each one used to cost a prompt build, a model call and
+often a translation. This cache remembers, per contact, which replies were
+actually sent (or approved) for which inbound messages, and serves one of
+them again when a new message is close enough:
+
+  • fingerprint: the message is normalized (case, accents, punctuation,
+    stretched letters: "goood morninggg!!" -> "god morning") and cut into
+    character 3-gram shingles; two messages match when the Jaccard similarity
+    of their shingle sets reaches `threshold`.
+  • context: a match also needs the same coarse context signature (language,
+    mood, part of the day), so "gm" at 8am isn't answered like "gm" at 11pm.
+  • only short messages (<= max_words) are cached, and only replies from the
+    model path; entries older than `window_days` are ignored and pruned.
+  • the caller passes the contact's recent replies as `avoid`, so the same
+    text isn't sent twice in a row, and humanizes what it gets back.
+
+Hits and misses are counted per contact and overall, together with the
+model calls each hit saved. The file is written `flush_delay` seconds after
+the entries change (and at exit); lookups alone only update the counters,
+which go out with the next write.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+
+from metrics import metrics
+from storage import write_json_atomic
+
+MAX_WORDS = 8
+THRESHOLD = 0.6
+WINDOW_DAYS = 14
+MAX_PER_CONTACT = 50
+
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+_REPEAT_RE = re.compile(r"(\w)\1+")
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = _NON_WORD_RE.sub(" ", text)
+    text = _REPEAT_RE.sub(r"\1", text)
+    return _WS_RE.sub(" ", text).strip()
+
+
+def shingles(norm, k=3):
+    padded = f" {norm} "
+    if len(padded) <= k:
+        return {padded}
+    return {padded[i:i + k] for i in range(len(padded) - k + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ReplyCache:
+    def __init__(self, path, max_words=MAX_WORDS, threshold=THRESHOLD,
+                 window_days=WINDOW_DAYS, max_per_contact=MAX_PER_CONTACT, flush_delay=30.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.max_words = max_words
+        self.threshold = threshold
+        self.window = window_days * 86400
+        self.max_per_contact = max_per_contact
+        self._entries = {}      # jid -> [{"norm", "ctx", "reply", "ts"}], oldest first
+        self._shingles = {}     # norm -> shingle set (derived, not persisted)
+        self._stats = {}        # jid -> {"lookups", "hits", "saved_calls"}
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._stats_dirty = False   # counters changed; written with the next flush
+        self._timer = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._entries = data.get("entries", {})
+        self._stats = data.get("stats", {})
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            if not (self._dirty or self._stats_dirty):
+                return
+            self._dirty = self._stats_dirty = False
+            data = {"entries": self._entries, "stats": self._stats}
+            write_json_atomic(self.path, data, target="reply_cache", ensure_ascii=False)
+
+    def _shingles_of(self, norm):
+        s = self._shingles.get(norm)
+        if s is None:
+            if len(self._shingles) > 20000:
+                self._shingles.clear()
+            s = self._shingles[norm] = shingles(norm)
+        return s
+
+    def eligible(self, msg):
+        norm = normalize(msg)
+        return bool(norm) and len(norm.split()) <= self.max_words
+
+    # ─── Lookup / learn ─────────────────────────────────────────────
+    def lookup(self, jid, msg, ctx, avoid=(), saves=1):
+        """
+        A previously sent reply to a message like `msg` in context `ctx`, or
+        None. `avoid`: recent replies not to repeat. `saves`: model calls a
+        hit spares (for the report).
+        """
+        if not self.eligible(msg):
+            return None
+        norm = normalize(msg)
+        target = self._shingles_of(norm)
+        recent = {normalize(a) for a in avoid}
+        cutoff = time.time() - self.window
+        with self._lock:
+            stats = self._stats.setdefault(jid, {"lookups": 0, "hits": 0, "saved_calls": 0})
+            stats["lookups"] += 1
+            self._stats_dirty = True
+            candidates = [
+                e["reply"] for e in self._entries.get(jid, [])
+                if e["ts"] >= cutoff and e["ctx"] == ctx
+                and jaccard(target, self._shingles_of(e["norm"])) >= self.threshold
+                and not any(normalize(e["reply"]) in r for r in recent)
+            ]
+            if not candidates:
+                metrics.inc("reply_cache_lookups_total", outcome="miss")
+                return None
+            stats["hits"] += 1
+            stats["saved_calls"] += saves
+        metrics.inc("reply_cache_lookups_total", outcome="hit")
+        metrics.inc("reply_cache_saved_calls_total", saves)
+        return random.choice(candidates)
+
+    def learn(self, jid, msg, ctx, reply):
+        """Remember that `reply` was sent for `msg` in context `ctx`."""
+        if not reply or not self.eligible(msg):
+            return
+        norm = normalize(msg)
+        now = time.time()
+        with self._lock:
+            entries = self._entries.setdefault(jid, [])
+            entries[:] = [
+                e for e in entries
+                if e["ts"] >= now - self.window and not (e["norm"] == norm and e["ctx"] == ctx and e["reply"] == reply)
+            ]
+            entries.append({"norm": norm, "ctx": ctx, "reply": reply, "ts": now})
+            del entries[:-self.max_per_contact]
+            self._mark_dirty()
+
+    def drop(self, jid):
+        with self._lock:
+            self._entries.pop(jid, None)
+            self._stats.pop(jid, None)
+            self._mark_dirty()
+
+    # ─── Reporting ──────────────────────────────────────────────────
+    @staticmethod
+    def _rate(s):
+        return round(s["hits"] / s["lookups"], 3) if s["lookups"] else 0.0
+
+    def report(self):
+        with self._lock:
+            contacts = []
+            total = {"lookups": 0, "hits": 0, "saved_calls": 0}
+            for jid, s in self._stats.items():
+                for k in total:
+                    total[k] += s[k]
+                contacts.append(dict(s, jid=jid, hit_rate=self._rate(s),
+                                     entries=len(self._entries.get(jid, []))))
+            total["hit_rate"] = self._rate(total)
+            total["entries"] = sum(len(v) for v in self._entries.values())
+        contacts.sort(key=lambda c: -c["saved_calls"])
+        return {"global": total, "contacts": contacts}
@@ -0,0 +1,482 @@
+# router.py
+"""
+Front router for the sharded deployment (see shards.py).
+
+    python router.py --shards 4        # starts 4 bot.py workers, listens on :5001
+
+index.js and the dashboard keep talking to http://127.0.0.1:5001. Each
+request is forwarded to the worker that owns its contact, found from:
+
+  • a path segment holding a JID (/contact_profile/<jid>, /media/<jid>/...)
+  • a "sender"/"jid" field in the JSON body, form or query string
+  • a pending-item id minted by a shard ("s2-...")
+
+Views that span every contact are fetched from all shards and merged
+(/approved_batch, /pending, /api/contacts, /api/pending, /api/notifications,
+/api/knowledge_gaps, /events, /metrics), and bulk approval actions are sent
+to every shard.
+Everything else (dashboard pages, facts/personality/settings edits) goes to
+shard 0, which owns the global sections. /shards/<i>/<path> reaches one
+worker directly, e.g. /shards/2/profiler.
+"""
+import argparse
+import atexit
+import http.client
+import json
+import os
+import queue
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+import ipc
+from approval_queue import normalize_gap
+from contact_rows import ContactRows
+from events import HEARTBEAT_SECONDS, SUBSCRIBER_QUEUE_SIZE
+from pagination import MAX_LIMIT, clamp_limit, encode_cursor, paginate_offset
+from shards import OUTBOUND_HEADER, ShardConfig, shard_of
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+# headers that belong to one hop and must not be forwarded
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "content-length", "host",
+}
+ITEM_ROUTE_RE = re.compile(r"^/(approve_reply|approve_with_edit|reject_reply|regenerate_reply)/([^/]+)$")
+ITEM_ID_RE = re.compile(r"^s(\d+)-")
+BROADCAST_ROUTES = {
+    "/pending/approve_selected", "/pending/reject_selected",
+    "/pending/reject_older_than", "/add_knowledge_gap",
+}
+# safe to resend after the request went out and the connection dropped
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
+
+
+class ShardUnavailable(Exception):
+    pass
+
+
+class ShardClient:
+    """Keep-alive HTTP connections to one worker (one connection per router thread)."""
+
+    def __init__(self, index, host, port, timeout=120):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, target, body=None, headers=None):
+        """(status, [(header, value)], body bytes)"""
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            reused = conn is not None
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            sent = False
+            try:
+                conn.request(method, target, body=body, headers=headers or {})
+                sent = True
+                resp = conn.getresponse()
+                return resp.status, resp.getheaders(), resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                self._local.conn = None
+                # a kept-alive connection the worker already closed: retry once on a
+                # fresh one, unless the worker may have acted on it (a sent POST)
+                retry = reused and attempt == 0 and (not sent or method in IDEMPOTENT_METHODS)
+                if not retry:
+                    raise ShardUnavailable(f"shard {self.index} ({self.host}:{self.port}): {e}") from e
+
+    def open_stream(self, target):
+        """A dedicated connection for a long-lived response (SSE)."""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=HEARTBEAT_SECONDS * 3)
+        conn.request("GET", target, headers={"Accept": "text/event-stream"})
+        return conn, conn.getresponse()
+
+
+class ShardRouter:
+    def __init__(self, count, base_port=5101, host="127.0.0.1", timeout=120):
+        self.config = ShardConfig(count=count, base_port=base_port, host=host)
+        self.clients = [ShardClient(i, host, self.config.port(i), timeout=timeout)
+                        for i in range(self.config.count)]
+        self._pool = ThreadPoolExecutor(max_workers=max(2, self.config.count * 2), thread_name_prefix="fanout")
+        self.on_outbound = None     # set to push "outbound" over the bridge channel
+        self._event_subscribers = set()
+        self._events_lock = threading.Lock()
+        self._event_pumps = False
+        self.merged = {
+            "/approved_batch": self.merge_approved,
+            "/pending": self.merge_pending,
+            "/api/contacts": self.merge_keyset(ContactRows.sort_key),
+            "/api/pending": self.merge_keyset(lambda it: [it.get("seq", 0), it.get("id", "")]),
+            "/api/search": self.merge_keyset(lambda it: [it["score"], it["jid"], it["pos"]]),
+            "/api/notifications": self.merge_notifications,
+            "/api/knowledge_gaps": self.merge_knowledge_gaps,
+            "/api/reply_cache": self.merge_reply_cache,
+            "/sync/cursors": self.merge_cursors,
+            "/metrics": self.merge_metrics,
+            "/events": self.merge_events,
+        }
+
+    # ─── Finding the owner ──────────────────────────────────────────
+    def jid_of(self, path, req):
+        for seg in path.split("/"):
+            if "@" in seg:
+                return seg
+        body = req.get_json(silent=True) if req.is_json else None
+        if isinstance(body, dict):
+            jid = body.get("sender") or body.get("jid")
+            if jid:
+                return jid
+        return (req.form.get("jid") if req.form else None) or req.args.get("jid") or None
+
+    def owner(self, jid):
+        return shard_of(jid, self.config.count)
+
+    # ─── Forwarding ─────────────────────────────────────────────────
+    @staticmethod
+    def _headers(req):
+        headers = {k: v for k, v in req.headers.items() if k.lower() not in HOP_BY_HOP}
+        headers["X-Forwarded-For"] = req.remote_addr or ""
+        return headers
+
+    @staticmethod
+    def _response(status, headers, body):
+        return Response(body, status=status,
+                        headers=[(k, v) for k, v in headers if k.lower() not in HOP_BY_HOP])
+
+    def _relay_outbound(self, headers):
+        # a worker queued replies for the bridge; it can't push them itself
+        if self.on_outbound is not None and any(k.lower() == OUTBOUND_HEADER.lower() for k, _ in headers):
+            self.on_outbound()
+
+    def forward(self, index, target, req):
+        try:
+            status, headers, body = self.clients[index].request(
+                req.method, target, req.get_data(), self._headers(req))
+        except ShardUnavailable as e:
+            print(f"[ERROR] {e}")
+            return Response(f"Shard {index} unavailable.", status=503)
+        self._relay_outbound(headers)
+        return self._response(status, headers, body)
+
+    def fan_out(self, target, req, method=None):
+        """Send the request to every shard; [(status, headers, body) or None] in shard order."""
+        method, body, headers = method or req.method, req.get_data(), self._headers(req)
+
+        def one(client):
+            try:
+                return client.request(method, target, body, headers)
+            except ShardUnavailable as e:
+                print(f"[ERROR] {e}")
+                return None
+        return list(self._pool.map(one, self.clients))
+
+    def fan_out_json(self, target, req):
+        out = []
+        for res in self.fan_out(target, req, method="GET"):
+            if res is None or res[0] != 200:
+                out.append(None)
+                continue
+            try:
+                out.append(json.loads(res[2]))
+            except ValueError:
+                out.append(None)
+        return out
+
+    def broadcast(self, target, req):
+        """Every shard applies the action; the primary's response goes back."""
+        results = [res for res in self.fan_out(target, req) if res is not None]
+        for res in results:
+            self._relay_outbound(res[1])
+        if results:
+            return self._response(*results[0])
+        return Response("No shard available.", status=503)
+
+    # ─── Merged views ───────────────────────────────────────────────
+    def merge_approved(self, target, req):
+        items = []
+        for page in self.fan_out_json(target, req):
+            items.extend((page or {}).get("items", []))
+        return jsonify(items=items)
+
+    def merge_reply_cache(self, target, req):
+        total = {"lookups": 0, "hits": 0, "saved_calls": 0, "entries": 0}
+        contacts = []
+        for report in self.fan_out_json(target, req):
+            report = report or {}
+            for k in total:
+                total[k] += report.get("global", {}).get(k, 0)
+            contacts.extend(report.get("contacts", []))
+        total["hit_rate"] = round(total["hits"] / total["lookups"], 3) if total["lookups"] else 0.0
+        contacts.sort(key=lambda c: -c.get("saved_calls", 0))
+        return jsonify({"global": total, "contacts": contacts})
+
+    def merge_cursors(self, target, req):
+        cursors = {}
+        for page in self.fan_out_json(target, req):
+            cursors.update(page or {})
+        return jsonify(cursors)
+
+    def merge_pending(self, target, req):
+        pages = [p or {} for p in self.fan_out_json(target, req)]
+        items = sorted((it for p in pages for it in p.get("pending_for_approval", [])),
+                       key=lambda it: it.get("seq", 0))
+        scheduled = {}
+        for p in pages:
+            for k, v in (p.get("scheduled_sends") or {}).items():
+                scheduled[k] = scheduled.get(k, 0) + v
+        return jsonify({
+            "pending_for_approval": items,
+            "approval_enabled": pages[0].get("approval_enabled", False),
+            "scheduled_sends": scheduled,
+        })
+
+    def merge_keyset(self, sort_key):
+        """Merge keyset pages: every shard pages from the same cursor key."""
+        def merge(target, req):
+            pages = [p or {} for p in self.fan_out_json(target, req)]
+            limit = clamp_limit(req.args.get("limit"))
+            rows = sorted((r for p in pages for r in p.get("items", [])), key=sort_key)
+            items = rows[:limit]
+            more = len(rows) > limit or any(p.get("next_cursor") for p in pages)
+            page = {"items": items, "next_cursor": encode_cursor(sort_key(items[-1])) if more and items else None}
+            if any("total" in p for p in pages):
+                page["total"] = sum(p.get("total", 0) for p in pages)
+            return jsonify(page)
+        return merge
+
+    def merge_notifications(self, target, req):
+        # rings are small (50 per shard): take them whole, then page here
+        path = target.split("?", 1)[0] + f"?limit={MAX_LIMIT}"
+        items = []
+        for page in self.fan_out_json(path, req):
+            items.extend((page or {}).get("items", []))
+        items.sort(key=lambda n: n.get("ts") or "", reverse=True)
+        return jsonify(paginate_offset(items, req.args.get("cursor"), clamp_limit(req.args.get("limit"))))
+
+    def merge_knowledge_gaps(self, target, req):
+        # each shard collects the gaps its own contacts hit; show every gap once
+        items, seen = [], set()
+        for page in self.fan_out_json(target, req):
+            for gap in (page or {}).get("items", []):
+                if normalize_gap(gap) not in seen:
+                    seen.add(normalize_gap(gap))
+                    items.append(gap)
+        return jsonify(items=items)
+
+    def merge_metrics(self, target, req):
+        """One exposition: every sample gets a shard label, HELP/TYPE appear once."""
+        families = {}           # name -> [header lines, sample lines]
+        for index, res in enumerate(self.fan_out(target, req, method="GET")):
+            if res is None or res[0] != 200:
+                continue
+            current = None
+            for line in res[2].decode("utf-8").splitlines():
+                if not line:
+                    continue
+                if line.startswith("#"):
+                    parts = line.split(" ", 3)
+                    if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                        current = families.setdefault(parts[2], [[], []])
+                        if line not in current[0]:
+                            current[0].append(line)
+                    continue
+                name, _, rest = line.partition(" ")
+                if "{" in name:
+                    name = name.replace("{", f'{{shard="{index}",', 1)
+                else:
+                    name = f'{name}{{shard="{index}"}}'
+                if current is None:
+                    current = families.setdefault(name.split("{", 1)[0], [[], []])
+                current[1].append(f"{name} {rest}")
+        lines = []
+        for headers, samples in families.values():
+            lines.extend(headers)
+            lines.extend(samples)
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    def _pump_events(self, client):
+        """Follow one shard's /events for good, handing every event to the open dashboards."""
+        while True:
+            conn = None
+            try:
+                conn, resp = client.open_stream("/events")
+                block = []
+                while True:
+                    line = resp.readline()
+                    if not line:
+                        break
+                    line = line.decode("utf-8").rstrip("\r\n")
+                    if line:
+                        block.append(line)
+                        continue
+                    if any(l.startswith(("event:", "data:")) for l in block):
+                        self._publish_event("\n".join(block) + "\n\n")
+                    block = []
+            except (http.client.HTTPException, OSError):
+                pass
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(3)
+
+    def _publish_event(self, text):
+        with self._events_lock:
+            subscribers = list(self._event_subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(text)
+            except queue.Full:
+                pass    # slow client; it will resync on its next reload
+
+    def merge_events(self, target, req):
+        """
+        Fan in every shard's SSE stream into one. The router holds a single
+        stream per shard, shared by every dashboard, so open dashboards don't
+        tie up the workers' threads.
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._events_lock:
+            self._event_subscribers.add(q)
+            if not self._event_pumps:
+                self._event_pumps = True
+                for client in self.clients:
+                    threading.Thread(target=self._pump_events, args=(client,), daemon=True,
+                                     name=f"sse-{client.index}").start()
+
+        def stream():
+            try:
+                yield "retry: 3000\n\n"
+                while True:
+                    try:
+                        yield q.get(timeout=HEARTBEAT_SECONDS)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+            finally:
+                with self._events_lock:
+                    self._event_subscribers.discard(q)
+        return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # ─── Dispatch ───────────────────────────────────────────────────
+    def dispatch(self, req):
+        req.get_data()          # buffer the body before form/JSON parsing reads it
+        path = req.path
+        qs = req.query_string.decode("latin-1")
+        target = quote(path, safe="/@:+,;=!$&'()*~") + (f"?{qs}" if qs else "")
+
+        m = re.match(r"^/shards/(\d+)(/.*)?$", path)
+        if m:
+            index = int(m.group(1))
+            if index >= self.config.count:
+                return Response("No such shard.", status=404)
+            return self.forward(index, target[len(f"/shards/{index}"):] or "/", req)
+
+        jid = self.jid_of(path, req)
+        if jid:
+            return self.forward(self.owner(jid), target, req)
+
+        m = ITEM_ROUTE_RE.match(path)
+        if m:
+            owner = ITEM_ID_RE.match(m.group(2))
+            if owner and int(owner.group(1)) < self.config.count:
+                return self.forward(int(owner.group(1)), target, req)
+            # an id from before sharding: whichever shard holds it acts on it
+            return self.broadcast(target, req)
+
+        merge = self.merged.get(path)
+        if merge and req.method == "GET":
+            return merge(target, req)
+        if path in BROADCAST_ROUTES and req.method == "POST":
+            return self.broadcast(target, req)
+        return self.forward(0, target, req)
+
+
+def create_app(router):
+    app = Flask(__name__)
+
+    @app.route("/", defaults={"path": ""}, methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+    @app.route("/<path:path>", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+    def proxy(path):
+        return router.dispatch(request)
+
+    return app
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# WORKERS
+# ─────────────────────────────────────────────────────────────────────────────
+class WorkerPool:
+    """Runs one bot.py per shard and restarts any that exit."""
+
+    def __init__(self, config, command=None):
+        self.config = config
+        self.command = command or [sys.executable, BOT_PATH]
+        self.procs = [None] * config.count
+        self._stopping = False
+
+    def _spawn(self, index):
+        env = dict(os.environ,
+                   SHARD_COUNT=str(self.config.count),
+                   SHARD_INDEX=str(index),
+                   SHARD_BASE_PORT=str(self.config.base_port))
+        self.procs[index] = subprocess.Popen(self.command, env=env)
+        print(f"[INFO] Shard {index} started (pid {self.procs[index].pid}, port {self.config.port(index)})")
+
+    def start(self):
+        for i in range(self.config.count):
+            self._spawn(i)
+        threading.Thread(target=self._watch, daemon=True, name="shard-watch").start()
+
+    def _watch(self):
+        while not self._stopping:
+            time.sleep(2)
+            for i, proc in enumerate(self.procs):
+                if not self._stopping and proc.poll() is not None:
+                    print(f"[ERROR] Shard {i} exited with {proc.returncode}; restarting")
+                    self._spawn(i)
+
+    def stop(self, timeout=20):
+        self._stopping = True
+        for proc in self.procs:
+            if proc and proc.poll() is None:
+                proc.terminate()
+        for proc in self.procs:
+            if proc:
+                try:
+                    proc.wait(timeout)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Run the brain as N shards behind one router.")
+    ap.add_argument("--shards", type=int, default=int(os.getenv("SHARD_COUNT", str(os.cpu_count() or 2))))
+    ap.add_argument("--port", type=int, default=5001, help="port index.js talks to")
+    ap.add_argument("--base-port", type=int, default=int(os.getenv("SHARD_BASE_PORT", "5101")),
+                    help="shard i listens on base-port + i")
+    ap.add_argument("--no-spawn", action="store_true", help="route to shards started elsewhere")
+    args = ap.parse_args()
+
+    router = ShardRouter(args.shards, base_port=args.base_port)
+    if not args.no_spawn:
+        workers = WorkerPool(router.config)
+        workers.start()
+        atexit.register(workers.stop)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"🚦 Router on :{args.port} → {args.shards} shards (ports {args.base_port}–{args.base_port + args.shards - 1})")
+    app = create_app(router)
+    ipc_server = ipc.start_server(app)  # the bridge's persistent channel
+    if ipc_server is not None:
+        router.on_outbound = lambda: ipc_server.notify("outbound")
+    app.run(host="0.0.0.0", port=args.port, threaded=True)
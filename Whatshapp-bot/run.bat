@@ -3,7 +3,7 @@ REM ── make sure we’re sitting in the script’s own folder
 cd /d "%~dp0"
 
 echo 🚀 Starting Python backend…
-start "Python Backend" cmd /k "python bot.py"
+start "Python Backend" cmd /k "python serve.py"
 
 echo 🚀 Starting WhatsApp client…
 start "WhatsApp Client" cmd /k "node index.js"
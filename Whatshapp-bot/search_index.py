@@ -0,0 +1,276 @@
+# search_index.py
+"""
+Full-text search over every contact's history (SQLite FTS5).
+
+Each message is stored once in `messages`, keyed by contact and its
+position in that contact's history (archived + hot, see storage.py), with
+an external-content FTS5 table over the text. Indexing is incremental: the
+index remembers how many of a contact's messages it holds and reads only
+the messages past that position. A history that got shorter (contact
+removed and re-added) is dropped and re-indexed.
+
+All writes happen on one background indexer thread: schedule(jid) and
+drop(jid) only queue work, so request threads never wait on indexing (or
+see its errors). The thread takes the database lock per BATCH, so searches
+interleave with a long backfill.
+
+search() ranks with bm25, filters by contact, role and date, and pages
+with a keyset cursor on (score, jid, pos), the same way on every shard,
+so router.py can merge shard pages like the other keyset views.
+"""
+import html
+import queue
+import re
+import sqlite3
+import threading
+import time
+from itertools import islice
+
+from metrics import metrics
+from storage import ts_epoch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id      INTEGER PRIMARY KEY,
+    jid     TEXT NOT NULL,
+    pos     INTEGER NOT NULL,
+    role    TEXT,
+    ts      REAL,
+    content TEXT NOT NULL,
+    UNIQUE (jid, pos)
+);
+CREATE INDEX IF NOT EXISTS messages_jid_ts ON messages (jid, ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS progress (
+    jid TEXT PRIMARY KEY,
+    indexed INTEGER NOT NULL
+);
+"""
+
+# snippet() markers, swapped for <mark> after the text is HTML-escaped
+_HL_OPEN, _HL_CLOSE = "\x02", "\x03"
+SNIPPET_TOKENS = 16
+BATCH = 2000            # messages per transaction while catching up
+
+_TERM_RE = re.compile(r'"([^"]+)"|(\S+)')
+
+
+def fts_query(text):
+    """
+    Operator input -> an FTS5 query: every word must match, "quoted phrases"
+    match as phrases, a trailing * matches a prefix. Everything else is
+    quoted, so user input can't produce FTS5 syntax errors.
+    """
+    terms = []
+    for phrase, word in _TERM_RE.findall(text or ""):
+        if phrase:
+            terms.append('"' + phrase.replace('"', '""') + '"')
+            continue
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def render_snippet(raw):
+    return html.escape(raw).replace(_HL_OPEN, "<mark>").replace(_HL_CLOSE, "</mark>")
+
+
+class SearchIndex:
+    def __init__(self, path, history_len, iter_positions):
+        """
+        history_len(jid) -> messages in jid's history;
+        iter_positions(jid, start) -> (position, message) from start on.
+        """
+        self.path = path
+        self.history_len = history_len
+        self.iter_positions = iter_positions
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()       # the connection: indexer thread vs. searches
+        self._jobs = queue.Queue()
+        self._queued = set()                # jids with a catch-up waiting in _jobs
+        self._queued_lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ─── Indexer thread ─────────────────────────────────────────────
+    def start(self, counts=None):
+        """Start the indexer; counts ({jid: messages}) queues a backfill of whatever is behind."""
+        if counts is not None:
+            self._jobs.put(("backfill", counts))
+        threading.Thread(target=self._run, name="search-indexer", daemon=True).start()
+        return self
+
+    def schedule(self, jid):
+        """Queue jid's new messages for indexing (returns at once)."""
+        with self._queued_lock:
+            if jid in self._queued:
+                return
+            self._queued.add(jid)
+        self._jobs.put(("catch_up", jid))
+
+    def drop(self, jid):
+        """Queue removing jid from the index (returns at once)."""
+        self._jobs.put(("drop", jid))
+
+    def reindex(self, jid):
+        """Queue indexing jid from scratch, e.g. after messages were inserted mid-history."""
+        self._jobs.put(("drop", jid))
+        with self._queued_lock:
+            self._queued.add(jid)
+        self._jobs.put(("catch_up", jid))
+
+    def _run(self):
+        while True:
+            kind, arg = self._jobs.get()
+            try:
+                if kind == "catch_up":
+                    with self._queued_lock:
+                        self._queued.discard(arg)   # appends from now on queue it again
+                    self.catch_up(arg)
+                elif kind == "drop":
+                    with self._lock:
+                        self._drop(arg)
+                elif kind == "backfill":
+                    self.catch_up_all(arg)
+            except Exception as e:
+                print(f"[ERROR] Search index: {kind} failed: {e}")
+            finally:
+                self._jobs.task_done()
+
+    # ─── Indexing (indexer thread) ──────────────────────────────────
+    def indexed(self, jid):
+        row = self._db.execute("SELECT indexed FROM progress WHERE jid = ?", (jid,)).fetchone()
+        return row[0] if row else 0
+
+    def catch_up(self, jid):
+        """Index jid's messages past what the index holds, BATCH at a time; returns how many were added."""
+        added = 0
+        while True:
+            total = self.history_len(jid)
+            with self._lock:
+                done = self.indexed(jid)
+                if done > total:
+                    self._drop(jid)
+                    done = 0
+            if done >= total:
+                break
+            # read the batch (maybe from the cold archive) without holding the lock
+            rows, end = [], done
+            for pos, m in islice(self.iter_positions(jid, done), BATCH):
+                content = m.get("content")
+                if isinstance(content, str) and content.strip():
+                    rows.append((jid, pos, m.get("role"), ts_epoch(m.get("ts")), content))
+                end = pos + 1
+            if end == done:
+                break
+            with self._lock:
+                added += self._insert(jid, rows, end)
+        if added:
+            metrics.inc("search_indexed_total", added)
+        return added
+
+    def _insert(self, jid, rows, indexed):
+        with self._db:
+            cur = self._db.cursor()
+            for row in rows:
+                cur.execute("INSERT OR IGNORE INTO messages (jid, pos, role, ts, content) VALUES (?, ?, ?, ?, ?)", row)
+                if cur.rowcount:
+                    cur.execute("INSERT INTO messages_fts (rowid, content) VALUES (?, ?)", (cur.lastrowid, row[4]))
+            cur.execute("INSERT INTO progress (jid, indexed) VALUES (?, ?) "
+                        "ON CONFLICT (jid) DO UPDATE SET indexed = excluded.indexed", (jid, indexed))
+        return len(rows)
+
+    def catch_up_all(self, counts):
+        """Bring every contact up to date; counts: {jid: messages} (from the contact index)."""
+        t = time.perf_counter()
+        added = 0
+        for jid, total in counts.items():
+            with self._lock:
+                behind = self.indexed(jid) != total
+            if behind:
+                added += self.catch_up(jid)
+        with self._lock:
+            known = [row[0] for row in self._db.execute("SELECT jid FROM progress")]
+            for jid in known:
+                if jid not in counts:
+                    self._drop(jid)
+        if added:
+            print(f"[INFO] Search index: {added} message(s) indexed in {time.perf_counter() - t:.1f}s")
+        return added
+
+    def _drop(self, jid):
+        with self._db:
+            self._db.execute(
+                "INSERT INTO messages_fts (messages_fts, rowid, content) "
+                "SELECT 'delete', id, content FROM messages WHERE jid = ?", (jid,))
+            self._db.execute("DELETE FROM messages WHERE jid = ?", (jid,))
+            self._db.execute("DELETE FROM progress WHERE jid = ?", (jid,))
+
+    # ─── Queries ────────────────────────────────────────────────────
+    def search(self, text, jid=None, role=None, since=None, until=None, after=None, limit=50):
+        """
+        Ranked matches for text, best first: {"items": [...], "more": bool}.
+        since/until are epoch seconds; after is the (score, jid, pos) of the
+        last item of the previous page.
+        """
+        query = fts_query(text)
+        if not query:
+            return {"items": [], "more": False}
+        where, args = ["messages_fts MATCH ?"], [query]
+        if jid:
+            where.append("m.jid = ?")
+            args.append(jid)
+        if role:
+            where.append("m.role = ?")
+            args.append(role)
+        if since is not None:
+            where.append("m.ts >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("m.ts < ?")
+            args.append(until)
+        sql = f"""
+            SELECT * FROM (
+                SELECT bm25(messages_fts) AS score, m.jid, m.pos, m.role, m.ts, m.id
+                FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                WHERE {" AND ".join(where)}
+            )
+        """
+        if after is not None:
+            sql += " WHERE (score, jid, pos) > (?, ?, ?)"
+            args.extend(after)
+        sql += " ORDER BY score, jid, pos LIMIT ?"
+        args.append(limit + 1)
+        with metrics.span("search"):
+            try:
+                with self._lock:
+                    rows = self._db.execute(sql, args).fetchall()
+                    # snippets only for the page, not for every match
+                    ids = [row[5] for row in rows[:limit]]
+                    snippets = dict(self._db.execute(
+                        f"SELECT rowid, snippet(messages_fts, 0, ?, ?, '…', {SNIPPET_TOKENS}) FROM messages_fts "
+                        f"WHERE messages_fts MATCH ? AND rowid IN ({','.join('?' * len(ids))})",
+                        [_HL_OPEN, _HL_CLOSE, query] + ids,
+                    )) if ids else {}
+            except sqlite3.OperationalError as e:
+                print(f"[ERROR] Search for {text!r} failed: {e}")
+                return {"items": [], "more": False}
+        items = [{"score": score, "jid": j, "pos": pos, "role": r, "ts": ts, "snippet": render_snippet(snippets.get(rowid, ""))}
+                 for score, j, pos, r, ts, rowid in rows[:limit]]
+        return {"items": items, "more": len(rows) > limit}
+
+    def stats(self):
+        with self._lock:
+            (messages,) = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()
+            (contacts,) = self._db.execute("SELECT COUNT(*) FROM progress").fetchone()
+        return {"messages": messages, "contacts": contacts}
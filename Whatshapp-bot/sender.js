@@ -0,0 +1,225 @@
+// sender.js
+// Outbound sends to WhatsApp.
+//
+// Every reply (images first, then the text) goes into its contact's lane.
+// A lane sends its items strictly in order, while up to `concurrency` lanes
+// send at the same time, so one slow media upload only holds up its own
+// contact. A lane gives its slot back after each item, so busy contacts take
+// turns with quiet ones.
+//
+// All lanes share one token bucket (`ratePerSec`, bursts of `burst`) to stay
+// under WhatsApp's throttling. A failed send is retried with exponential
+// backoff. Each item's outcome is posted to the brain's /send_result.
+//
+// With `outboxPath`, every item is written there when it is enqueued and
+// removed only once sendItem is done with it (sent, or given up on and
+// reported), so replies in the lanes survive a crash: restore() queues them
+// again once the client is ready.
+const fs = require('fs');
+const path = require('path');
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+class TokenBucket {
+    constructor(ratePerSec, burst) {
+        this.rate = ratePerSec;
+        this.burst = burst;
+        this.tokens = burst;
+        this.last = Date.now();
+    }
+
+    refill() {
+        const now = Date.now();
+        this.tokens = Math.min(this.burst, this.tokens + ((now - this.last) / 1000) * this.rate);
+        this.last = now;
+    }
+
+    async take() {
+        for (;;) {
+            this.refill();
+            if (this.tokens >= 1) {
+                this.tokens -= 1;
+                return;
+            }
+            await sleep(Math.ceil(((1 - this.tokens) / this.rate) * 1000));
+        }
+    }
+}
+
+class OutboundSender {
+    constructor(client, {
+        imagesDir,
+        concurrency = 4,
+        ratePerSec = 2,
+        burst = 5,
+        retries = 3,
+        backoffMs = 1000,
+        report = null,
+        MessageMedia = null,
+        outboxPath = null,
+    } = {}) {
+        this.client = client;
+        this.imagesDir = imagesDir;
+        this.concurrency = concurrency;
+        this.retries = retries;
+        this.backoffMs = backoffMs;
+        this.report = report;
+        this.MessageMedia = MessageMedia;
+        this.bucket = new TokenBucket(ratePerSec, burst);
+        this.lanes = new Map();   // jid -> items waiting, oldest first
+        this.ready = [];          // jids with items and no send in progress
+        this.active = 0;          // lanes sending right now
+        this.outboxPath = outboxPath;
+        this.outbox = new Map();  // key -> item, for every item not done yet
+    }
+
+    // Items left in the outbox by a previous run, queued again
+    restore() {
+        if (!this.outboxPath) return 0;
+        let items = [];
+        try {
+            const parsed = JSON.parse(fs.readFileSync(this.outboxPath, 'utf-8'));
+            items = Array.isArray(parsed) ? parsed : [];
+        } catch {
+            items = [];
+        }
+        for (const item of items) {
+            if (!this.outbox.has(item.key)) this.enqueue(item);
+        }
+        return items.length;
+    }
+
+    saveOutbox() {
+        if (!this.outboxPath) return;
+        const tmp = `${this.outboxPath}.tmp`;
+        try {
+            fs.writeFileSync(tmp, JSON.stringify([...this.outbox.values()]));
+            fs.renameSync(tmp, this.outboxPath);
+        } catch (e) {
+            console.warn('[sender] could not save the outbox:', e.message);
+        }
+    }
+
+    // item: { jid, reply, images, id? }
+    enqueue(item) {
+        if (!item || !item.jid) return;
+        item.key = item.key || item.id || `local-${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        this.outbox.set(item.key, item);
+        this.saveOutbox();
+        const lane = this.lanes.get(item.jid);
+        if (lane) {
+            lane.push(item);      // already waiting or sending: keeps its order
+            return;
+        }
+        this.lanes.set(item.jid, [item]);
+        this.ready.push(item.jid);
+        this.pump();
+    }
+
+    pending() {
+        let n = 0;
+        for (const lane of this.lanes.values()) n += lane.length;
+        return n;
+    }
+
+    pump() {
+        while (this.active < this.concurrency && this.ready.length) {
+            const jid = this.ready.shift();
+            this.active += 1;
+            this.runNext(jid).finally(() => {
+                this.active -= 1;
+                this.pump();
+            });
+        }
+    }
+
+    async runNext(jid) {
+        const lane = this.lanes.get(jid);
+        const item = lane[0];
+        try {
+            await this.sendItem(item);
+        } finally {
+            this.outbox.delete(item.key);
+            this.saveOutbox();
+            lane.shift();
+            if (lane.length) {
+                this.ready.push(jid);     // back of the line, after the other contacts
+            } else {
+                this.lanes.delete(jid);
+            }
+        }
+    }
+
+    parts(item) {
+        const parts = [];
+        for (const img of Array.isArray(item.images) ? item.images : []) {
+            const p = path.join(this.imagesDir, img);
+            if (fs.existsSync(p)) {
+                parts.push({ kind: 'image', path: p });
+            } else {
+                console.warn('[sender] image not found:', p);
+            }
+        }
+        if (item.reply) parts.push({ kind: 'text', text: item.reply });
+        return parts;
+    }
+
+    sendPart(jid, part) {
+        if (part.kind === 'image') {
+            return this.client.sendMessage(jid, this.MessageMedia.fromFilePath(part.path));
+        }
+        return this.client.sendMessage(jid, part.text);
+    }
+
+    async sendItem(item) {
+        const started = Date.now();
+        const parts = this.parts(item);
+        let sent = 0;
+        let attempts = 0;
+        let error = null;
+        const waIds = [];     // WhatsApp's ids for what was sent, so history sync skips them
+        for (const part of parts) {
+            for (let attempt = 0; ; attempt++) {
+                await this.bucket.take();
+                attempts += 1;
+                try {
+                    const msg = await this.sendPart(item.jid, part);
+                    if (msg?.id?._serialized) waIds.push(msg.id._serialized);
+                    sent += 1;
+                    break;
+                } catch (e) {
+                    if (attempt >= this.retries) {
+                        error = e;
+                        break;
+                    }
+                    const delay = this.backoffMs * 2 ** attempt;
+                    console.warn(`[sender] ${part.kind} to ${item.jid} failed (${e.message}), retrying in ${delay} ms`);
+                    await sleep(delay + Math.random() * delay * 0.2);
+                }
+            }
+            if (error) break;     // don't send the text without the images before it
+        }
+        const result = {
+            id: item.id || null,
+            jid: item.jid,
+            ok: !error,
+            parts: parts.length,
+            sent,
+            attempts,
+            ms: Date.now() - started,
+            error: error ? String(error.message || error) : null,
+            wa_ids: waIds,
+        };
+        if (error) console.error(`[sender] gave up on ${item.jid}: ${result.error}`);
+        if (this.report) {
+            try {
+                await this.report(result);
+            } catch {
+                // the brain is down; the send itself already happened (or not)
+            }
+        }
+        return result;
+    }
+}
+
+module.exports = { OutboundSender, TokenBucket };
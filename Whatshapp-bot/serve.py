@@ -0,0 +1,280 @@
+# serve.py
+"""
+Production entry point for the brain (python bot.py is the dev server).
+
+    python serve.py                              # one process, 8 threads, :5001
+    python serve.py --threads 16 --workers 4     # 4 shard workers behind router.py
+
+  • waitress serves the app: keep-alive HTTP/1.1, a thread pool, a
+    connection limit and an idle-connection timeout, debugger and reloader
+    off. It is pure Python, so it runs the same on Windows (run.bat).
+  • bot.py builds its state once, when this process imports it; there is
+    one copy of memory per process. --workers N > 1 therefore doesn't fork
+    copies of the same state: it starts N shard workers (each a
+    `serve.py --worker`) behind the JID router, see shards.py.
+  • every open dashboard holds one thread for its live updates (/events,
+    SSE); at most --max-streams do, so the bridge always has the rest of
+    the pool. Raise --threads along with it for more dashboards. With
+    --workers, the router reads one stream per worker, shared by every
+    dashboard.
+  • --model-timeout bounds every OpenAI call, the long part of /reply:
+    it caps the per-route timeouts in model_router.py.
+  • SIGTERM / Ctrl+C drains: the listening socket closes, requests that
+    arrive on already-open connections get a 503 with Retry-After (index.js
+    queues those messages and retries), in-flight requests such as a /reply
+    waiting on the model are allowed to finish for up to --drain-timeout
+    seconds, then memory, notifications and summaries are flushed. A second
+    signal exits right away.
+  • the bridge channel (ipc.py) is opened in the process index.js talks to:
+    this one, or the router with --workers.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+import _thread
+
+try:
+    from waitress import create_server
+    from waitress.server import BaseWSGIServer
+except ImportError:     # pragma: no cover
+    sys.exit("serve.py needs waitress: pip install waitress")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# long-lived responses that shouldn't hold up a drain
+STREAMING_PATHS = ("/events",)
+
+
+class InFlight:
+    """
+    WSGI middleware that counts requests still being handled and, once
+    draining, turns away new ones. Streams (/events) hold a pool thread for
+    as long as the dashboard stays open, so at most `max_streams` run at
+    once; the rest of the pool stays free for the bridge.
+    """
+
+    def __init__(self, app, max_streams=None):
+        self.app = app
+        self.active = 0
+        self.streams = 0
+        self.max_streams = max_streams
+        self.draining = False
+        self._cond = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        if self.draining:
+            start_response("503 Service Unavailable", [
+                ("Content-Type", "text/plain"), ("Retry-After", "5"), ("Connection", "close"),
+            ])
+            return [b"Shutting down, retry shortly.\n"]
+        if environ.get("PATH_INFO", "").startswith(STREAMING_PATHS):
+            return self._stream(environ, start_response)
+        with self._cond:
+            self.active += 1
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return _ClosingIterator(result, self._done)
+
+    def _stream(self, environ, start_response):
+        with self._cond:
+            full = self.max_streams is not None and self.streams >= self.max_streams
+            if not full:
+                self.streams += 1
+        if full:
+            start_response("503 Service Unavailable", [("Content-Type", "text/plain"), ("Retry-After", "30")])
+            return [b"Too many live dashboards open (raise --threads / --max-streams).\n"]
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._stream_done()
+            raise
+        return _ClosingIterator(result, self._stream_done)
+
+    def _stream_done(self):
+        with self._cond:
+            self.streams -= 1
+
+    def _done(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout):
+        """True once nothing is in flight, False if `timeout` ran out first."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.active > 0:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+
+class _ClosingIterator:
+    """Response body wrapper that reports when the server is done with it."""
+
+    def __init__(self, result, on_close):
+        self._result = result
+        self._it = iter(result)
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._it)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._result, "close"):
+                self._result.close()
+        finally:
+            self._on_close()
+
+
+def serve(app, host, port, args, on_drained=None, ipc_server=None):
+    """
+    Run app under waitress until SIGTERM/SIGINT, then drain gracefully
+    (ipc_server, the bridge channel, drains alongside).
+    """
+    guarded = InFlight(app, max_streams=args.max_streams)
+    server = create_server(
+        guarded,
+        host=host,
+        port=port,
+        threads=args.threads,
+        connection_limit=args.connection_limit,
+        channel_timeout=args.idle_timeout,
+        ident="whatshapp-bot",
+    )
+    listeners = [s for s in ([server] if isinstance(server, BaseWSGIServer) else server.map.values())
+                 if isinstance(s, BaseWSGIServer)]
+    drained = threading.Event()
+
+    def finish():
+        if ipc_server is not None:
+            ipc_server.stop()
+        if not guarded.wait_idle(args.drain_timeout):
+            print(f"[ERROR] {guarded.active} request(s) still running after {args.drain_timeout:.0f}s; stopping anyway")
+        try:
+            if on_drained:
+                on_drained()
+        finally:
+            drained.set()
+            _thread.interrupt_main()    # lands in on_signal below, which ends server.run()
+
+    def stop_listening():
+        for listener in listeners:
+            listener.del_channel()
+            listener.socket.close()
+
+    def on_signal(signum, _frame):
+        if drained.is_set():
+            raise KeyboardInterrupt
+        if guarded.draining:
+            print("[INFO] Second signal, exiting now")
+            os._exit(1)
+        print(f"[INFO] {signal.Signals(signum).name}: draining {guarded.active} in-flight request(s)…")
+        guarded.draining = True
+        for listener in listeners:
+            listener.accepting = False
+        # close the sockets from inside the server loop, between select() calls
+        listeners[0].trigger.pull_trigger(stop_listening)
+        threading.Thread(target=finish, name="drain", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    print(f"[INFO] Serving on http://{host}:{port} ({args.threads} threads)")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_single(args, host, port):
+    os.environ["OPENAI_TIMEOUT"] = str(args.model_timeout)
+    import bot
+    bot.app.config["DEBUG"] = False
+    bot.start_background()
+
+    def flush():
+        bot.flush_state()
+        print("[INFO] State flushed")
+    # shard workers sit behind the router, which holds the bridge channel
+    ipc_server = None if args.worker else bot.start_ipc(workers=args.threads)
+    serve(bot.app, host, port, args, on_drained=flush, ipc_server=ipc_server)
+
+
+def run_sharded(args):
+    from router import ShardRouter, WorkerPool, create_app
+    import ipc
+
+    router = ShardRouter(args.workers, base_port=args.base_port, timeout=args.model_timeout * 2)
+    worker_cmd = [sys.executable, os.path.join(HERE, "serve.py"), "--worker",
+                  "--threads", str(args.threads),
+                  "--connection-limit", str(args.connection_limit),
+                  "--idle-timeout", str(args.idle_timeout),
+                  "--drain-timeout", str(args.drain_timeout),
+                  "--model-timeout", str(args.model_timeout)]
+    workers = WorkerPool(router.config, command=worker_cmd)
+    workers.start()
+    # the router drains first (its in-flight requests are waiting on workers),
+    # then each worker gets SIGTERM and drains/flushes on its own
+    app = create_app(router)
+    ipc_server = ipc.start_server(app, workers=args.threads)
+    if ipc_server is not None:
+        router.on_outbound = lambda: ipc_server.notify("outbound")
+    serve(app, args.host, args.port, args,
+          on_drained=lambda: workers.stop(timeout=args.drain_timeout + 10),
+          ipc_server=ipc_server)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve the brain with waitress.")
+    ap.add_argument("--host", default=os.getenv("BOT_HOST", "0.0.0.0"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("BOT_PORT", "5001")))
+    ap.add_argument("--threads", type=int, default=int(os.getenv("BOT_THREADS", "8")),
+                    help="request threads per process")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("BOT_WORKERS", "1")),
+                    help="processes; more than 1 runs shard workers behind the router")
+    ap.add_argument("--base-port", type=int, default=int(os.getenv("SHARD_BASE_PORT", "5101")),
+                    help="shard i listens on base-port + i")
+    ap.add_argument("--connection-limit", type=int, default=100)
+    ap.add_argument("--idle-timeout", type=float, default=120,
+                    help="close keep-alive connections idle this long (seconds)")
+    ap.add_argument("--model-timeout", type=float, default=float(os.getenv("OPENAI_TIMEOUT", "60")),
+                    help="cap on every OpenAI call's timeout, see model_router.py (seconds)")
+    ap.add_argument("--max-streams", type=int, default=None,
+                    help="live dashboards (/events) served at once, each holding a thread "
+                         "(default: a quarter of --threads, at least 1)")
+    ap.add_argument("--drain-timeout", type=float, default=30,
+                    help="on shutdown, wait this long for in-flight requests (seconds)")
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.max_streams is None:
+        args.max_streams = max(1, args.threads // 4)
+
+    if args.worker:
+        # started by run_sharded with SHARD_* in the environment
+        from shards import ShardConfig
+        shard = ShardConfig.from_env()
+        run_single(args, shard.host, shard.port(shard.index))
+    elif args.workers > 1:
+        run_sharded(args)
+    else:
+        run_single(args, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# shards.py
+"""
+Sharded deployment: contacts are partitioned by JID across worker processes.
+
+  • shard_of(jid, n) is a stable hash partition (crc32), so a contact always
+    lands on the same worker across restarts.
+  • Each worker keeps its own memory.json (contact registry, queues,
+    settings copy) under shards/<i>/. Per-contact files in memory_contacts/
+    and memory_archive/ are already one file/folder per contact, so all
+    workers share those directories without ever touching the same file.
+  • The global sections (my_profile, personality_profile, settings) are
+    owned by shard 0, the primary. It publishes them to shared_globals.json
+    whenever they change, and the other shards reload that file when its
+    mtime moves (read-mostly replication).
+  • router.py is the front process index.js keeps talking to; it forwards
+    each request to the shard that owns the contact.
+
+With SHARD_COUNT unset (or 1) bot.py runs exactly as a single process.
+"""
+import json
+import os
+import threading
+import time
+import zlib
+
+from storage import write_json_atomic
+
+GLOBAL_SECTIONS = ("my_profile", "personality_profile", "settings")
+
+# set by a worker on a response after which the bridge has replies to fetch;
+# the router, which holds the bridge channel, pushes "outbound" on seeing it
+OUTBOUND_HEADER = "X-Outbound-Ready"
+
+# memory sections keyed by jid, and lists of {"jid": ...} items, that are
+# split between shards when a shard is seeded from a single-process memory.json
+PER_CONTACT_MAPS = (
+    "contacts_index", "contacts_info", "images_sent", "missed_messages",
+    "synced_wa_ids", "chat_history", "person_profiles",
+)
+PER_CONTACT_LISTS = ("allowed_contacts", "pending_for_approval", "pending_approved")
+
+
+def shard_of(jid, count):
+    """Index of the shard that owns jid."""
+    if count <= 1 or not jid:
+        return 0
+    return zlib.crc32(jid.encode("utf-8")) % count
+
+
+class ShardConfig:
+    def __init__(self, count=1, index=0, base_port=5101, host="127.0.0.1"):
+        if not 0 <= index < max(count, 1):
+            raise ValueError(f"shard index {index} out of range for {count} shards")
+        self.count = max(count, 1)
+        self.index = index
+        self.base_port = base_port
+        self.host = host
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            count=int(os.getenv("SHARD_COUNT", "1")),
+            index=int(os.getenv("SHARD_INDEX", "0")),
+            base_port=int(os.getenv("SHARD_BASE_PORT", "5101")),
+        )
+
+    @property
+    def enabled(self):
+        return self.count > 1
+
+    @property
+    def is_primary(self):
+        return self.index == 0
+
+    @property
+    def id_prefix(self):
+        """Prefix for ids this shard hands out (lets the router find the owner)."""
+        return f"s{self.index}-" if self.enabled else ""
+
+    def owns(self, jid):
+        return shard_of(jid, self.count) == self.index
+
+    def port(self, index):
+        return self.base_port + index
+
+    def data_dir(self, base_dir):
+        """Where this shard keeps its own files (base_dir when not sharded)."""
+        if not self.enabled:
+            return base_dir
+        return os.path.join(base_dir, "shards", str(self.index))
+
+
+def partition_memory(memory, owns):
+    """
+    Copy of a single-process memory dict keeping only the contacts `owns`
+    accepts. Global sections are copied as they are.
+    """
+    part = {}
+    for key, value in memory.items():
+        if key in PER_CONTACT_MAPS and isinstance(value, dict):
+            part[key] = {jid: v for jid, v in value.items() if owns(jid)}
+        elif key in PER_CONTACT_LISTS and isinstance(value, list):
+            part[key] = [v for v in value if not isinstance(v, dict) or owns(v.get("jid"))]
+        else:
+            part[key] = value
+    return part
+
+
+class GlobalReplica:
+    """
+    Replicates the global memory sections from the primary shard to the rest.
+    The primary calls publish() after saving; followers call refresh() (cheap:
+    one stat per `interval` seconds) before handling a request.
+    """
+
+    def __init__(self, path, memory, primary, sections=GLOBAL_SECTIONS, interval=1.0):
+        self.path = path
+        self.memory = memory
+        self.primary = primary
+        self.sections = tuple(sections)
+        self.interval = interval
+        self._published = None      # last blob written (primary)
+        self._mtime = None          # mtime of the last file loaded (followers)
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def _snapshot(self):
+        return {k: self.memory.get(k) for k in self.sections if k in self.memory}
+
+    def publish(self):
+        if not self.primary:
+            return False
+        snapshot = self._snapshot()
+        blob = json.dumps(snapshot, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            if blob == self._published:
+                return False
+            write_json_atomic(self.path, snapshot, target="globals", indent=2, ensure_ascii=False)
+            self._published = blob
+        return True
+
+    def sync(self):
+        """At startup: the primary publishes, followers load the shared copy."""
+        return self.publish() if self.primary else self.refresh(force=True)
+
+    def refresh(self, force=False):
+        if self.primary:
+            return False
+        now = time.monotonic()
+        if not force and now - self._checked < self.interval:
+            return False
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[ERROR] Could not reload shared globals: {e}")
+                return False
+            self._mtime = mtime
+            for k in self.sections:
+                if k in data:
+                    self.memory[k] = data[k]
+            self.reloads += 1
+        return True
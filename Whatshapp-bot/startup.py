@@ -0,0 +1,58 @@
+# startup.py
+"""
+Startup-time report: where does the time go between `python bot.py` and
+the first byte served? Stages are timed while bot.py imports; anything loaded
+lazily afterwards (OpenAI client, langid model, contact files) is recorded
+too so the cost shows up somewhere instead of hiding in the first request.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_T0 = time.perf_counter()
+
+
+class StartupReport:
+    def __init__(self):
+        self.stages = []      # [(name, seconds)] during import/startup
+        self.lazy = []        # [(name, seconds)] paid later, on first use
+        self.ready_at = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages.append((name, time.perf_counter() - t))
+
+    def record_lazy(self, name, seconds):
+        with self._lock:
+            self.lazy.append((name, seconds))
+
+    def ready(self):
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter() - _T0
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "ready_seconds": self.ready_at,
+                "stages": [{"name": n, "seconds": round(s, 4)} for n, s in self.stages],
+                "lazy": [{"name": n, "seconds": round(s, 4)} for n, s in self.lazy],
+            }
+
+    def render(self):
+        lines = ["⏱️  Startup report"]
+        for name, secs in self.stages:
+            lines.append(f"   {secs * 1000:8.1f} ms  {name}")
+        if self.ready_at is not None:
+            lines.append(f"   {self.ready_at * 1000:8.1f} ms  total until ready")
+        for name, secs in self.lazy:
+            lines.append(f"   {secs * 1000:8.1f} ms  (lazy) {name}")
+        return "\n".join(lines)
+
+
+startup_report = StartupReport()
@@ -0,0 +1,326 @@
+# storage.py
+"""
+Per-contact persistence for the brain.
+
+memory.json only keeps the small, global sections (settings, contact
+registry, queues, ...). Each contact's chat history and profile live in their
+own file under memory_contacts/ and are loaded the first time something asks
+for them, so startup cost no longer grows with the size of every history.
+
+The rest of bot.py keeps using memory["chat_history"] and
+memory["person_profiles"] like plain dicts: they are ContactFieldView
+objects backed by a single ContactStore.
+
+memory["chat_history"][jid] is only the hot tail of the conversation. When a
+contact is flushed with more than HOT_WINDOW + SEGMENT_SIZE messages, the
+oldest SEGMENT_SIZE-sized blocks are spilled to the cold archive (archive.py).
+Use iter_history() to read a whole conversation across both tiers. The
+segment is written before the contact file, and the contact file records
+how many messages were archived when it was written; a crash in between
+leaves the spilled messages in both, and loading trims them off the hot tail.
+
+Loaded histories are MessageLog objects (messagelog.py): a compact, columnar
+list-of-messages that callers use like the plain list it replaces.
+
+Contact files (and memory.json) are written in MEMORY_FORMAT and read in any
+format, see codec.py.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections.abc import MutableMapping
+from datetime import datetime
+
+import codec
+from messagelog import MessageLog, json_default
+from metrics import metrics
+
+# memory keys that are stored per contact instead of inside memory.json
+CONTACT_FIELDS = (
+    "chat_history",             # { jid: [ {role, content, ts} ] }
+    "person_profiles",          # { jid: {info, style, summary, ...} }
+)
+INDEX_KEY = "contacts_index"    # { jid: {file, fields, messages, last_ts} }
+
+HOT_WINDOW = 200        # messages always kept in memory per contact
+SEGMENT_SIZE = 500      # messages per cold archive segment
+
+
+def ts_epoch(ts):
+    """ISO timestamp -> epoch seconds (None if missing/unparseable)."""
+    try:
+        return datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def contact_key(jid: str) -> str:
+    """Filesystem-safe, collision-free name for a contact's file."""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", jid).strip("_")[:40] or "contact"
+    digest = hashlib.sha1(jid.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{digest}"
+
+
+def write_json_atomic(path, data, target=None, **dump_kwargs):
+    """
+    Write JSON to a temp file and swap it in, so a crash never truncates `path`.
+    Bytes written are counted under `target` (default: the file name).
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, **dump_kwargs)
+        size = f.tell()
+    os.replace(tmp, path)
+    target = target or os.path.basename(path)
+    metrics.inc("persist_bytes_total", size, target=target)
+    metrics.inc("persist_writes_total", target=target)
+
+
+def write_memory_atomic(path, data, target=None, default=None, fmt=None):
+    """write_json_atomic for memory files, in MEMORY_FORMAT (see codec.py)."""
+    raw = codec.encode(data, fmt, default=default)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+    os.replace(tmp, path)
+    target = target or os.path.basename(path)
+    metrics.inc("persist_bytes_total", len(raw), target=target)
+    metrics.inc("persist_writes_total", target=target)
+
+
+class ContactStore:
+    def __init__(self, root: str, index: dict, archive=None,
+                 hot_window=HOT_WINDOW, segment_size=SEGMENT_SIZE):
+        self.root = root
+        self.index = index          # lives inside memory.json (the "hot index")
+        self.archive = archive      # HistoryArchive for the cold tier (optional)
+        self.hot_window = hot_window
+        self.segment_size = segment_size
+        self._loaded = {}           # jid -> {field: value}
+        self._touched = set()       # loaded contacts to write on next flush
+        self._removed = {}          # jid -> file name to delete on next flush
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.load_seconds = 0.0
+
+    # ─── Loading ────────────────────────────────────────────────────
+    def _path(self, jid):
+        entry = self.index.get(jid)
+        name = entry["file"] if entry and entry.get("file") else contact_key(jid)
+        return os.path.join(self.root, name + ".json")
+
+    def _contact(self, jid, create=False, touch=False):
+        """Return the loaded record for jid (loading it on first access); touch: write it on next flush."""
+        with self._lock:
+            rec = self._loaded.get(jid)
+            if rec is None and jid in self.index:
+                t = time.perf_counter()
+                path = self._path(jid)
+                rec, archived = {}, None
+                if os.path.exists(path):
+                    data = codec.load(path)
+                    rec, archived = data.get("fields", {}), data.get("archived")
+                if "chat_history" in rec:
+                    rec["chat_history"] = MessageLog(rec["chat_history"])
+                self._loaded[jid] = rec
+                spilled = self.archived_count(jid) - archived if archived is not None else 0
+                if spilled > 0 and "chat_history" in rec:
+                    # crashed after archiving a segment but before rewriting this file
+                    del rec["chat_history"][:spilled]
+                    self._touched.add(jid)
+                self.loads += 1
+                self.load_seconds += time.perf_counter() - t
+            if rec is None and create:
+                rec = self._loaded[jid] = {}
+                self.index[jid] = {"file": contact_key(jid), "fields": []}
+                self._removed.pop(jid, None)
+            if rec is not None and (touch or create):
+                self._touched.add(jid)
+            return rec
+
+    def has(self, jid, field):
+        with self._lock:
+            rec = self._loaded.get(jid)
+            if rec is not None:
+                return field in rec
+            return field in self.index.get(jid, {}).get("fields", [])
+
+    def jids(self, field):
+        with self._lock:
+            return [jid for jid in list(self.index) if self.has(jid, field)]
+
+    def is_loaded(self, jid):
+        return jid in self._loaded
+
+    def touch(self, jid):
+        """Mark jid's record as changed (in place) so the next flush writes it."""
+        self._contact(jid, touch=True)
+
+    # ─── Field access ───────────────────────────────────────────────
+    def get(self, jid, field):
+        if not self.has(jid, field):
+            raise KeyError(jid)
+        return self._contact(jid)[field]
+
+    def set(self, jid, field, value):
+        with self._lock:
+            rec = self._contact(jid, create=True, touch=True)
+            if field == "chat_history" and not isinstance(value, MessageLog):
+                value = MessageLog(value)
+            rec[field] = value
+            fields = self.index[jid].setdefault("fields", [])
+            if field not in fields:
+                fields.append(field)
+
+    def delete(self, jid, field):
+        with self._lock:
+            if not self.has(jid, field):
+                raise KeyError(jid)
+            rec = self._contact(jid, touch=True)
+            rec.pop(field, None)
+            entry = self.index[jid]
+            entry["fields"] = [f for f in entry.get("fields", []) if f != field]
+            if field == "chat_history" and self.archive is not None:
+                self.archive.drop(jid)
+            if not rec:
+                self._loaded.pop(jid, None)
+                self._touched.discard(jid)
+                self.index.pop(jid, None)
+                self._removed[jid] = entry.get("file") or contact_key(jid)
+
+    # ─── History across tiers ───────────────────────────────────────
+    def archived_count(self, jid):
+        return self.archive.count(jid) if self.archive is not None else 0
+
+    def history_len(self, jid):
+        """Total messages for jid (cold + hot)."""
+        hot = self.get(jid, "chat_history") if self.has(jid, "chat_history") else []
+        return self.archived_count(jid) + len(hot)
+
+    def iter_positions(self, jid, start=0, since=None):
+        """
+        Stream (position, message) over the whole conversation, oldest first,
+        without materializing it. `since` (epoch seconds) lets readers skip
+        archive segments that are entirely older.
+        """
+        pos = start
+        while True:
+            if self.archive is not None:
+                archived_seen = self.archived_count(jid)
+                for p, m in self.archive.iter_messages(jid, start=pos, since=since):
+                    yield p, m
+                pos = max(pos, archived_seen)
+            with self._lock:
+                archived = self.archived_count(jid)
+                if pos < archived:
+                    continue  # a segment was spilled while we were reading
+                hot = list(self.get(jid, "chat_history")) if self.has(jid, "chat_history") else []
+            for i, m in enumerate(hot[pos - archived:], start=pos):
+                if since is not None:
+                    e = ts_epoch(m.get("ts"))
+                    if e is not None and e < since:
+                        continue
+                yield i, m
+            return
+
+    def iter_history(self, jid, start=0, since=None):
+        for _, m in self.iter_positions(jid, start=start, since=since):
+            yield m
+
+    def _spill(self, jid, hist):
+        """Move the oldest full segments of an over-long hot history to the archive."""
+        if self.archive is None:
+            return
+        while len(hist) > self.hot_window + self.segment_size:
+            self.archive.append_segment(jid, list(hist[:self.segment_size]))
+            del hist[:self.segment_size]
+
+    # ─── Persistence ────────────────────────────────────────────────
+    def flush(self):
+        """Write every contact touched since the last flush."""
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            for jid in list(self._touched):
+                rec = self._loaded.get(jid)
+                if rec is None:
+                    continue
+                entry = self.index.setdefault(jid, {"file": contact_key(jid)})
+                entry["fields"] = sorted(rec)
+                hist = rec.get("chat_history") or []
+                self._spill(jid, hist)
+                entry["messages"] = self.archived_count(jid) + len(hist)
+                entry["last_ts"] = hist[-1].get("ts") if hist else None
+                write_memory_atomic(
+                    self._path(jid), {"jid": jid, "archived": self.archived_count(jid), "fields": rec},
+                    target="contact", default=json_default
+                )
+            self._touched.clear()
+            for jid, name in list(self._removed.items()):
+                path = os.path.join(self.root, name + ".json")
+                if jid not in self.index and os.path.exists(path):
+                    os.remove(path)
+            self._removed.clear()
+
+    def adopt(self, field, mapping):
+        """Move a legacy inline section (from an old memory.json) into the store."""
+        for jid, value in (mapping or {}).items():
+            self.set(jid, field, value)
+
+
+class ContactFieldView(MutableMapping):
+    """
+    dict-like view of one per-contact field, e.g. memory["chat_history"].
+    Reading (view[jid], .get) doesn't mark the contact for writing; code
+    that changes a value in place gets it through setdefault(), which does.
+    """
+
+    def __init__(self, store: ContactStore, field: str):
+        self.store = store
+        self.field = field
+
+    def __getitem__(self, jid):
+        return self.store.get(jid, self.field)
+
+    def __setitem__(self, jid, value):
+        self.store.set(jid, self.field, value)
+
+    def __delitem__(self, jid):
+        self.store.delete(jid, self.field)
+
+    def __contains__(self, jid):
+        return self.store.has(jid, self.field)
+
+    def setdefault(self, jid, default=None):
+        # the store may convert the value (lists become MessageLogs); return what it kept
+        if not self.store.has(jid, self.field):
+            self.store.set(jid, self.field, default)
+        else:
+            self.store.touch(jid)   # callers append to / edit what they get back
+        return self.store.get(jid, self.field)
+
+    def __iter__(self):
+        return iter(self.store.jids(self.field))
+
+    def __len__(self):
+        return len(self.store.jids(self.field))
+
+    def __repr__(self):
+        return f"<ContactFieldView {self.field}: {len(self)} contacts>"
+
+
+def install_contact_views(memory: dict, store: ContactStore):
+    """Replace memory's per-contact sections with lazy views (migrating old data)."""
+    for field in CONTACT_FIELDS:
+        legacy = memory.get(field)
+        memory[field] = ContactFieldView(store, field)
+        if isinstance(legacy, dict) and legacy:
+            store.adopt(field, legacy)
+    return memory
+
+
+def core_sections(memory: dict) -> dict:
+    """The part of memory that belongs in memory.json."""
+    return {k: v for k, v in memory.items() if k not in CONTACT_FIELDS}
@@ -0,0 +1,161 @@
+# summaries.py
+"""
+Map-reduce conversation summaries with a chunk-level cache.
+
+A conversation is cut into fixed, position-aligned chunks (messages 0-49,
+50-99, ...). Each chunk is summarized once and cached by a hash of its
+content, so summarizing again only sends the chunks that changed since last
+time (normally just the newest, still-growing one) plus the reduce step.
+
+    map     chunk transcript            -> chunk summary   (cached)
+    merge   up to FAN_IN summaries      -> one summary     (cached; long chats only)
+    reduce  remaining summaries + the caller's prompt -> final text (cached)
+
+The three summary routes share one cache and only differ in their reduce prompt.
+The last finished summary per (contact, reduce prompt) is kept in the same
+file, so it can be served right away, also after a restart.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from storage import write_json_atomic
+
+CHUNK_SIZE = 50
+FAN_IN = 8
+MAX_ENTRIES = 5000
+
+MAP_PROMPT = (
+    "Summarize this part of a WhatsApp conversation between Julio (assistant) and a contact (user). "
+    "Keep names, personal details, facts, plans, preferences and the tone of the relationship. "
+    "Be concise; use short bullet points."
+)
+MERGE_PROMPT = (
+    "These are summaries of consecutive parts of one conversation, oldest first. "
+    "Merge them into one concise summary, keeping every personal detail, fact and plan; "
+    "when details conflict, prefer the later part."
+)
+
+
+def _digest(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def format_transcript(messages):
+    return "\n".join(f"{m.get('role')}: {m.get('content', '')}" for m in messages)
+
+
+class SummaryCache:
+    def __init__(self, path, complete, chunk_size=CHUNK_SIZE, fan_in=FAN_IN, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.complete = complete        # complete(system, user, max_tokens) -> text
+        self.chunk_size = chunk_size
+        self.fan_in = fan_in
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # hash -> summary, least recently used first
+        self._latest = {}               # key -> {hash of reduce prompt: last finished summary}
+        self._lock = threading.RLock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("chunk_size") == self.chunk_size:
+            self._entries.update(data.get("entries", {}))
+        self._latest.update(data.get("latest", {}))
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = {"chunk_size": self.chunk_size, "entries": dict(self._entries),
+                    "latest": {k: dict(v) for k, v in self._latest.items()}}
+        write_json_atomic(self.path, data, ensure_ascii=False)
+
+    # ─── Cached model calls ─────────────────────────────────────────
+    def _cached(self, system, user, max_tokens):
+        key = _digest(system, user)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        text = self.complete(system, user, max_tokens)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = text
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        return text
+
+    def chunks(self, positions):
+        """Group (position, message) pairs into position-aligned chunks."""
+        current, current_idx = [], None
+        for pos, msg in positions:
+            idx = pos // self.chunk_size
+            if idx != current_idx and current:
+                yield current
+                current = []
+            current_idx = idx
+            current.append(msg)
+        if current:
+            yield current
+
+    def summarize(self, positions, reduce_prompt, max_tokens=300, key=None):
+        """
+        Summarize a conversation given as (position, message) pairs
+        (ContactStore.iter_positions). Returns "" for an empty conversation.
+        With key (the contact), the result is also kept for latest().
+        """
+        text = self._summarize(positions, reduce_prompt, max_tokens)
+        if key is not None:
+            with self._lock:
+                self._latest.setdefault(key, {})[_digest(reduce_prompt)] = text
+                self._dirty = True
+        return text
+
+    def latest(self, key, reduce_prompt):
+        """The last summary finished for key with reduce_prompt ("" if none)."""
+        with self._lock:
+            return self._latest.get(key, {}).get(_digest(reduce_prompt), "")
+
+    def drop(self, key):
+        with self._lock:
+            if self._latest.pop(key, None) is not None:
+                self._dirty = True
+
+    def _summarize(self, positions, reduce_prompt, max_tokens):
+        partials = [
+            self._cached(MAP_PROMPT, format_transcript(chunk), 250)
+            for chunk in self.chunks(positions)
+        ]
+        if not partials:
+            return ""
+        # merge level by level until one reduce call can take them all
+        while len(partials) > self.fan_in:
+            partials = [
+                self._cached(MERGE_PROMPT, "\n\n---\n\n".join(partials[i:i + self.fan_in]), 400)
+                for i in range(0, len(partials), self.fan_in)
+            ]
+        body = "\n\n---\n\n".join(partials)
+        return self._cached(reduce_prompt, body, max_tokens)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
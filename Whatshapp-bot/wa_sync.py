@@ -0,0 +1,120 @@
+# wa_sync.py
+"""
+Incremental history sync from WhatsApp (the bridge's history_sync.js).
+
+Per contact, memory["synced_wa_ids"][jid] keeps a cursor (the WhatsApp
+timestamp of the newest message the brain knows about) and the ids of the
+most recent messages:
+
+    {"cursor": 1718031234, "ids": ["false_1555...@c.us_3EB0...", ...]}
+
+The bridge asks for the cursors, fetches each chat's messages from the
+cursor on and posts only those. Messages are deduplicated by WhatsApp id;
+messages the brain logged without an id (replies it sent, imports) are
+matched on role + text within DUP_WINDOW seconds. Live traffic notes ids
+too (/reply and /send_result), so a catch-up after downtime only carries
+what actually arrived while the bridge or the brain was down.
+"""
+from datetime import datetime, timezone
+
+from storage import ts_epoch
+
+KEEP_IDS = 500          # recent WhatsApp ids remembered per contact
+DUP_WINDOW = 600        # seconds: same role and text this close = same message
+
+
+def wa_ts_iso(ts):
+    """WhatsApp epoch seconds -> the ISO timestamps chat_history uses."""
+    return datetime.fromtimestamp(float(ts), timezone.utc).isoformat()
+
+
+class SyncLedger:
+    """Cursors and recent message ids per contact, kept in memory["synced_wa_ids"]."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def cursor(self, jid):
+        return (self.store.get(jid) or {}).get("cursor")
+
+    def seen(self, jid, wa_id):
+        return wa_id in (self.store.get(jid) or {}).get("ids", ())
+
+    def note(self, jid, wa_id, ts=None):
+        entry = self.store.setdefault(jid, {"cursor": None, "ids": []})
+        if wa_id and wa_id not in entry["ids"]:
+            entry["ids"].append(wa_id)
+            del entry["ids"][:-KEEP_IDS]
+        if ts is not None and (entry["cursor"] is None or ts > entry["cursor"]):
+            entry["cursor"] = ts
+
+    def drop(self, jid):
+        self.store.pop(jid, None)
+
+
+def select_new(jid, messages, ledger, tail, floor=None):
+    """
+    Messages from a bridge batch that aren't in history yet, oldest first, as
+    (wa_message, history_entry). `tail` is the recent history to match
+    id-less entries against; messages older than `floor` (epoch seconds)
+    are taken as already known.
+    """
+    recent = {}
+    for m in tail:
+        e = ts_epoch(m.get("ts"))
+        if e is not None:
+            recent.setdefault((m["role"], m["content"].strip()), []).append(e)
+
+    fresh = []
+    for msg in sorted(messages, key=lambda m: m.get("ts") or 0):
+        wa_id, body = msg.get("id"), (msg.get("body") or "").strip()
+        if not body or (wa_id and ledger.seen(jid, wa_id)):
+            continue
+        role = "assistant" if msg.get("fromMe") else "user"
+        ts = float(msg.get("ts") or 0)
+        if floor is not None and ts < floor:
+            ledger.note(jid, wa_id)
+            continue
+        if any(abs(e - ts) <= DUP_WINDOW for e in recent.get((role, body), ())):
+            ledger.note(jid, wa_id, ts)     # same message, logged before it had an id
+            continue
+        fresh.append((msg, {"role": role, "content": body, "ts": wa_ts_iso(ts)}))
+    return fresh
+
+
+def insert_by_ts(history, entry):
+    """
+    Put entry into history (oldest first) after every message that isn't
+    newer; True if it went at the end. Synced messages can be older than
+    what live traffic logged while the sync was running.
+    """
+    ts = ts_epoch(entry["ts"])
+    i = len(history)
+    while i > 0:
+        e = ts_epoch(history[i - 1].get("ts"))
+        if e is None or e <= ts:
+            break
+        i -= 1
+    if i == len(history):
+        history.append(entry)
+        return True
+    history.insert(i, entry)
+    return False
+
+
+def answered_after(history, content, tail=50):
+    """True if we sent something after the latest inbound `content` in the last `tail` messages."""
+    content = content.strip()
+    recent = history[-tail:]
+    for i in range(len(recent) - 1, -1, -1):
+        m = recent[i]
+        if m["role"] == "user" and m["content"].strip() == content:
+            return any(n["role"] == "assistant" for n in recent[i + 1:])
+    return False
+
+
+def missed_since_reply(history, entries):
+    """The inbound entries newer than the last message we sent (oldest first)."""
+    last_reply = next((ts_epoch(m.get("ts")) for m in reversed(history) if m["role"] == "assistant"), None)
+    return [m for m in entries
+            if m["role"] == "user" and (last_reply is None or (ts_epoch(m["ts"]) or 0) > last_reply)]